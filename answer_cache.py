@@ -0,0 +1,162 @@
+import atexit
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+class SemanticAnswerCache:
+    """
+    Answer cache keyed by query embedding.
+    A question whose embedding is within `threshold` cosine similarity of a cached question
+    (asked with the same search parameters) returns the stored answer and contexts.
+    Entries expire after `ttl` seconds, the least recently used entry is evicted above
+    `max_entries`, and the whole cache is dropped when the index version changes.
+    New entries are written to `path` at most every `save_interval` seconds and at exit.
+    """
+    def __init__(self, threshold=0.95, max_entries=1000, ttl=86400, path=None, save_interval=60):
+        self.threshold = threshold
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.path = path
+        self.save_interval = save_interval
+        self.lock = threading.Lock()
+        self.save_lock = threading.Lock()
+        self.entries = OrderedDict()  # id -> entry, in the order of the rows of self.matrix
+        self.recency = OrderedDict()  # ids, least recently used first (a hit does not move matrix rows)
+        self.next_id = 0
+        self.index_version = None
+        self.hits = 0
+        self.misses = 0
+        self.matrix = None  # normalized vectors of self.entries, rebuilt lazily after a store or an eviction
+        self.row_ids = []
+        self.dirty = False
+        self.saved_at = time.time()
+        if path and os.path.exists(path):
+            self.load()
+        if path:
+            atexit.register(self.flush)
+
+    @staticmethod
+    def _normalize(vector):
+        vector = np.asarray(vector, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm else vector
+
+    def _expire(self):
+        if not self.ttl:
+            return
+        now = time.time()
+        expired = [entry_id for entry_id, entry in self.entries.items() if now - entry["created"] > self.ttl]
+        for entry_id in expired:
+            del self.entries[entry_id]
+            del self.recency[entry_id]
+        if expired:
+            self.matrix = None
+            self.dirty = True
+
+    def invalidate_if_stale(self, index_version):
+        """
+        Clear the cache when the vector index was rebuilt since the answers were stored
+        """
+        with self.lock:
+            if index_version != self.index_version:
+                if self.entries:
+                    print("Answer cache: index changed, cache cleared")
+                self.entries.clear()
+                self.recency.clear()
+                self.matrix = None
+                self.index_version = index_version
+                self.dirty = True
+
+    def lookup(self, vector, params):
+        """
+        Return the cached entry ({"question", "answer", "contexts", ...}) closest to vector, or None
+        """
+        with self.lock:
+            self._expire()
+            if self.entries:
+                if self.matrix is None:
+                    self.matrix = np.stack([entry["vector"] for entry in self.entries.values()])
+                    self.row_ids = list(self.entries)
+                similarities = self.matrix @ self._normalize(vector)
+                ids = self.row_ids
+                for i in np.argsort(-similarities):
+                    if similarities[i] < self.threshold:
+                        break
+                    entry = self.entries[ids[i]]
+                    if entry["params"] == list(params):
+                        self.recency.move_to_end(ids[i])
+                        self.hits += 1
+                        return entry
+            self.misses += 1
+            return None
+
+    def store(self, question, vector, params, answer, contexts):
+        with self.lock:
+            self.entries[self.next_id] = {
+                "question": question,
+                "vector": self._normalize(vector),
+                "params": list(params),
+                "answer": answer,
+                "contexts": list(contexts),
+                "created": time.time(),
+            }
+            self.recency[self.next_id] = None
+            self.next_id += 1
+            while len(self.entries) > self.max_entries:
+                oldest, _ = self.recency.popitem(last=False)
+                del self.entries[oldest]
+            self.matrix = None
+            self.dirty = True
+            due = self.path and time.time() - self.saved_at >= self.save_interval
+        if due:
+            self.save()
+
+    def flush(self):
+        """
+        Save the cache if it changed since the last save
+        """
+        if self.path and self.dirty:
+            self.save()
+
+    def save(self):
+        """
+        Persist the cache to self.path (JSON), least recently used entry first.
+        The entries are collected under the lock, lookups do not wait for the file to be written.
+        """
+        with self.lock:
+            entries = [self.entries[entry_id] for entry_id in self.recency]
+            index_version = self.index_version
+            self.dirty = False
+            self.saved_at = time.time()
+        with self.save_lock:
+            data = {
+                "index_version": index_version,
+                "entries": [{**entry, "vector": entry["vector"].tolist()} for entry in entries],
+            }
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.path)
+
+    def load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            data = json.load(f)
+        self.index_version = data.get("index_version")
+        for entry in data.get("entries", []):
+            entry["vector"] = np.asarray(entry["vector"], dtype=np.float32)
+            self.entries[self.next_id] = entry
+            self.recency[self.next_id] = None
+            self.next_id += 1
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "entries": len(self.entries),
+        }
@@ -0,0 +1,175 @@
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+PAGE_SIZE = 100
+
+
+def rich_text(text):
+    return {"rich_text": [{"type": "text", "text": {"content": text}, "plain_text": text}]}
+
+
+def synthetic_workspace(n_pages, blocks_per_page=40, seed=0):
+    """
+    Generate {page_id: {"title", "last_edited_time", "blocks"}} with nested lists and tables,
+    in the same layout as the crawler's sync cache (children nested under "children").
+    """
+    rng = random.Random(seed)
+    words = ["notion", "lake", "stars", "course", "price", "warsaw", "university", "accommodation",
+             "exam", "schedule", "python", "embedding", "budget", "travel", "spirit", "village"]
+
+    def sentence():
+        return " ".join(rng.choice(words) for _ in range(rng.randint(6, 20))) + "."
+
+    workspace = {}
+    for p in range(n_pages):
+        blocks = []
+        for b in range(blocks_per_page):
+            block_id = f"p{p}-b{b}"
+            kind = rng.random()
+            if kind < 0.1:
+                block = {"id": block_id, "type": "heading_2", "has_children": False, "heading_2": rich_text(sentence())}
+            elif kind < 0.2:
+                children = [{"id": f"{block_id}-c{c}", "type": "bulleted_list_item", "has_children": False,
+                             "bulleted_list_item": rich_text(sentence())} for c in range(3)]
+                block = {"id": block_id, "type": "bulleted_list_item", "has_children": True,
+                         "bulleted_list_item": rich_text(sentence()), "children": children}
+            elif kind < 0.25:
+                rows = [{"id": f"{block_id}-r{r}", "type": "table_row", "has_children": False,
+                         "table_row": {"cells": [[{"text": {"content": rng.choice(words)}}], [{"text": {"content": str(r)}}]]}}
+                        for r in range(5)]
+                block = {"id": block_id, "type": "table", "has_children": True, "table": {}, "children": rows}
+            else:
+                block = {"id": block_id, "type": "paragraph", "has_children": False, "paragraph": rich_text(sentence())}
+            block["last_edited_time"] = "2024-12-28T00:00:00.000Z"
+            blocks.append(block)
+        workspace[f"page-{p}"] = {"title": f"Page {p}", "last_edited_time": "2024-12-28T00:00:00.000Z", "blocks": blocks}
+    return workspace
+
+
+class FakeNotionServer:
+    """
+    Local HTTP server answering the Notion endpoints used by the crawler
+    (GET /v1/pages/{id}, paginated GET /v1/blocks/{id}/children, POST /v1/search and
+    POST /v1/databases/{id}/query) from recorded block trees. A page may have a "parent"
+    (Notion parent object, workspace by default); databases maps database id -> its parent.
+    latency adds a fixed delay to every request to imitate the network round trip.
+    error_rate answers that fraction of the requests with a 429 (Retry-After: retry_after) or a 503.
+    """
+    def __init__(self, workspace, latency=0.0, host="127.0.0.1", port=0, error_rate=0.0, retry_after=0, seed=0,
+                 databases=None):
+        self.latency = latency
+        self.error_rate = error_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.requests = 0
+        self.errors = 0
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.children = {}
+        for page_id, page in workspace.items():
+            self.pages[page_id] = {
+                "object": "page",
+                "id": page_id,
+                "last_edited_time": page["last_edited_time"],
+                "parent": page.get("parent", {"type": "workspace", "workspace": True}),
+                "properties": {"title": {"type": "title", "title": [{"plain_text": page["title"]}]}},
+            }
+            self._add_children(page_id, page["blocks"])
+        self.databases = [{"object": "database", "id": database_id, "parent": parent}
+                          for database_id, parent in (databases or {}).items()]
+        self.server = ThreadingHTTPServer((host, port), self._handler())
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    def _add_children(self, parent_id, blocks):
+        self.children[parent_id] = [{key: value for key, value in block.items() if key != "children"} for block in blocks]
+        for block in blocks:
+            if "children" in block:
+                self._add_children(block["id"], block["children"])
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def send_json(self, status, body, headers=None):
+                data = json.dumps(body).encode("utf-8")
+                self.send_response(status)
+                for key, value in (headers or {}).items():
+                    self.send_header(key, value)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                with fake.lock:
+                    fake.requests += 1
+                    error = fake.rng.random() < fake.error_rate
+                    if error:
+                        fake.errors += 1
+                        status = fake.rng.choice([429, 503])
+                if fake.latency:
+                    time.sleep(fake.latency)
+                if error and status == 429:
+                    return self.send_json(429, {"object": "error", "status": 429, "code": "rate_limited"},
+                                          {"Retry-After": str(fake.retry_after)})
+                if error:
+                    return self.send_json(503, {"object": "error", "status": 503, "code": "service_unavailable"})
+                url = urlparse(self.path)
+                parts = url.path.strip("/").split("/")
+                if len(parts) == 3 and parts[1] == "pages" and parts[2] in fake.pages:
+                    return self.send_json(200, fake.pages[parts[2]])
+                if len(parts) == 4 and parts[1] == "blocks" and parts[3] == "children":
+                    results = fake.children.get(parts[2], [])
+                    start = int(parse_qs(url.query).get("start_cursor", ["0"])[0])
+                    end = start + PAGE_SIZE
+                    return self.send_json(200, {
+                        "object": "list",
+                        "results": results[start:end],
+                        "has_more": end < len(results),
+                        "next_cursor": str(end) if end < len(results) else None,
+                    })
+                return self.send_json(404, {"object": "error", "status": 404, "message": "not found"})
+
+            def do_POST(self):
+                with fake.lock:
+                    fake.requests += 1
+                if fake.latency:
+                    time.sleep(fake.latency)
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                parts = urlparse(self.path).path.strip("/").split("/")
+                if parts[1:] == ["search"]:
+                    results = list(fake.pages.values()) + fake.databases
+                elif len(parts) == 4 and parts[1] == "databases" and parts[3] == "query":
+                    results = [page for page in fake.pages.values() if page["parent"].get("database_id") == parts[2]]
+                else:
+                    return self.send_json(404, {"object": "error", "status": 404, "message": "not found"})
+                start = int(body.get("start_cursor") or 0)
+                end = start + min(body.get("page_size", PAGE_SIZE), PAGE_SIZE)
+                return self.send_json(200, {
+                    "object": "list",
+                    "results": results[start:end],
+                    "has_more": end < len(results),
+                    "next_cursor": str(end) if end < len(results) else None,
+                })
+
+        return Handler
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
@@ -0,0 +1,265 @@
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+import numpy as np
+
+# offline: no telemetry, and Embedding only checks that a key is set
+os.environ.setdefault("ANONYMIZED_TELEMETRY", "False")
+os.environ.setdefault("HUGGING_FACE_API_KEY", "offline-benchmark")
+
+# langchain
+from langchain_core.embeddings import Embeddings
+
+# import my class
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.append(ROOT)
+sys.path.append(os.path.join(ROOT, "notion-api"))
+import retrieve_data  # noqa: E402
+from bm25 import tokenize  # noqa: E402
+from context_packing import count_tokens  # noqa: E402
+from embedding import Embedding, JSONHandler  # noqa: E402
+from llm import RAGApp  # noqa: E402
+from fake_notion import FakeNotionServer, synthetic_workspace  # noqa: E402
+from llm_backends import LocalLlamaLLM, StubLLM  # noqa: E402
+
+
+class HashEncoder(Embeddings):
+    """
+    Offline stand-in for the sentence-transformers encoder (hashed bag of words, no model download).
+    Exposes the same close()/report() and counters as embedding.BatchEncoder.
+    """
+    def __init__(self, dim=384):
+        self.dim = dim
+        self.chunks = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def _vector(self, text):
+        vector = np.zeros(self.dim, dtype=np.float32)
+        tokens = tokenize(text)
+        for token in tokens:
+            vector[int(hashlib.md5(token.encode("utf-8")).hexdigest()[:8], 16) % self.dim] += 1.0
+        norm = np.linalg.norm(vector)
+        return (vector / norm if norm else vector).tolist(), len(tokens)
+
+    def embed_documents(self, texts):
+        start = time.perf_counter()
+        results = [self._vector(text) for text in texts]
+        self.seconds += time.perf_counter() - start
+        self.chunks += len(results)
+        self.tokens += sum(n for _, n in results)
+        return [vector for vector, _ in results]
+
+    def embed_query(self, text):
+        return self._vector(text)[0]
+
+    def close(self):
+        pass
+
+    def report(self):
+        pass
+
+
+class BenchmarkEmbedding(Embedding):
+    """
+    Embedding with the offline HashEncoder unless a real model name is given.
+    """
+    def __init__(self, *args, offline=True, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.offline = offline
+
+    def create_embeddings(self):
+        if not self.offline:
+            return super().create_embeddings()
+        self.encoder = HashEncoder()
+        return self.encoder
+
+
+def percentiles(values):
+    values = np.asarray(values, dtype=np.float64) * 1000.0
+    return {
+        "p50_ms": float(np.percentile(values, 50)),
+        "p95_ms": float(np.percentile(values, 95)),
+        "p99_ms": float(np.percentile(values, 99)),
+        "mean_ms": float(values.mean()),
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def bench_crawl(workspace, args):
+    """
+    Crawl the fake Notion server; return (metrics, {page_id: text})
+    """
+    server = FakeNotionServer(workspace, latency=args.http_latency).start()
+    try:
+        metrics = {}
+        contents = {}
+        for name, workers in (("sequential", 1), ("concurrent", args.crawl_workers)):
+            server.requests = 0
+            start = time.perf_counter()
+            pages = retrieve_data.crawl_pages(list(workspace), {}, f"{server.url}/blocks",
+                                              max_workers=workers, requests_per_second=0)
+            seconds = time.perf_counter() - start
+            metrics[name] = {
+                "workers": workers,
+                "seconds": seconds,
+                "requests": server.requests,
+                "pages_per_s": len(pages) / seconds,
+                "requests_per_s": server.requests / seconds,
+            }
+            # keyed by page id like the corpus snapshot (titles are not unique)
+            contents = {page_id: full_text for page_id, _, _, full_text in pages}
+        return metrics, contents
+    finally:
+        server.stop()
+
+
+def bench_ingest(contents, db_dir, args):
+    """
+    Chunk, embed and index the crawled contents
+    """
+    embedding_handler = BenchmarkEmbedding(
+        embedding_model_name=args.model or "hash",
+        persist_directory=db_dir,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.overlap,
+        backend=args.backend,
+        bm25=args.search_type == "hybrid",
+        dedup={"enabled": True, "threshold": args.dedup_threshold} if args.dedup_threshold else None,
+        offline=args.model is None,
+    )
+    documents = JSONHandler.create_documents_from_json(contents)
+
+    start = time.perf_counter()
+    cleaned_docs = embedding_handler.split_and_clean_documents(documents)
+    chunk_seconds = time.perf_counter() - start
+
+    start = time.perf_counter()
+    embedding_handler.persist(cleaned_docs)
+    persist_seconds = time.perf_counter() - start
+    encoder = embedding_handler.encoder
+    encode_seconds = encoder.seconds or 1e-9
+
+    return {
+        "chunk": {"chunks": len(cleaned_docs), "seconds": chunk_seconds, "chunks_per_s": len(cleaned_docs) / chunk_seconds},
+        "embed": {"chunks": encoder.chunks, "tokens": encoder.tokens, "seconds": encoder.seconds,
+                  "chunks_per_s": encoder.chunks / encode_seconds, "tokens_per_s": encoder.tokens / encode_seconds},
+        "index": {"backend": args.backend, "build_seconds": persist_seconds - encoder.seconds},
+        "dedup": embedding_handler.dedup_stats,
+    }, cleaned_docs, embedding_handler.encoder
+
+
+def bench_query(db_dir, cleaned_docs, encoder, args):
+    """
+    Per-stage query latency with the stub LLM (the LLM is streamed, so its time to first token
+    is reported separately), and the mean prompt size in tokens
+    """
+    if args.local_model:
+        llm = LocalLlamaLLM(model_path=args.local_model, max_tokens=64)
+    else:
+        llm = StubLLM(first_token_latency=args.llm_latency, token_latency=args.token_latency)
+    vector_store = "numpy" if args.backend == "numpy" else "chroma"
+    app = RAGApp(args.model or "hash", "stub", 0, llm=llm, embedding_function=encoder,
+                 persist_directory=db_dir, vector_store=vector_store, context_token_budget=args.context_token_budget)
+    rng = np.random.default_rng(0)
+    questions = [" ".join(cleaned_docs[i].page_content.split()[:8]) for i in rng.integers(0, len(cleaned_docs), args.queries)]
+
+    stages = {"embed_query": [], "retrieve": [], "prompt": [], "llm_ttft": [], "llm": [], "total": []}
+    prompt_tokens = []
+    for question in questions:
+        t0 = time.perf_counter()
+        vector = app.embedding_function.embed_query(question)
+        t1 = time.perf_counter()
+        docs = app.__retrieve__(question, args.search_type, args.k, args.fetch_k, vector)
+        t2 = time.perf_counter()
+        docs, _ = app.__pack__(question, docs)
+        formatted_input = app.prompt.format(context=app.__format_docs__(docs), question=question)
+        t3 = time.perf_counter()
+        prompt_tokens.append(count_tokens(formatted_input))
+        first_token = None
+        for _ in app.llm.stream(formatted_input):
+            if first_token is None:
+                first_token = time.perf_counter()
+        t4 = time.perf_counter()
+        for stage, seconds in (("embed_query", t1 - t0), ("retrieve", t2 - t1), ("prompt", t3 - t2),
+                               ("llm_ttft", (first_token or t4) - t3), ("llm", t4 - t3), ("total", t4 - t0)):
+            stages[stage].append(seconds)
+    return {stage: percentiles(values) for stage, values in stages.items()}, float(np.mean(prompt_tokens))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline end-to-end latency benchmark")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 50, 200], help="number of synthetic pages")
+    parser.add_argument("--blocks-per-page", type=int, default=40)
+    parser.add_argument("--workspace", help="recorded block trees (e.g. notion-api/notion_cache.json)")
+    parser.add_argument("--http-latency", type=float, default=0.02, help="fake Notion round trip (s)")
+    parser.add_argument("--crawl-workers", type=int, default=8)
+    parser.add_argument("--model", help="sentence-transformers model (default: offline hash encoder)")
+    parser.add_argument("--chunk-size", type=int, default=1024)
+    parser.add_argument("--overlap", type=int, default=100)
+    parser.add_argument("--backend", default="chroma", choices=["chroma", "numpy"])
+    parser.add_argument("--dedup-threshold", type=float, help="collapse near-duplicate chunks (default: off)")
+    parser.add_argument("--search-type", default="mmr", choices=["similarity", "mmr", "hybrid"])
+    parser.add_argument("--k", type=int, default=4)
+    parser.add_argument("--fetch-k", type=int, default=20)
+    parser.add_argument("--queries", type=int, default=50)
+    parser.add_argument("--context-token-budget", type=int, help="context packing budget (default: every chunk in full)")
+    parser.add_argument("--llm-latency", type=float, default=0.05, help="stub LLM time to first token (s)")
+    parser.add_argument("--token-latency", type=float, default=0.002, help="stub LLM time per token (s)")
+    parser.add_argument("--local-model", help="GGUF model run with llama.cpp instead of the stub LLM")
+    parser.add_argument("--output-dir", default=os.path.join(ROOT, "benchmark", "results"))
+    args = parser.parse_args()
+
+    if args.workspace:
+        with open(args.workspace, "r", encoding="utf-8") as f:
+            recorded = json.load(f)
+        workspaces = [recorded.get("pages", recorded)]
+    else:
+        workspaces = [synthetic_workspace(size, args.blocks_per_page) for size in args.sizes]
+
+    results = []
+    for workspace in workspaces:
+        db_dir = tempfile.mkdtemp(prefix="rag-bench-")
+        try:
+            crawl, contents = bench_crawl(workspace, args)
+            ingest, cleaned_docs, encoder = bench_ingest(contents, db_dir, args)
+            query, prompt_tokens = bench_query(db_dir, cleaned_docs, encoder, args)
+        finally:
+            shutil.rmtree(db_dir, ignore_errors=True)
+        results.append({"pages": len(workspace), "crawl": crawl, **ingest, "query": query, "prompt_tokens": prompt_tokens})
+
+        print(f"--- {len(workspace)} pages, {ingest['chunk']['chunks']} chunks ---")
+        for name, metrics in crawl.items():
+            print(f"crawl ({name}): {metrics['pages_per_s']:.1f} pages/s, {metrics['requests_per_s']:.1f} requests/s")
+        print(f"chunk: {ingest['chunk']['chunks_per_s']:.1f} chunks/s")
+        print(f"embed: {ingest['embed']['chunks_per_s']:.1f} chunks/s, {ingest['embed']['tokens_per_s']:.1f} tokens/s")
+        print(f"index build: {ingest['index']['build_seconds']:.3f}s")
+        for stage, metrics in query.items():
+            print(f"query {stage}: p50 {metrics['p50_ms']:.2f}ms, p95 {metrics['p95_ms']:.2f}ms, "
+                  f"p99 {metrics['p99_ms']:.2f}ms")
+        print(f"prompt: {prompt_tokens:.0f} tokens on average")
+
+    # machine-readable results for comparisons across commits
+    commit = git_commit()
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_file = os.path.join(args.output_dir, f"{datetime.now().strftime('%Y-%m-%d_%H-%M-%S')}_{commit}.json")
+    with open(output_file, "w", encoding="utf-8") as f:
+        json.dump({"commit": commit, "args": vars(args), "results": results}, f, indent=4)
+    print(f"Results saved to {output_file}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+import json
+import os
+import re
+import numpy as np
+
+# langchain
+from langchain.schema import Document
+
+TOKEN_PATTERN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Lowercase word tokens (keeps numbers and identifiers such as course codes intact).
+    """
+    return TOKEN_PATTERN.findall(text.lower())
+
+
+class BM25Index:
+    """
+    Compact inverted index with BM25 scoring.
+    Postings are kept in CSR layout: the documents containing term t are
+    doc_ids[offsets[t]:offsets[t + 1]] with term frequencies in tfs.
+    Files: bm25.npz, vocab.json and docs.jsonl.
+    """
+    def __init__(self, vocab, offsets, doc_ids, tfs, doc_lengths, docs, k1=1.5, b=0.75):
+        self.vocab = vocab
+        self.offsets = offsets
+        self.doc_ids = doc_ids
+        self.tfs = tfs
+        self.doc_lengths = doc_lengths
+        self.docs = docs
+        self.k1 = k1
+        self.b = b
+        self.avg_length = float(doc_lengths.mean()) if len(doc_lengths) else 0.0
+
+    @staticmethod
+    def index_arrays(docs):
+        """
+        (vocab, offsets, doc_ids, tfs, doc_lengths) of an iterable of documents, read once.
+        """
+        postings = {}
+        doc_lengths = []
+        for doc_id, doc in enumerate(docs):
+            tokens = tokenize(doc.page_content)
+            doc_lengths.append(len(tokens))
+            counts = {}
+            for token in tokens:
+                counts[token] = counts.get(token, 0) + 1
+            for token, count in counts.items():
+                postings.setdefault(token, []).append((doc_id, count))
+
+        vocab = {term: i for i, term in enumerate(sorted(postings))}
+        offsets = np.zeros(len(vocab) + 1, dtype=np.int64)
+        doc_ids, tfs = [], []
+        for term, i in vocab.items():
+            for doc_id, count in postings[term]:
+                doc_ids.append(doc_id)
+                tfs.append(count)
+            offsets[i + 1] = len(doc_ids)
+        return (vocab, offsets, np.array(doc_ids, dtype=np.int32), np.array(tfs, dtype=np.int32),
+                np.array(doc_lengths, dtype=np.int32))
+
+    @classmethod
+    def build(cls, docs):
+        """
+        Build the index from the cleaned chunk documents.
+        """
+        docs = list(docs)
+        return cls(*cls.index_arrays(docs), docs)
+
+    @classmethod
+    def write(cls, directory, docs):
+        """
+        Build and save the index of an iterable of documents (e.g. read from Chroma in pages)
+        without keeping them in memory: each document goes straight into docs.jsonl.
+        Return (documents, terms).
+        """
+        os.makedirs(directory, exist_ok=True)
+        docs_path = os.path.join(directory, "docs.jsonl")
+        with open(f"{docs_path}.tmp", "w", encoding="utf-8") as f:
+            def written():
+                for doc in docs:
+                    f.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False) + "\n")
+                    yield doc
+            vocab, offsets, doc_ids, tfs, doc_lengths = cls.index_arrays(written())
+        cls.save_arrays(directory, vocab, offsets, doc_ids, tfs, doc_lengths)
+        os.replace(f"{docs_path}.tmp", docs_path)
+        return len(doc_lengths), len(vocab)
+
+    @staticmethod
+    def save_arrays(directory, vocab, offsets, doc_ids, tfs, doc_lengths):
+        # files are replaced rather than rewritten, they may be hard links into a published index version
+        arrays_path = os.path.join(directory, "bm25.npz")
+        with open(f"{arrays_path}.tmp", "wb") as f:
+            np.savez_compressed(f, offsets=offsets, doc_ids=doc_ids, tfs=tfs, doc_lengths=doc_lengths)
+        os.replace(f"{arrays_path}.tmp", arrays_path)
+        vocab_path = os.path.join(directory, "vocab.json")
+        with open(f"{vocab_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(vocab, f, ensure_ascii=False)
+        os.replace(f"{vocab_path}.tmp", vocab_path)
+
+    def save(self, directory):
+        os.makedirs(directory, exist_ok=True)
+        self.save_arrays(directory, self.vocab, self.offsets, self.doc_ids, self.tfs, self.doc_lengths)
+        docs_path = os.path.join(directory, "docs.jsonl")
+        with open(f"{docs_path}.tmp", "w", encoding="utf-8") as f:
+            for doc in self.docs:
+                f.write(json.dumps({"page_content": doc.page_content, "metadata": doc.metadata}, ensure_ascii=False) + "\n")
+        os.replace(f"{docs_path}.tmp", docs_path)
+
+    @classmethod
+    def load(cls, directory):
+        if not os.path.exists(os.path.join(directory, "bm25.npz")):
+            raise FileNotFoundError(f"BM25 index not found: {directory}")
+        arrays = np.load(os.path.join(directory, "bm25.npz"))
+        with open(os.path.join(directory, "vocab.json"), "r", encoding="utf-8") as f:
+            vocab = json.load(f)
+        docs = []
+        with open(os.path.join(directory, "docs.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                docs.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+        return cls(vocab, arrays["offsets"], arrays["doc_ids"], arrays["tfs"], arrays["doc_lengths"], docs)
+
+    def scores(self, query):
+        """
+        BM25 score of every document for the query.
+        """
+        scores = np.zeros(len(self.docs), dtype=np.float32)
+        n_docs = len(self.docs)
+        for token in set(tokenize(query)):
+            term = self.vocab.get(token)
+            if term is None:
+                continue
+            start, end = self.offsets[term], self.offsets[term + 1]
+            doc_ids, tfs = self.doc_ids[start:end], self.tfs[start:end]
+            idf = np.log(1 + (n_docs - len(doc_ids) + 0.5) / (len(doc_ids) + 0.5))
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_ids] / self.avg_length)
+            scores[doc_ids] += idf * tfs * (self.k1 + 1) / (tfs + norm)
+        return scores
+
+    def search(self, query, k=4):
+        """
+        Return the top k (document, score) pairs with a positive score.
+        """
+        scores = self.scores(query)
+        k = min(k, int((scores > 0).sum()))
+        if k <= 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [(self.docs[i], float(scores[i])) for i in top]
+
+
+def fuse_scores(vector_results, lexical_results, k=4, alpha=0.5):
+    """
+    Hybrid ranking: min-max normalize both score lists and combine them as
+    alpha * vector + (1 - alpha) * lexical. Documents are matched by chunk_id.
+    """
+    def normalized(results):
+        if not results:
+            return {}
+        values = np.array([score for _, score in results], dtype=np.float32)
+        low, spread = values.min(), values.max() - values.min()
+        return {
+            doc.metadata.get("chunk_id", doc.page_content): (doc, (score - low) / spread if spread > 0 else 1.0)
+            for doc, score in results
+        }
+
+    vector_scores = normalized(vector_results)
+    lexical_scores = normalized(lexical_results)
+    fused = []
+    for key in list(vector_scores) + [key for key in lexical_scores if key not in vector_scores]:
+        doc = (vector_scores.get(key) or lexical_scores.get(key))[0]
+        score = alpha * vector_scores.get(key, (None, 0.0))[1] + (1 - alpha) * lexical_scores.get(key, (None, 0.0))[1]
+        fused.append((score, doc))
+    fused.sort(key=lambda item: -item[0])
+    return [doc for _, doc in fused[:k]]
@@ -0,0 +1,126 @@
+import re
+
+# langchain
+from langchain.schema import Document
+
+from bm25 import tokenize
+
+SENTENCE_PATTERN = re.compile(r"(?<=[.!?。])\s+")
+MIN_OVERLAP_WORDS = 3
+WINDOW_WORDS = 40
+
+
+def count_tokens(text):
+    """
+    Approximate prompt tokens as word tokens (the LLM tokenizer runs remotely).
+    """
+    return len(tokenize(text))
+
+
+def split_sentences(text):
+    return [sentence.strip() for sentence in SENTENCE_PATTERN.split(text) if sentence.strip()]
+
+
+def boundary_overlap(first, second):
+    """
+    Number of words at the end of first repeated at the start of second (at least MIN_OVERLAP_WORDS, else 0)
+    """
+    for size in range(min(len(first), len(second)), MIN_OVERLAP_WORDS - 1, -1):
+        if first[-size:] == second[:size]:
+            return size
+    return 0
+
+
+def trim_overlap(words, earlier):
+    """
+    Drop the words of a chunk that repeat the boundary of an earlier chunk of the same page:
+    the chunk_overlap region at its start (it follows that chunk) or at its end (it precedes it).
+    """
+    start, end = 0, len(words)
+    for previous in earlier:
+        start = max(start, boundary_overlap(previous, words))
+        end = min(end, len(words) - boundary_overlap(words, previous))
+    return words[start:max(start, end)]
+
+
+def word_windows(text, size):
+    words = text.split()
+    return [" ".join(words[i:i + size]) for i in range(0, len(words), size)]
+
+
+class ContextPacker:
+    """
+    Pack retrieved chunks into a prompt context of at most `token_budget` tokens.
+    Chunks are taken in relevance order (the retriever order). Words repeating the boundary of
+    an earlier chunk of the same page (the chunk_overlap region) and sentences already present
+    in an earlier chunk are dropped. A chunk that fits the remaining budget is kept whole,
+    otherwise only its sentences sharing the most words with the question are kept, in their
+    original order. Notion lines are joined without punctuation, so a "sentence" longer than
+    the remaining budget is split into word windows first.
+    """
+    def __init__(self, token_budget):
+        self.token_budget = token_budget
+
+    @staticmethod
+    def relevance(sentence_tokens, question_tokens):
+        if not sentence_tokens:
+            return 0.0
+        return len(question_tokens.intersection(sentence_tokens)) / len(set(sentence_tokens)) ** 0.5
+
+    def pack(self, question, docs):
+        """
+        Return (packed documents, stats) where stats has original_tokens, packed_tokens,
+        saved_tokens and dropped_chunks.
+        """
+        question_tokens = set(tokenize(question))
+        original_tokens = sum(count_tokens(doc.page_content) for doc in docs)
+        seen = set()
+        earlier = []
+        remaining = self.token_budget
+        packed = []
+        for doc in docs:
+            if remaining <= 0:
+                break
+            words = doc.page_content.split()
+            page_key = doc.metadata.get("key")
+            text = " ".join(trim_overlap(words, [previous for previous_key, previous in earlier if previous_key == page_key]))
+            earlier.append((page_key, words))
+            sentences = []
+            for sentence in split_sentences(text):
+                sentence_key = " ".join(tokenize(sentence))
+                if sentence_key and sentence_key not in seen:
+                    seen.add(sentence_key)
+                    sentences.append((sentence, tokenize(sentence)))
+            if not sentences:
+                continue
+
+            total = sum(len(tokens) for _, tokens in sentences)
+            if total <= remaining:
+                kept = [sentence for sentence, _ in sentences]
+                remaining -= total
+            else:
+                window = max(1, min(WINDOW_WORDS, remaining))
+                units = []
+                for sentence, tokens in sentences:
+                    if len(tokens) <= remaining:
+                        units.append((sentence, tokens))
+                    else:
+                        units.extend((piece, tokenize(piece)) for piece in word_windows(sentence, window))
+                ranked = sorted(range(len(units)), key=lambda i: -self.relevance(units[i][1], question_tokens))
+                chosen = set()
+                for i in ranked:
+                    if len(units[i][1]) <= remaining:
+                        chosen.add(i)
+                        remaining -= len(units[i][1])
+                kept = [units[i][0] for i in sorted(chosen)]
+            if kept:
+                packed.append(Document(page_content=" ".join(kept), metadata=doc.metadata))
+
+        packed_tokens = sum(count_tokens(doc.page_content) for doc in packed)
+        stats = {
+            "original_tokens": original_tokens,
+            "packed_tokens": packed_tokens,
+            "saved_tokens": original_tokens - packed_tokens,
+            "dropped_chunks": len(docs) - len(packed),
+        }
+        return packed, stats
@@ -0,0 +1,171 @@
+import argparse
+import json
+import os
+import struct
+import zlib
+
+# langchain
+from langchain.schema import Document
+
+MAGIC = b"NCORPUS1"
+FOOTER = struct.Struct("<QQ8s")  # index offset, index length, magic
+
+
+class CorpusWriter:
+    """
+    Write a corpus snapshot: one zlib-compressed JSON record per page followed by
+    a compressed index (page id -> offset, length, title, last_edited_time) and a
+    fixed-size footer pointing at the index. The file is written to a temporary path
+    and moved in place on close, so readers never see a partial snapshot.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.tmp_path = f"{path}.tmp"
+        self.file = open(self.tmp_path, "wb")
+        self.file.write(MAGIC)
+        self.index = {}
+
+    def add(self, page_id, title, text, last_edited_time=None, parent=None):
+        record = zlib.compress(json.dumps({
+            "page_id": page_id, "title": title, "last_edited_time": last_edited_time, "text": text, "parent": parent,
+        }, ensure_ascii=False).encode("utf-8"))
+        self.index[page_id] = [self.file.tell(), len(record), title, last_edited_time]
+        self.file.write(record)
+
+    def close(self):
+        index = zlib.compress(json.dumps(self.index, ensure_ascii=False).encode("utf-8"))
+        offset = self.file.tell()
+        self.file.write(index)
+        self.file.write(FOOTER.pack(offset, len(index), MAGIC))
+        self.file.close()
+        os.replace(self.tmp_path, self.path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.file.close()
+            os.remove(self.tmp_path)
+        return False
+
+
+class CorpusReader:
+    """
+    Read a corpus snapshot without loading it: only the index is read on open, pages
+    are decompressed one at a time on access (get) or iteration (file order).
+    """
+    def __init__(self, path):
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"File not found: {path}")
+        self.path = path
+        self.file = open(path, "rb")
+        self.file.seek(-FOOTER.size, os.SEEK_END)
+        offset, length, magic = FOOTER.unpack(self.file.read(FOOTER.size))
+        if magic != MAGIC:
+            raise ValueError(f"Not a corpus snapshot: {path}")
+        self.file.seek(offset)
+        self.index = json.loads(zlib.decompress(self.file.read(length)).decode("utf-8"))
+
+    def __len__(self):
+        return len(self.index)
+
+    def __contains__(self, page_id):
+        return page_id in self.index
+
+    def page_ids(self):
+        return list(self.index)
+
+    def metadata(self, page_id):
+        """
+        Return {"page_id", "title", "last_edited_time"} without reading the page text
+        """
+        _, _, title, last_edited_time = self.index[page_id]
+        return {"page_id": page_id, "title": title, "last_edited_time": last_edited_time}
+
+    def get(self, page_id):
+        """
+        Return the page record {"page_id", "title", "last_edited_time", "text", "parent"}
+        (parent is the database or parent page id found by the page discovery, if any)
+        """
+        offset, length, _, _ = self.index[page_id]
+        self.file.seek(offset)
+        return json.loads(zlib.decompress(self.file.read(length)).decode("utf-8"))
+
+    def __iter__(self):
+        for page_id in sorted(self.index, key=lambda page_id: self.index[page_id][0]):
+            yield self.get(page_id)
+
+    def close(self):
+        self.file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+def iter_documents(path):
+    """
+    Yield one Document per page; pages are keyed by page id so equal titles stay separate.
+    """
+    with CorpusReader(path) as reader:
+        for record in reader:
+            metadata = {"key": record["page_id"]}
+            if record["title"] is not None:
+                metadata["title"] = record["title"]
+            if record["last_edited_time"]:
+                metadata["last_edited_time"] = record["last_edited_time"]
+            if record.get("parent"):
+                metadata["parent"] = record["parent"]
+            yield Document(page_content=record["text"], metadata=metadata)
+
+
+def export_json(corpus_path, json_path):
+    """
+    Write the legacy notion_contents.json layout ({title: text}).
+    Pages sharing a title are written as "title (page id)" instead of overwriting each other.
+    """
+    contents = {}
+    with CorpusReader(corpus_path) as reader:
+        for record in reader:
+            title = record["title"]
+            if title in contents:
+                title = f"{title} ({record['page_id']})"
+            contents[title] = record["text"]
+    with open(json_path, "w", encoding="utf-8") as f:
+        json.dump(contents, f, ensure_ascii=False, indent=4)
+    print(f"Exported {len(contents)} pages to {json_path}")
+
+
+def import_json(json_path, corpus_path):
+    """
+    Convert a legacy notion_contents.json; it has no page ids, so the title is used as id.
+    """
+    with open(json_path, "r", encoding="utf-8") as f:
+        contents = json.load(f)
+    with CorpusWriter(corpus_path) as writer:
+        for title, text in contents.items():
+            writer.add(title, title, text)
+    print(f"Imported {len(contents)} pages into {corpus_path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Convert between the corpus snapshot and notion_contents.json")
+    parser.add_argument("command", choices=["import", "export"])
+    parser.add_argument("corpus", help="corpus snapshot (e.g. notion-api/notion_corpus.bin)")
+    parser.add_argument("json", help="legacy JSON file (e.g. notion-api/notion_contents.json)")
+    args = parser.parse_args()
+
+    if args.command == "import":
+        import_json(args.json, args.corpus)
+    else:
+        export_json(args.corpus, args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import zlib
+import numpy as np
+
+# langchain
+from langchain.schema import Document
+
+from bm25 import tokenize
+
+MERSENNE_PRIME = (1 << 31) - 1
+
+
+def shingles(text, size=5):
+    """
+    Set of word size-grams of text (the whole text for chunks shorter than size words)
+    """
+    tokens = tokenize(text)
+    if len(tokens) <= size:
+        return {" ".join(tokens)}
+    return {" ".join(tokens[i:i + size]) for i in range(len(tokens) - size + 1)}
+
+
+def jaccard(a, b):
+    return len(a & b) / len(a | b) if a or b else 1.0
+
+
+def permutations(num_perm=128, seed=1):
+    """
+    Coefficients (a, b) of the universal hashes (a * x + b) mod 2^31 - 1 used as MinHash permutations
+    """
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    b = rng.integers(0, MERSENNE_PRIME, num_perm, dtype=np.uint64)
+    return a, b
+
+
+def minhash_signatures(shingle_sets, num_perm=128, seed=1):
+    """
+    MinHash signature (num_perm values below 2^31) of each shingle set, one row per set.
+    The permutations are universal hashes (a * x + b) mod 2^31 - 1 of the CRC32 of each shingle.
+    """
+    a, b = permutations(num_perm, seed)
+    signatures = np.empty((len(shingle_sets), num_perm), dtype=np.uint32)
+    for row, shingle_set in enumerate(shingle_sets):
+        hashes = np.fromiter((zlib.crc32(shingle.encode("utf-8")) for shingle in shingle_set), dtype=np.uint64,
+                             count=len(shingle_set))
+        signatures[row] = ((np.outer(hashes, a) + b) % MERSENNE_PRIME).min(axis=0)
+    return signatures
+
+
+def lsh_bands(num_perm, threshold):
+    """
+    (bands, rows) splitting num_perm so the LSH threshold (1 / bands) ** (1 / rows) is closest to threshold
+    """
+    options = [(bands, num_perm // bands) for bands in range(1, num_perm + 1) if num_perm % bands == 0]
+    return min(options, key=lambda option: abs((1 / option[0]) ** (1 / option[1]) - threshold))
+
+
+class NearDuplicateIndex:
+    """
+    MinHash / LSH index filled one chunk at a time, so it works on a stream of chunks.
+    Every chunk that is not a near-duplicate of an earlier one becomes a group representative: its
+    signature goes into the LSH buckets. A later chunk sharing a bucket with a representative joins
+    its group if the two signatures agree on at least threshold of their values (the MinHash estimate
+    of the Jaccard similarity), so buckets shared by chance do not merge anything.
+    Memory is num_perm * 4 bytes per representative; the chunk texts are not kept.
+    """
+    def __init__(self, threshold=0.8, num_perm=128, shingle_size=5):
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.bands, self.rows = lsh_bands(num_perm, threshold)
+        self.buckets = [{} for _ in range(self.bands)]
+        self.signatures = []
+
+    def add(self, text):
+        """
+        Return the number of the group text joins, and whether text is its representative (a new group)
+        """
+        signature = minhash_signatures([shingles(text, self.shingle_size)], self.num_perm)[0]
+        bands = [signature[band * self.rows:(band + 1) * self.rows].tobytes() for band in range(self.bands)]
+        candidates = sorted({group for band, bucket in zip(bands, self.buckets) for group in bucket.get(band, ())})
+        for group in candidates:
+            if np.mean(self.signatures[group] == signature) >= self.threshold:
+                return group, False
+        group = len(self.signatures)
+        self.signatures.append(signature)
+        for band, bucket in zip(bands, self.buckets):
+            bucket.setdefault(band, []).append(group)
+        return group, True
+
+
+def merged_metadata(metadata, keys):
+    """
+    Metadata of a group representative whose group holds chunks of the pages keys (in order of appearance):
+    the pages joined into "sources" and the number of chunks dropped in "duplicates".
+    Chroma metadata values are scalars, hence the joined string.
+    """
+    metadata = {name: value for name, value in metadata.items() if name not in ("sources", "duplicates")}
+    if len(keys) > 1:
+        metadata["sources"] = ",".join(dict.fromkeys(keys))
+        metadata["duplicates"] = len(keys) - 1
+    return metadata
+
+
+def replace_metadata(collection, ids, metadatas):
+    """
+    Overwrite the metadata of chunks of a Chroma collection. An update merges the new metadata into
+    the stored one (a key such as "sources" cannot be dropped), so the chunks are re-added with their
+    stored vectors instead.
+    """
+    if not ids:
+        return
+    stored = collection.get(ids=list(ids), include=["embeddings", "documents"])
+    rows = dict(zip(stored["ids"], zip(stored["embeddings"], stored["documents"])))
+    collection.delete(ids=list(ids))
+    collection.add(ids=list(ids), embeddings=[rows[doc_id][0] for doc_id in ids],
+                   documents=[rows[doc_id][1] for doc_id in ids], metadatas=list(metadatas))
+
+
+def deduplicate(docs, threshold=0.8, num_perm=128, shingle_size=5):
+    """
+    Collapse near-duplicate chunks (copied templates, repeated headers, pasted tables) into one.
+    The first chunk of a group is kept, with the keys of every page it appeared in joined
+    into metadata["sources"] and the number of chunks dropped in metadata["duplicates"]
+    (pipeline.py sees the chunks in the same order and keeps the same ones).
+    Return (kept docs in their original order, stats).
+    """
+    index = NearDuplicateIndex(threshold, num_perm, shingle_size)
+    kept, keys = [], []
+    for doc in docs:
+        group, new = index.add(doc.page_content)
+        if new:
+            kept.append(doc)
+            keys.append([])
+        keys[group].append(doc.metadata.get("key", ""))
+    kept = [Document(page_content=doc.page_content, metadata=merged_metadata(doc.metadata, group_keys))
+            if len(group_keys) > 1 else doc for doc, group_keys in zip(kept, keys)]
+
+    words = sum(len(doc.page_content.split()) for doc in docs)
+    kept_words = sum(len(doc.page_content.split()) for doc in kept)
+    stats = {
+        "chunks": len(docs),
+        "kept": len(kept),
+        "removed": len(docs) - len(kept),
+        "groups": sum(1 for group_keys in keys if len(group_keys) > 1),
+        "words": words,
+        "kept_words": kept_words,
+    }
+    return kept, stats
+
+
+def report(stats):
+    """
+    Print how much the dedup shrank the index (vectors) and the embedding work (words to encode)
+    """
+    chunks = stats["chunks"] or 1
+    words = stats["words"] or 1
+    print(f"Dedup: {stats['chunks']} chunks -> {stats['kept']} ({stats['removed']} near-duplicates in "
+          f"{stats['groups']} groups): {100 * stats['removed'] / chunks:.1f}% fewer vectors, "
+          f"{100 * (stats['words'] - stats['kept_words']) / words:.1f}% less text to embed")
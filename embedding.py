@@ -1,5 +1,8 @@
+import hashlib
 import json
 import os
+import time
+import uuid
 import yaml
 from dotenv import load_dotenv
 
@@ -7,7 +10,16 @@ from dotenv import load_dotenv
 from langchain.text_splitter import CharacterTextSplitter
 from langchain.schema import Document  
 from langchain_community.vectorstores import Chroma
-from langchain_huggingface import HuggingFaceEmbeddings
+from langchain_core.embeddings import Embeddings
+
+from bm25 import BM25Index
+from corpus import iter_documents
+from dedup import deduplicate, replace_metadata, report
+from embedding_cache import CachedEmbeddings
+from index_versions import VersionBuild
+from sharding import SHARD_DIR, ShardedIndex
+from tracing import tracer
+from vector_index import NumpyVectorIndex
 
 
 class JSONHandler:
@@ -35,13 +47,153 @@ class JSONHandler:
         return documents
 
 
+def load_documents(source_file):
+    """
+    Load the crawled pages as Documents from a corpus snapshot or a legacy JSON file.
+    """
+    if source_file.endswith(".json"):
+        return JSONHandler.create_documents_from_json(JSONHandler.load_json_data(source_file))
+    return list(iter_documents(source_file))
+
+
+def source_file(notion_config):
+    """
+    The corpus snapshot written by retrieve_data.py, or content_file if only the legacy JSON exists.
+    """
+    corpus_file = notion_config.get("corpus_file")
+    if corpus_file and (os.path.exists(corpus_file) or not os.path.exists(notion_config.get("content_file", ""))):
+        return corpus_file
+    return notion_config["content_file"]
+
+
+def chunk_id(doc):
+    """
+    Content-addressed chunk id derived from the source page key and the chunk text.
+    """
+    return hashlib.sha256(f"{doc.metadata.get('key', '')}\n{doc.page_content}".encode("utf-8")).hexdigest()
+
+
+INDEX_VERSION_FILE = "index_version"
+NUMPY_INDEX_DIR = "numpy_index"
+BM25_INDEX_DIR = "bm25"
+
+
+def read_index_version(persist_directory):
+    """
+    Return the version id written by the last index build (None if unknown).
+    """
+    path = os.path.join(persist_directory, INDEX_VERSION_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip()
+
+
+def write_index_version(persist_directory):
+    """
+    Record a new version id so caches built on the previous index get invalidated.
+    """
+    version = uuid.uuid4().hex
+    path = os.path.join(persist_directory, INDEX_VERSION_FILE)
+    # replaced rather than rewritten, the file may be a hard link into the published version
+    with open(f"{path}.tmp", "w", encoding="utf-8") as f:
+        f.write(version)
+    os.replace(f"{path}.tmp", path)
+    return version
+
+
+class BatchEncoder(Embeddings):
+    """
+    Sentence-transformers encoder used for ingestion.
+    Chunks are sorted by length before batching to cut padding, encoding can be
+    sharded across a process pool, and throughput is counted for report().
+    """
+    def __init__(self, model_name, batch_size=32, normalize=False, num_workers=1):
+        from sentence_transformers import SentenceTransformer
+
+        self.model = SentenceTransformer(model_name, device="cpu")
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.num_workers = num_workers
+        self.pool = None
+        self.chunks = 0
+        self.tokens = 0
+        self.seconds = 0.0
+
+    def count_tokens(self, texts):
+        encoded = self.model.tokenizer(list(texts), truncation=True, max_length=self.model.max_seq_length)
+        return sum(len(ids) for ids in encoded["input_ids"])
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        if not texts:
+            return []
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        sorted_texts = [texts[i] for i in order]
+
+        start = time.perf_counter()
+        if self.num_workers > 1:
+            if self.pool is None:
+                self.pool = self.model.start_multi_process_pool(["cpu"] * self.num_workers)
+            vectors = self.model.encode_multi_process(
+                sorted_texts, self.pool, batch_size=self.batch_size, normalize_embeddings=self.normalize
+            )
+        else:
+            vectors = self.model.encode(
+                sorted_texts, batch_size=self.batch_size, normalize_embeddings=self.normalize, convert_to_numpy=True
+            )
+        self.seconds += time.perf_counter() - start
+        self.chunks += len(texts)
+        self.tokens += self.count_tokens(texts)
+
+        results = [None] * len(texts)
+        for i, vector in zip(order, vectors):
+            results[i] = vector.tolist()
+        return results
+
+    def embed_query(self, text):
+        return self.model.encode(text, normalize_embeddings=self.normalize, convert_to_numpy=True).tolist()
+
+    def close(self):
+        if self.pool is not None:
+            self.model.stop_multi_process_pool(self.pool)
+            self.pool = None
+
+    def report(self):
+        """
+        Print encoding throughput (chunks/sec and tokens/sec).
+        """
+        if not self.chunks:
+            print("Embedding throughput: no chunks were encoded")
+            return
+        print(f"Embedding throughput: {self.chunks} chunks, {self.tokens} tokens in {self.seconds:.2f}s "
+              f"({self.chunks / self.seconds:.1f} chunks/s, {self.tokens / self.seconds:.1f} tokens/s, "
+              f"batch_size={self.batch_size}, workers={self.num_workers})")
+
+
 class Embedding:
-    def __init__(self, embedding_model_name, persist_directory, chunk_size=1024, chunk_overlap=100, separator='\n'):
+    def __init__(self, embedding_model_name, persist_directory, chunk_size=1024, chunk_overlap=100, separator='\n',
+                 cache_dir=None, cache_max_entries=100000, batch_size=32, normalize=False, num_workers=1,
+                 backend="chroma", numpy_dtype="float32", bm25=False, shards=None, versioned=False, dedup=None):
         self.embedding_model_name = embedding_model_name
         self.persist_directory = persist_directory
         self.chunk_size = chunk_size
         self.chunk_overlap = chunk_overlap
         self.separator = separator
+        self.cache_dir = cache_dir
+        self.cache_max_entries = cache_max_entries
+        self.batch_size = batch_size
+        self.normalize = normalize
+        self.num_workers = num_workers
+        self.backend = backend
+        self.numpy_dtype = numpy_dtype
+        self.bm25 = bm25
+        self.shards = shards
+        self.versioned = versioned
+        self.dedup = dedup or {}
+        self.dedup_stats = None
+        self.embedding_cache = None
+        self.encoder = None
 
         load_dotenv()
         HUGGING_FACE_API_KEY = os.getenv('HUGGING_FACE_API_KEY')
@@ -53,7 +205,15 @@ class Embedding:
             raise ValueError("HUGGING_FACE_API_KEY is not set in the .env file.")
 
     def create_embeddings(self):
-        return HuggingFaceEmbeddings(model_name=self.embedding_model_name)
+        self.encoder = BatchEncoder(
+            self.embedding_model_name, batch_size=self.batch_size, normalize=self.normalize, num_workers=self.num_workers
+        )
+        if self.cache_dir:
+            # reuse vectors of chunks already encoded by this model
+            cache_name = f"{self.embedding_model_name}-normalized" if self.normalize else self.embedding_model_name
+            self.embedding_cache = CachedEmbeddings(self.encoder, cache_name, self.cache_dir, self.cache_max_entries)
+            return self.embedding_cache
+        return self.encoder
 
     def clean_text(self, text):
         """
@@ -65,34 +225,214 @@ class Embedding:
         """
         Splitting the texts into chunks and cleaning.
         """
-        text_splitter = CharacterTextSplitter(
-            chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, separator=self.separator
-        )
-        split_docs = text_splitter.split_documents(documents)
-        cleaned_docs = [
-            Document(
-                page_content=self.clean_text(doc.page_content),
-                metadata=doc.metadata
+        with tracer.span("ingest.split", documents=len(documents)) as span:
+            text_splitter = CharacterTextSplitter(
+                chunk_size=self.chunk_size, chunk_overlap=self.chunk_overlap, separator=self.separator
             )
-            for doc in split_docs
-        ]
+            split_docs = text_splitter.split_documents(documents)
+            cleaned_docs = [
+                Document(
+                    page_content=self.clean_text(doc.page_content),
+                    metadata=doc.metadata
+                )
+                for doc in split_docs
+            ]
+            span.set(chunks=len(cleaned_docs))
         return cleaned_docs
 
-    def create_and_persist_chroma_db(self, cleaned_docs):
+    def deduplicate_documents(self, cleaned_docs):
+        """
+        Collapse near-duplicate chunks before they are embedded when embedding.dedup is enabled
+        (see dedup.deduplicate).
+        """
+        if not self.dedup.get("enabled", False):
+            return cleaned_docs
+        with tracer.span("ingest.dedup", chunks=len(cleaned_docs)) as span:
+            docs, self.dedup_stats = deduplicate(
+                cleaned_docs, threshold=self.dedup.get("threshold", 0.8), num_perm=self.dedup.get("num_perm", 128),
+                shingle_size=self.dedup.get("shingle_size", 5),
+            )
+            span.set(removed=self.dedup_stats["removed"], groups=self.dedup_stats["groups"])
+        report(self.dedup_stats)
+        return docs
+
+    def encoding_counters(self, embedding_function):
         """
-        Create and save Chroma database.
+        (tokens encoded, embedding cache hits) so far, for the tracing spans.
         """
+        hits = embedding_function.stats()["hits"] if isinstance(embedding_function, CachedEmbeddings) else 0
+        return getattr(self.encoder, "tokens", 0), hits
+
+    def prepare_documents(self, cleaned_docs):
+        """
+        Attach content-addressed ids and drop identical chunks of the same page.
+        Return an ordered dict id -> document.
+        """
+        docs_by_id = {}
+        for doc in cleaned_docs:
+            doc_id = chunk_id(doc)
+            if doc_id not in docs_by_id:
+                docs_by_id[doc_id] = Document(page_content=doc.page_content, metadata={**doc.metadata, "chunk_id": doc_id})
+        return docs_by_id
+
+    def persist(self, cleaned_docs):
+        """
+        Write the configured index backend(s), into a new index version when versioned.
+        Return True if the index changed.
+        """
+        return self.in_new_version(lambda: self.persist_backends(cleaned_docs))
+
+    def in_new_version(self, build):
+        """
+        Run build() (True if it changed the index) against persist_directory, or when versioned against
+        a new version that is published once build() succeeds (see index_versions.VersionBuild).
+        Readers of the published version are not disturbed while it runs.
+        """
+        if not self.versioned:
+            return build()
+        db_dir = self.persist_directory
+        with VersionBuild(db_dir, linked=(NUMPY_INDEX_DIR, BM25_INDEX_DIR, SHARD_DIR, INDEX_VERSION_FILE)) as version:
+            self.persist_directory = version.directory
+            try:
+                version.changed = build()
+            finally:
+                self.persist_directory = db_dir
+        return version.changed
+
+    def persist_backends(self, cleaned_docs):
+        """
+        Write the configured index backend(s): chroma, numpy or both.
+        """
+        cleaned_docs = self.deduplicate_documents(cleaned_docs)
         embedding_function = self.create_embeddings()
+        changed = False
+        if self.backend in ("chroma", "both"):
+            changed |= self.create_and_persist_chroma_db(cleaned_docs, embedding_function)
+        if self.backend in ("numpy", "both"):
+            changed |= self.create_and_persist_numpy_index(cleaned_docs, embedding_function)
+        if self.shards:
+            changed |= self.create_and_persist_shards(cleaned_docs, embedding_function)
+        if self.bm25:
+            changed |= self.create_and_persist_bm25_index(cleaned_docs)
+        self.finish_encoding(changed)
+        return changed
+
+    def finish_encoding(self, changed):
+        self.encoder.close()
+        if self.embedding_cache is not None:
+            self.embedding_cache.close()
+        self.encoder.report()
+        if changed or read_index_version(self.persist_directory) is None:
+            write_index_version(self.persist_directory)
+
+    def create_and_persist_chroma_db(self, cleaned_docs, embedding_function=None):
+        """
+        Create or incrementally update the Chroma database.
+        Chunks are stored under content-addressed ids, so only new chunks are embedded
+        and chunks whose source text disappeared are deleted. Stored chunks whose metadata changed
+        (e.g. the sources of a near-duplicate group) get the new metadata without being embedded again.
+        Return True if the index changed.
+        """
+        standalone = embedding_function is None
+        if standalone:
+            embedding_function = self.create_embeddings()
 
         if not os.path.exists(self.persist_directory):
             os.makedirs(self.persist_directory)
 
-        db = Chroma.from_documents(
-            cleaned_docs,
-            embedding_function,
-            persist_directory=self.persist_directory,
-        )
+        docs_by_id = self.prepare_documents(cleaned_docs)
+
+        with tracer.span("ingest.chroma", chunks=len(docs_by_id)) as span:
+            tokens, hits = self.encoding_counters(embedding_function)
+            db = Chroma(
+                persist_directory=self.persist_directory,
+                embedding_function=embedding_function,
+            )
+            stored = db.get(include=["metadatas"])
+            existing = dict(zip(stored["ids"], stored["metadatas"]))
+
+            stale_ids = [doc_id for doc_id in existing if doc_id not in docs_by_id]
+            new_ids = [doc_id for doc_id in docs_by_id if doc_id not in existing]
+            updated_ids = [doc_id for doc_id in docs_by_id
+                           if doc_id in existing and existing[doc_id] != docs_by_id[doc_id].metadata]
+
+            if stale_ids:
+                db.delete(ids=stale_ids)
+            replace_metadata(db._collection, updated_ids, [docs_by_id[doc_id].metadata for doc_id in updated_ids])
+            if new_ids:
+                db.add_documents([docs_by_id[doc_id] for doc_id in new_ids], ids=new_ids)
+            new_tokens, new_hits = self.encoding_counters(embedding_function)
+            span.set(added=len(new_ids), removed=len(stale_ids), updated=len(updated_ids), tokens=new_tokens - tokens,
+                     cache_hits=new_hits - hits)
+        changed = bool(new_ids or stale_ids or updated_ids)
+        if standalone:
+            self.finish_encoding(changed)
+
+        print(f"Index updated: {len(new_ids)} added, {len(stale_ids)} removed, {len(updated_ids)} metadata updated, "
+              f"{len(docs_by_id) - len(new_ids) - len(updated_ids)} unchanged")
         print(f"Database saved successfully to disk at {self.persist_directory}")
+        return changed
+
+    def create_and_persist_numpy_index(self, cleaned_docs, embedding_function):
+        """
+        Write the flat NumPy index into <persist_directory>/numpy_index.
+        Vectors of chunks already in the previous index are reused, only new chunks are embedded.
+        Return True if the index changed.
+        """
+        directory = os.path.join(self.persist_directory, NUMPY_INDEX_DIR)
+        docs_by_id = self.prepare_documents(cleaned_docs)
+
+        old_index = None
+        previous_metadata = {}
+        if os.path.exists(directory):
+            old_index = NumpyVectorIndex.load(directory, mmap=False)
+            previous_metadata = {doc_id: doc.metadata for doc_id, doc in zip(old_index.ids, old_index.docs)}
+
+        ids = list(docs_by_id)
+        new_ids = [doc_id for doc_id in ids if doc_id not in previous_metadata]
+        with tracer.span("ingest.numpy", chunks=len(ids), added=len(new_ids)) as span:
+            tokens, hits = self.encoding_counters(embedding_function)
+            new_vectors = embedding_function.embed_documents([docs_by_id[doc_id].page_content for doc_id in new_ids])
+            new_tokens, new_hits = self.encoding_counters(embedding_function)
+            span.set(tokens=new_tokens - tokens, cache_hits=new_hits - hits)
+
+        # stored rows (and int8 scales) of unchanged chunks are reused as they are
+        index = NumpyVectorIndex.extend(old_index, [docs_by_id[doc_id] for doc_id in ids], ids, new_vectors,
+                                        dtype=self.numpy_dtype)
+        index.save(directory)
+        removed = sum(1 for doc_id in previous_metadata if doc_id not in docs_by_id)
+        updated = sum(1 for doc_id in ids
+                      if doc_id in previous_metadata and previous_metadata[doc_id] != docs_by_id[doc_id].metadata)
+        dtype_changed = old_index is not None and old_index.vectors.dtype != index.vectors.dtype
+        print(f"Numpy index updated: {len(new_ids)} added, {removed} removed ({self.numpy_dtype}) at {directory}")
+        return bool(new_ids or removed or updated or dtype_changed)
+
+    def create_and_persist_shards(self, cleaned_docs, embedding_function):
+        """
+        Write the per-page (shards: page) or per-parent (shards: parent) collections and their
+        centroids for routed search (llm.vector_store: sharded). Return True if a shard changed.
+        """
+        os.makedirs(self.persist_directory, exist_ok=True)
+        index = ShardedIndex(self.persist_directory)
+        return index.update(self.prepare_documents(cleaned_docs), embedding_function, self.shards)
+
+    def create_and_persist_bm25_index(self, cleaned_docs):
+        """
+        Build the BM25 inverted index over the cleaned chunks into <persist_directory>/bm25
+        (cheap, so it is always rebuilt in full).
+        Return True if its chunks or their metadata differ from the previous one (or there was none).
+        """
+        directory = os.path.join(self.persist_directory, BM25_INDEX_DIR)
+        with tracer.span("ingest.bm25") as span:
+            docs = list(self.prepare_documents(cleaned_docs).values())
+            previous_metadata = None
+            if os.path.exists(os.path.join(directory, "bm25.npz")):
+                previous_metadata = [doc.metadata for doc in BM25Index.load(directory).docs]
+            index = BM25Index.build(docs)
+            index.save(directory)
+            span.set(chunks=len(index.docs), terms=len(index.vocab))
+        print(f"BM25 index saved: {len(index.docs)} chunks, {len(index.vocab)} terms at {directory}")
+        return previous_metadata != [doc.metadata for doc in docs]
 
 
 def main():
@@ -100,11 +440,11 @@ def main():
     # load config
     with open('config.yaml') as file:
         config = yaml.safe_load(file.read())
+    tracer.configure(config.get("tracing", {}))
 
     try:
-        # Load and process the JSON data
-        json_data = JSONHandler.load_json_data(config["notion"]["content_file"])
-        documents = JSONHandler.create_documents_from_json(json_data)
+        # Load the crawled pages
+        documents = load_documents(source_file(config["notion"]))
 
         # Create EmbeddingHandler instance and process the documents
         embedding_handler = Embedding(
@@ -112,10 +452,21 @@ def main():
             persist_directory=config["embedding"]["db_dir"],
             chunk_size=config["embedding"]["chunk_size"],
             chunk_overlap=config["embedding"]["overlap"],
+            cache_dir=config["embedding"].get("cache_dir"),
+            cache_max_entries=config["embedding"].get("cache_max_entries", 100000),
+            batch_size=config["embedding"].get("batch_size", 32),
+            normalize=config["embedding"].get("normalize", False),
+            num_workers=config["embedding"].get("num_workers", 1),
+            backend=config["embedding"].get("backend", "chroma"),
+            numpy_dtype=config["embedding"].get("numpy_dtype", "float32"),
+            bm25=config["embedding"].get("bm25", False),
+            shards=config["embedding"].get("shards"),
+            versioned=config["embedding"].get("versioned", False),
+            dedup=config["embedding"].get("dedup"),
         )
 
         cleaned_docs = embedding_handler.split_and_clean_documents(documents)
-        embedding_handler.create_and_persist_chroma_db(cleaned_docs)
+        embedding_handler.persist(cleaned_docs)
 
     except Exception as e:
         print(f"Error: {e}")
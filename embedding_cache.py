@@ -0,0 +1,168 @@
+import atexit
+import hashlib
+import json
+import os
+import re
+import threading
+import unicodedata
+import numpy as np
+
+# langchain
+from langchain_core.embeddings import Embeddings
+
+
+def normalize_text(text):
+    """
+    Normalize text before hashing so whitespace/unicode variants share a cache entry.
+    """
+    return re.sub(r"\s+", " ", unicodedata.normalize("NFKC", text)).strip()
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Embedding function wrapper with a persistent on-disk cache.
+    Vectors are stored in a memory-mapped float32 array (vectors.npy) and an index
+    file (index.json) maps hash(model, normalized text) -> row. The cache holds at
+    most max_entries vectors and evicts the least recently used ones when full.
+    The index file is written every flush_every new vectors, on close() and at exit.
+    """
+    INITIAL_CAPACITY = 1024
+
+    def __init__(self, embeddings, model_name, cache_dir, max_entries=100000, flush_every=1000):
+        self.embeddings = embeddings
+        self.flush_every = flush_every
+        self.pending = 0
+        self.model_name = model_name
+        self.max_entries = max_entries
+        self.cache_dir = os.path.join(cache_dir, re.sub(r"[^\w.-]", "_", model_name))
+        self.vectors_path = os.path.join(self.cache_dir, "vectors.npy")
+        self.index_path = os.path.join(self.cache_dir, "index.json")
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.entries = {}  # key -> [row, last_used]
+        self.tick = 0
+        self.vectors = None
+        if os.path.exists(self.index_path) and os.path.exists(self.vectors_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                index = json.load(f)
+            self.entries = index["entries"]
+            self.tick = index["tick"]
+            self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.free_rows = self._free_rows()
+        atexit.register(self.close)
+
+    def _key(self, text, kind):
+        return hashlib.sha256(f"{self.model_name}\0{kind}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _free_rows(self):
+        if self.vectors is None:
+            return []
+        used = {row for row, _ in self.entries.values()}
+        return [row for row in range(len(self.vectors) - 1, -1, -1) if row not in used]
+
+    def _grow(self, dim, needed):
+        """
+        Enlarge the memory-mapped array (doubling, capped at max_entries).
+        """
+        old_capacity = 0 if self.vectors is None else len(self.vectors)
+        capacity = max(old_capacity, self.INITIAL_CAPACITY)
+        while capacity < old_capacity + needed and capacity < self.max_entries:
+            capacity *= 2
+        capacity = min(capacity, self.max_entries)
+        if capacity <= old_capacity:
+            return
+        tmp_path = f"{self.vectors_path}.tmp"
+        vectors = np.lib.format.open_memmap(tmp_path, mode="w+", dtype=np.float32, shape=(capacity, dim))
+        if self.vectors is not None:
+            vectors[:old_capacity] = self.vectors
+            del self.vectors
+        vectors.flush()
+        del vectors
+        os.replace(tmp_path, self.vectors_path)
+        self.vectors = np.load(self.vectors_path, mmap_mode="r+")
+        self.free_rows.extend(range(capacity - 1, old_capacity - 1, -1))
+
+    def _evict(self, needed):
+        """
+        Free rows by dropping the least recently used entries.
+        """
+        needed = min(needed, len(self.entries))
+        oldest = sorted(self.entries.items(), key=lambda item: item[1][1])[:needed]
+        for key, (row, _) in oldest:
+            del self.entries[key]
+            self.free_rows.append(row)
+
+    def _store(self, keys, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.vectors is None or len(self.free_rows) < len(keys):
+            self._grow(vectors.shape[1], len(keys) - len(self.free_rows))
+        if len(self.free_rows) < len(keys):
+            self._evict(len(keys) - len(self.free_rows))
+        # more new vectors than the cache can hold: keep the last ones
+        start = max(0, len(keys) - len(self.free_rows))
+        for key, vector in zip(keys[start:], vectors[start:]):
+            row = self.free_rows.pop()
+            self.vectors[row] = vector
+            self.tick += 1
+            self.entries[key] = [row, self.tick]
+
+    def _lookup(self, texts, kind, embed):
+        keys = [self._key(text, kind) for text in texts]
+        results = [None] * len(texts)
+        missing = {}  # key -> (text, positions)
+        with self.lock:
+            for i, key in enumerate(keys):
+                entry = self.entries.get(key)
+                if entry is None:
+                    missing.setdefault(key, (texts[i], []))[1].append(i)
+                    continue
+                self.tick += 1
+                entry[1] = self.tick
+                results[i] = self.vectors[entry[0]].tolist()
+            self.hits += len(texts) - sum(len(positions) for _, positions in missing.values())
+            self.misses += sum(len(positions) for _, positions in missing.values())
+
+        if missing:
+            missing_keys = list(missing)
+            new_vectors = embed([missing[key][0] for key in missing_keys])
+            for key, vector in zip(missing_keys, new_vectors):
+                for i in missing[key][1]:
+                    results[i] = list(vector)
+            with self.lock:
+                self._store(missing_keys, new_vectors)
+                self.pending += len(missing_keys)
+                if self.pending >= self.flush_every:
+                    self.flush()
+        return results
+
+    def embed_documents(self, texts):
+        return self._lookup(list(texts), "document", self.embeddings.embed_documents)
+
+    def embed_query(self, text):
+        return self._lookup([text], "query", lambda texts: [self.embeddings.embed_query(texts[0])])[0]
+
+    def flush(self):
+        """
+        Persist the index file and the memory-mapped vectors.
+        """
+        self.pending = 0
+        if self.vectors is not None:
+            self.vectors.flush()
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump({"model": self.model_name, "tick": self.tick, "entries": self.entries}, f)
+        os.replace(tmp_path, self.index_path)
+
+    def close(self):
+        """
+        Flush the vectors stored since the last flush (end of an ingestion run)
+        """
+        with self.lock:
+            if self.pending:
+                self.flush()
+
+    def stats(self):
+        return {"hits": self.hits, "misses": self.misses, "entries": len(self.entries)}
@@ -1,6 +1,7 @@
 import sys
 import os
 import json
+import hashlib
 import time
 import numpy as np
 import yaml
@@ -25,7 +26,9 @@ from ragas.run_config import RunConfig
 # import my class 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from llm import RAGApp
-from embedding import Embedding, JSONHandler
+from embedding import Embedding, load_documents, read_index_version, source_file
+from index_versions import resolve_index_dir
+from tracing import tracer
 
 
 # logging setting
@@ -56,28 +59,111 @@ ground_truth = [
     "The villagers learned to appreciate the lake's beauty and value, quietly admiring its glow while respecting its sacred nature.",
 ]
 
+# config keys that change the index or the generated answers
+INDEX_KEYS = ["model", "chunk_size", "overlap", "normalize", "backend", "numpy_dtype", "bm25", "shards", "dedup"]
+INDEX_FINGERPRINT_FILE = "eval_fingerprint"
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def fingerprint(*parts):
+    return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()[:16]
+
+
+def index_fingerprint(config):
+    """
+    Fingerprint of the corpus and the embedding settings the index is built from
+    """
+    embedding_config = {key: config["embedding"].get(key) for key in INDEX_KEYS}
+    return fingerprint(file_digest(source_file(config["notion"])), embedding_config)
+
+
+def answers_fingerprint(config, index_fp):
+    """
+    Fingerprint of the index, the LLM/retrieval settings and the evaluation questions
+    """
+    llm_config = {key: value for key, value in config["llm"].items() if key != "max_concurrency"}
+    query_config = {key: config["embedding"].get(key) for key in ("query_runtime", "onnx_dir")}
+    return fingerprint(index_fp, llm_config, query_config, questions, ground_truth)
+
+
+def index_is_current(persist_directory, index_fp):
+    """
+    True if the index in persist_directory was built by this evaluator from the same fingerprint
+    and has not been rebuilt since (e.g. by embedding.py with another config)
+    """
+    path = os.path.join(persist_directory, INDEX_FINGERPRINT_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        stored = json.load(f)
+    return stored == {"fingerprint": index_fp, "index_version": read_index_version(resolve_index_dir(persist_directory))}
+
+
+def save_json(path, data):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=4)
+    os.replace(tmp_path, path)
+
+
+def load_json(path, default=None):
+    if not os.path.exists(path):
+        return default
+    with open(path, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
 def embedding_process(embedding_model_name: str, 
                       persist_directory: str, 
                       json_path: str, 
                       chunk_size: int, 
-                      chunk_overlap: int):
+                      chunk_overlap: int,
+                      cache_dir: str = None,
+                      cache_max_entries: int = 100000,
+                      batch_size: int = 32,
+                      normalize: bool = False,
+                      num_workers: int = 1,
+                      backend: str = "chroma",
+                      numpy_dtype: str = "float32",
+                      bm25: bool = False,
+                      shards: str = None,
+                      versioned: bool = False,
+                      dedup: dict = None):
     """
     Embedding 
     """
-    # Load and process the JSON data
-    json_data = JSONHandler.load_json_data(json_path)
-    documents = JSONHandler.create_documents_from_json(json_data)
+    # Load the crawled pages (corpus snapshot or legacy JSON)
+    documents = load_documents(json_path)
 
     # Create EmbeddingHandler instance and process the documents
     embedding_handler = Embedding(
         embedding_model_name=embedding_model_name,
         persist_directory=persist_directory,
         chunk_size=chunk_size,
-        chunk_overlap=chunk_overlap
+        chunk_overlap=chunk_overlap,
+        cache_dir=cache_dir,
+        cache_max_entries=cache_max_entries,
+        batch_size=batch_size,
+        normalize=normalize,
+        num_workers=num_workers,
+        backend=backend,
+        numpy_dtype=numpy_dtype,
+        bm25=bm25,
+        shards=shards,
+        versioned=versioned,
+        dedup=dedup
     )
 
     cleaned_docs = embedding_handler.split_and_clean_documents(documents)
-    embedding_handler.create_and_persist_chroma_db(cleaned_docs)
+    embedding_handler.persist(cleaned_docs)
 
 def generate_answer(questions: list, 
                     embedding_model: str,
@@ -86,26 +172,61 @@ def generate_answer(questions: list,
                     temperature: int,
                     search_type: int,
                     k: int,
-                    fetch_k: int) -> Dataset: 
+                    fetch_k: int,
+                    normalize_embeddings: bool = False,
+                    persist_directory: str = "./chroma_db",
+                    vector_store: str = "chroma",
+                    hybrid_alpha: float = 0.5,
+                    max_concurrency: int = 4,
+                    context_token_budget: int = None,
+                    llm_backend: str = "endpoint",
+                    local_llm: dict = None,
+                    query_runtime: str = "torch",
+                    onnx_dir: str = None,
+                    answers_file: str = None,
+                    shard_routing: dict = None) -> Dataset: 
     """
     Generate answer using LLM
+    (answers stored in answers_file by a previous run with the same fingerprint are reused)
     """
     try:
-        eval_rag = RAGApp(embedding_model=embedding_model, llm_model=llm_model, max_token=max_token, temperature=temperature)
         data = {
             "user_input": [],
             "response": [],
             "ground_truth": [],
             "contexts": [],
         }
+        if answers_file and os.path.exists(answers_file):
+            responses = load_json(answers_file)
+            logging.info(f"Reusing answers from {answers_file}")
+            print(f"Reusing answers from {answers_file}")
+            for i, response in enumerate(responses):
+                data["user_input"].append(response["user_input"])
+                data["response"].append(response["response"])
+                data["contexts"].append(response["contexts"])
+                data["ground_truth"].append(ground_truth[i])
+            return Dataset.from_dict(data)
+
+        eval_rag = RAGApp(embedding_model=embedding_model, llm_model=llm_model, max_token=max_token, temperature=temperature,
+                          normalize_embeddings=normalize_embeddings, persist_directory=persist_directory,
+                          vector_store=vector_store, hybrid_alpha=hybrid_alpha,
+                          context_token_budget=context_token_budget, llm_backend=llm_backend, local_llm=local_llm,
+                          query_runtime=query_runtime, onnx_dir=onnx_dir, shard_routing=shard_routing)
+        # Generate answers concurrently, each item records its own latency
+        start = time.time()
+        responses = eval_rag.get_responses(questions, search_type=search_type, k=k, fetch_k=fetch_k, eval_mode=True,
+                                           max_concurrency=max_concurrency)
+        total_time = time.time() - start
+        if answers_file:
+            save_json(answers_file, responses)
+
         mesure_time = []
-        # Generate answer & measure time
-        for i, question in enumerate(questions):
-            
-            start = time.time()
-            response = eval_rag.get_response(question, search_type=search_type, k=k, fetch_k=fetch_k, eval_mode=True)
-            end = time.time()
-            mesure_time.append(end - start)
+        first_token_time = []
+        saved_tokens = []
+        for i, response in enumerate(responses):
+            mesure_time.append(response["latency"])
+            first_token_time.append(response["time_to_first_token"])
+            saved_tokens.append(response["context_tokens_saved"])
 
             data["user_input"].append(response["user_input"])
             data["response"].append(response["response"])
@@ -117,6 +238,10 @@ def generate_answer(questions: list,
 
         logging.info(f"Time: {mesure_time}")
         logging.info(f"Average time: {mean_time} ") 
+        logging.info(f"Total time ({len(questions)} questions, concurrency {max_concurrency}): {total_time}")
+        logging.info(f"Time to first token: {first_token_time}")
+        logging.info(f"Average time to first token: {np.mean(first_token_time)} ")
+        logging.info(f"Context tokens saved by packing: {saved_tokens}")
         logging.info(f"user_input: {dataset['user_input']}") 
         logging.info(f"response: {dataset['response']}") 
         logging.info(f"contexts: {dataset['contexts']}") 
@@ -129,26 +254,80 @@ def generate_answer(questions: list,
         logging.error(f"Main loop error: {e}")
 
 
-def main():
-
-    # list of mtrics 
-    metrics = [answer_relevancy, context_recall]
-    results = {}
-
-    # load config
-    with open('config.yaml') as file:
-        config = yaml.safe_load(file.read())
+def prepare_index(config):
+    """
+    Build the index of config unless the one in db_dir already matches its fingerprint.
+    Return the index fingerprint.
+    """
+    use_cache = config["evaluation"].get("cache", True)
+    db_dir = config["embedding"]["db_dir"]
+    index_fp = index_fingerprint(config)
 
-    logging.info(f"config={config}")
+    if use_cache and index_is_current(db_dir, index_fp):
+        print(f"Index unchanged (fingerprint {index_fp}), skipping embedding")
+        logging.info(f"Index unchanged (fingerprint {index_fp}), skipping embedding")
+        return index_fp
 
-    # embedding and generate answer for evaluation      
     embedding_process(config["embedding"]["model"], 
                       config["embedding"]["db_dir"], 
-                      config["notion"]["content_file"], 
+                      source_file(config["notion"]), 
                       config["embedding"]["chunk_size"], 
-                      config["embedding"]["overlap"])  
-    
+                      config["embedding"]["overlap"],
+                      config["embedding"].get("cache_dir"),
+                      config["embedding"].get("cache_max_entries", 100000),
+                      config["embedding"].get("batch_size", 32),
+                      config["embedding"].get("normalize", False),
+                      config["embedding"].get("num_workers", 1),
+                      config["embedding"].get("backend", "chroma"),
+                      config["embedding"].get("numpy_dtype", "float32"),
+                      config["embedding"].get("bm25", False),
+                      config["embedding"].get("shards"),
+                      config["embedding"].get("versioned", False),
+                      config["embedding"].get("dedup"))
+
+    save_json(os.path.join(db_dir, INDEX_FINGERPRINT_FILE),
+              {"fingerprint": index_fp, "index_version": read_index_version(resolve_index_dir(db_dir))})
     print("Embedding is done")
+    return index_fp
+
+
+def latency_summary(answers_file):
+    """
+    Latency percentiles (ms) of the answers stored for one configuration
+    """
+    responses = load_json(answers_file, [])
+    if not responses:
+        return {}
+    latency = np.array([response["latency"] for response in responses]) * 1000.0
+    first_token = np.array([response["time_to_first_token"] or 0.0 for response in responses]) * 1000.0
+    return {
+        "latency_p50_ms": float(np.percentile(latency, 50)),
+        "latency_p95_ms": float(np.percentile(latency, 95)),
+        "ttft_p50_ms": float(np.percentile(first_token, 50)),
+    }
+
+
+def run_evaluation(config, metrics=None):
+    """
+    Evaluate one configuration: index, answers and metrics (each reused when its fingerprint matches).
+    Return a summary with the mean of every metric and the answer latency percentiles.
+    """
+    # list of mtrics 
+    metrics = metrics or [answer_relevancy, context_recall]
+    results = {}
+
+    # fingerprints of the corpus and config: unchanged parts of the pipeline are reused
+    use_cache = config["evaluation"].get("cache", True)
+    cache_dir = config["evaluation"].get("cache_dir", "evaluate/cache")
+    answers_fp = answers_fingerprint(config, index_fingerprint(config))
+    answers_file = os.path.join(cache_dir, f"answers_{answers_fp}.json") if use_cache else None
+    metrics_file = os.path.join(cache_dir, f"metrics_{answers_fp}.json")
+    logging.info(f"answers fingerprint={answers_fp}")
+
+    if use_cache and os.path.exists(answers_file):
+        print("Answers already generated for this fingerprint, skipping embedding")
+    else:
+        prepare_index(config)
     
     dataset = generate_answer(questions, 
                               config["embedding"]["model"], 
@@ -157,20 +336,41 @@ def main():
                               config["llm"]["temperature"], 
                               config["llm"]["search_type"], 
                               config["llm"]["k"], 
-                              config["llm"]["fetch_k"])
+                              config["llm"]["fetch_k"],
+                              config["embedding"].get("normalize", False),
+                              config["embedding"]["db_dir"],
+                              config["llm"].get("vector_store", "chroma"),
+                              config["llm"].get("hybrid_alpha", 0.5),
+                              config["llm"].get("max_concurrency", 4),
+                              config["llm"].get("context_token_budget"),
+                              config["llm"].get("backend", "endpoint"),
+                              config["llm"].get("local"),
+                              config["embedding"].get("query_runtime", "torch"),
+                              config["embedding"].get("onnx_dir"),
+                              answers_file,
+                              config["llm"].get("shard_routing"))
     
     print("Generated answers")
     
     # Evaluation
+    stored_metrics = {}
     try:           
         eval_llm = ChatOllama(model="llama3.2", timeout=60000)
         eval_embeddings = OllamaEmbeddings(model="llama3.2")
         run_config = RunConfig(timeout=config["evaluation"]["timeout"], max_workers=config["evaluation"]["max_workers"], log_tenacity=True)  
 
         # Evaluate one by one otherwise I get timeout error
+        # each metric is saved as soon as it is done, so a rerun resumes with the missing ones
+        stored_metrics = load_json(metrics_file, {}) if use_cache else {}
         try:
             # iterate each metric
             for metric in metrics:
+                if metric.name in stored_metrics:
+                    results[metric.name] = stored_metrics[metric.name]
+                    print(f"{metric.name} result (stored):", stored_metrics[metric.name]["mean"])
+                    logging.info(f"{metric.name} result (stored): {stored_metrics[metric.name]}")
+                    continue
+
                 print(f"Evaluating metric: {metric.name}") 
                 logging.info(f"Evaluating metric: {metric.name}")
 
@@ -184,6 +384,10 @@ def main():
                 )
 
                 results[metric.name] = result
+                scores = [float(score) for score in result.to_pandas()[metric.name]]
+                stored_metrics[metric.name] = {"mean": float(np.nanmean(scores)), "scores": scores}
+                if use_cache:
+                    save_json(metrics_file, stored_metrics)
 
                 # result
                 print(f"{metric.name} result:", result)
@@ -197,5 +401,22 @@ def main():
         print(f"Main loop error: {e}")
         logging.error(f"Main loop error: {e}")
 
+    summary = {metric.name: stored_metrics.get(metric.name, {}).get("mean") for metric in metrics}
+    if answers_file:
+        summary.update(latency_summary(answers_file))
+    return summary
+
+
+def main():
+
+    # load config
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file.read())
+
+    logging.info(f"config={config}")
+    tracer.configure(config.get("tracing", {}))
+    run_evaluation(config)
+
+
 if __name__ == "__main__":
     main()
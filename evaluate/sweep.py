@@ -0,0 +1,122 @@
+import copy
+import itertools
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor
+import yaml
+
+sys.path.append(os.path.abspath(os.path.dirname(__file__)))
+from ragas_eval import index_fingerprint, prepare_index, run_evaluation, save_json  # noqa: E402
+
+METRIC_COLUMNS = ["answer_relevancy", "context_recall"]
+LATENCY_COLUMNS = ["latency_p50_ms", "latency_p95_ms", "ttft_p50_ms"]
+
+
+def sweep_configs(config):
+    """
+    One evaluation config per combination of the sweep grid (invalid combinations are skipped).
+    Configs sharing the embedding settings get the same db_dir, so each index is built once.
+    """
+    sweep = config["sweep"]
+    output_dir = sweep.get("output_dir", "evaluate/sweep")
+    grid = itertools.product(
+        sweep.get("embedding_models", [config["embedding"]["model"]]),
+        sweep.get("chunk_sizes", [config["embedding"]["chunk_size"]]),
+        sweep.get("overlaps", [config["embedding"]["overlap"]]),
+        sweep.get("k", [config["llm"]["k"]]),
+        sweep.get("fetch_k", [config["llm"]["fetch_k"]]),
+        sweep.get("llm_models", [config["llm"]["model"]]),
+    )
+    configs = []
+    for embedding_model, chunk_size, overlap, k, fetch_k, llm_model in grid:
+        if overlap >= chunk_size or fetch_k < k:
+            continue
+        run_config = copy.deepcopy(config)
+        run_config.pop("sweep")
+        run_config["embedding"].update(model=embedding_model, chunk_size=chunk_size, overlap=overlap)
+        run_config["llm"].update(model=llm_model, k=k, fetch_k=fetch_k)
+        # the sweep table needs the stored answers and metrics
+        run_config["evaluation"]["cache"] = True
+        run_config["embedding"]["db_dir"] = os.path.join(output_dir, f"index_{index_fingerprint(run_config)}")
+        configs.append(run_config)
+    return configs
+
+
+def build_indexes(configs):
+    """
+    Build the indexes of one embedding model one after the other: they share its embedding cache
+    """
+    for config in configs:
+        prepare_index(config)
+    return len(configs)
+
+
+def describe(config):
+    return {
+        "embedding_model": config["embedding"]["model"],
+        "chunk_size": config["embedding"]["chunk_size"],
+        "overlap": config["embedding"]["overlap"],
+        "k": config["llm"]["k"],
+        "fetch_k": config["llm"]["fetch_k"],
+        "llm_model": config["llm"]["model"],
+    }
+
+
+def format_table(rows):
+    columns = list(rows[0]) if rows else []
+    lines = ["| " + " | ".join(columns) + " |", "|" + "---|" * len(columns)]
+    for row in rows:
+        cells = []
+        for column in columns:
+            value = row[column]
+            cells.append("-" if value is None else f"{value:.3f}" if isinstance(value, float) else str(value))
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def main():
+
+    # load config
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file.read())
+
+    sweep = config["sweep"]
+    output_dir = sweep.get("output_dir", "evaluate/sweep")
+    processes = sweep.get("processes") or os.cpu_count()
+    configs = sweep_configs(config)
+
+    # 1. distinct indexes, grouped by embedding model (one process per model)
+    indexes = {}
+    for run_config in configs:
+        indexes.setdefault(run_config["embedding"]["db_dir"], run_config)
+    groups = {}
+    for run_config in indexes.values():
+        key = (run_config["embedding"]["model"], run_config["embedding"].get("normalize", False))
+        groups.setdefault(key, []).append(run_config)
+    print(f"Sweep: {len(configs)} configurations, {len(indexes)} indexes, {processes} processes")
+
+    with ProcessPoolExecutor(max_workers=min(processes, len(groups)) or 1) as executor:
+        list(executor.map(build_indexes, groups.values()))
+    print("Indexes are ready")
+
+    # 2. answers and metrics of every configuration, sharing the indexes
+    with ProcessPoolExecutor(max_workers=min(processes, len(configs)) or 1) as executor:
+        summaries = list(executor.map(run_evaluation, configs))
+
+    rows = []
+    for run_config, summary in zip(configs, summaries):
+        row = describe(run_config)
+        for column in METRIC_COLUMNS + LATENCY_COLUMNS:
+            row[column] = summary.get(column)
+        rows.append(row)
+
+    table = format_table(rows)
+    save_json(os.path.join(output_dir, "results.json"), rows)
+    with open(os.path.join(output_dir, "results.md"), "w", encoding="utf-8") as f:
+        f.write(table + "\n")
+    print(table)
+    print(f"Results saved at {output_dir}/results.md and results.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,289 @@
+import os
+import shutil
+import threading
+import time
+import uuid
+
+VERSIONS_DIR = "versions"
+LEASES_DIR = "leases"
+CURRENT_FILE = "CURRENT"
+
+# version directory -> number of IndexHandles open on it in this process
+open_handles = {}
+open_handles_lock = threading.Lock()
+
+
+def current_version(db_dir):
+    """
+    Version id the CURRENT pointer of db_dir points to (None for an unversioned index)
+    """
+    path = os.path.join(db_dir, CURRENT_FILE)
+    if not os.path.exists(path):
+        return None
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read().strip() or None
+
+
+def version_directory(db_dir, version):
+    """
+    Directory holding an index version (db_dir itself for an unversioned index)
+    """
+    return os.path.join(db_dir, VERSIONS_DIR, version) if version else db_dir
+
+
+def resolve_index_dir(db_dir):
+    """
+    Directory of the published index of db_dir
+    """
+    return version_directory(db_dir, current_version(db_dir))
+
+
+def publish_version(db_dir, version):
+    """
+    Point CURRENT at version. The pointer is written to a temporary file and renamed over the old one,
+    so a reader sees either the previous version or the new one, never a partial write.
+    """
+    tmp_path = os.path.join(db_dir, f"{CURRENT_FILE}.{uuid.uuid4().hex}.tmp")
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        f.write(version)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, os.path.join(db_dir, CURRENT_FILE))
+
+
+def process_alive(pid):
+    if os.name != "posix":
+        # no cheap check without extra dependencies, the lease stays until it is released
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class IndexLease:
+    """
+    Marker file <db_dir>/leases/<version>.<pid>.<token> telling the garbage collector that this
+    process still reads (or writes) a version. Leases of processes that died are ignored.
+    """
+    def __init__(self, db_dir, version):
+        directory = os.path.join(db_dir, LEASES_DIR)
+        os.makedirs(directory, exist_ok=True)
+        self.version = version
+        self.path = os.path.join(directory, f"{version}.{os.getpid()}.{uuid.uuid4().hex[:8]}")
+        open(self.path, "w").close()
+
+    def release(self):
+        if self.path is not None:
+            if os.path.exists(self.path):
+                os.remove(self.path)
+            self.path = None
+
+
+def acquire_current_lease(db_dir):
+    """
+    Lease the published version of db_dir. Return (version, lease), (None, None) when unversioned.
+    CURRENT is read again once the lease exists: a version still current at that point
+    cannot be removed by a garbage collection that runs later.
+    """
+    while True:
+        version = current_version(db_dir)
+        if version is None:
+            return None, None
+        lease = IndexLease(db_dir, version)
+        if current_version(db_dir) == version:
+            return version, lease
+        lease.release()
+
+
+def leased_versions(db_dir):
+    """
+    Versions held by a live process (leases left by dead processes are removed)
+    """
+    directory = os.path.join(db_dir, LEASES_DIR)
+    versions = set()
+    if not os.path.isdir(directory):
+        return versions
+    for name in os.listdir(directory):
+        try:
+            version, pid, _ = name.rsplit(".", 2)
+            pid = int(pid)
+        except ValueError:
+            continue
+        if process_alive(pid):
+            versions.add(version)
+        else:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+    return versions
+
+
+def collect_garbage(db_dir):
+    """
+    Remove the versions that are neither published nor leased. Return the removed version ids.
+    """
+    directory = os.path.join(db_dir, VERSIONS_DIR)
+    if not os.path.isdir(directory):
+        return []
+    # CURRENT is read before the leases, see acquire_current_lease
+    keep = {current_version(db_dir)}
+    keep |= leased_versions(db_dir)
+    removed = []
+    for version in sorted(os.listdir(directory)):
+        if version in keep:
+            continue
+        try:
+            shutil.rmtree(os.path.join(directory, version))
+            removed.append(version)
+        except OSError as e:
+            # e.g. files still open on Windows, the next collection retries
+            print(f"Index version {version} could not be removed yet: {e}")
+    if removed:
+        print(f"Index versions removed: {', '.join(removed)}")
+    return removed
+
+
+class VersionBuild:
+    """
+    Context manager writing a new index version next to the published one.
+    The new version starts as a copy of the published index, so incremental updates only embed new chunks.
+    Files under the top-level names in linked are hard links instead of copies: their writers must replace
+    them (write a temporary file and rename it) and never write into them. The Chroma files (chroma.sqlite3
+    and the HNSW segment directories) are updated in place by Chroma, so they are copied, which costs
+    time and disk in proportion to the corpus on every build.
+    On exit the version is published if changed is still True, otherwise (or on error) it is removed;
+    unused old versions are then garbage-collected.
+    """
+    def __init__(self, db_dir, linked=()):
+        self.db_dir = db_dir
+        self.linked = set(linked)
+        self.version = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+        self.directory = version_directory(db_dir, self.version)
+        self.changed = True
+        self.lease = None
+
+    def __enter__(self):
+        os.makedirs(os.path.join(self.db_dir, VERSIONS_DIR), exist_ok=True)
+        # the lease keeps a concurrent garbage collection away from the half-written version
+        self.lease = IndexLease(self.db_dir, self.version)
+        source_version, source_lease = acquire_current_lease(self.db_dir)
+        source = version_directory(self.db_dir, source_version)
+        counts = {"linked": 0, "copied": 0}
+
+        def link_or_copy(src, dst):
+            if os.path.relpath(src, source).split(os.sep)[0] in self.linked:
+                try:
+                    os.link(src, dst)
+                    counts["linked"] += 1
+                    return dst
+                except OSError:
+                    # e.g. a file system without hard links
+                    pass
+            counts["copied"] += 1
+            return shutil.copy2(src, dst)
+
+        try:
+            # an unversioned index at the top of db_dir is the starting point of the first version
+            shutil.copytree(source, self.directory, copy_function=link_or_copy, ignore=shutil.ignore_patterns(
+                VERSIONS_DIR, LEASES_DIR, f"{CURRENT_FILE}*"
+            ))
+        finally:
+            if source_lease is not None:
+                source_lease.release()
+        print(f"Building index version {self.version} in {self.directory} "
+              f"({counts['copied']} files copied, {counts['linked']} linked)")
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None and self.changed:
+            publish_version(self.db_dir, self.version)
+            print(f"Index version {self.version} published")
+        else:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            if exc_type is None:
+                print(f"Index unchanged, version {self.version} discarded")
+        self.lease.release()
+        collect_garbage(self.db_dir)
+        return False
+
+
+def close_store(store):
+    """
+    Close the files a vector store holds open. Clients of chromadb 0.5 have no close method:
+    the system it keeps for each persist directory is stopped and dropped from its cache instead.
+    """
+    executor = getattr(store, "executor", None)
+    if executor is not None:
+        executor.shutdown(wait=False)
+    client = getattr(store, "_client", None) or getattr(store, "client", None)
+    identifier = getattr(client, "_identifier", None)
+    if identifier is None:
+        return
+    from chromadb.api.client import SharedSystemClient
+
+    system = SharedSystemClient._identifier_to_system.pop(identifier, None)
+    if system is not None:
+        system.stop()
+
+
+class IndexHandle:
+    """
+    Stores opened on one index version (vector store db, BM25 index bm25) and the number of
+    requests reading them. A retired handle is closed once the last of these requests is done:
+    its lease is released and, when no other handle of this process is open on the version,
+    its vector store is closed.
+    """
+    def __init__(self, db_dir, version, lease, db=None, bm25=None):
+        self.db_dir = db_dir
+        self.version = version
+        self.directory = version_directory(db_dir, version)
+        self.lease = lease
+        self.db = db
+        self.bm25 = bm25
+        self.readers = 0
+        self.retired = False
+        self.closed = False
+        self.lock = threading.Lock()
+        with open_handles_lock:
+            open_handles[self.directory] = open_handles.get(self.directory, 0) + 1
+
+    def acquire(self):
+        with self.lock:
+            self.readers += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.readers -= 1
+            done = self.retired and self.readers == 0
+        if done:
+            self.close()
+
+    def retire(self):
+        with self.lock:
+            self.retired = True
+            done = self.readers == 0
+        if done:
+            self.close()
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+            self.closed = True
+        with open_handles_lock:
+            open_handles[self.directory] -= 1
+            last = open_handles[self.directory] == 0
+            if last:
+                del open_handles[self.directory]
+        if last and self.db is not None:
+            close_store(self.db)
+        if self.lease is not None:
+            self.lease.release()
+            self.lease = None
+            collect_garbage(self.db_dir)
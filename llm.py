@@ -1,4 +1,7 @@
+import asyncio
 import os
+import threading
+import time
 import yaml
 from dotenv import load_dotenv
 
@@ -8,29 +11,160 @@ from langchain_chroma import Chroma
 from langchain.prompts import PromptTemplate
 from langchain_core.runnables import RunnablePassthrough
 
+from answer_cache import SemanticAnswerCache
+from bm25 import BM25Index, fuse_scores, tokenize
+from context_packing import ContextPacker
+from embedding import BM25_INDEX_DIR, NUMPY_INDEX_DIR, read_index_version
+from index_versions import IndexHandle, acquire_current_lease, current_version, version_directory
+from llm_backends import LocalLlamaLLM, StubLLM, prompt_prefix
+from onnx_embedding import OnnxEmbeddings, is_verified
+from sharding import ShardedIndex
+from tracing import tracer
+from vector_index import NumpyVectorIndex
 
-class RAGApp:
 
-    def __init__(self, embedding_model, llm_model, max_token, temperature=0.4):
-        # env
-        load_dotenv()
-        self.HUGGING_FACE_API_KEY = os.getenv('HUGGING_FACE_API_KEY')
+CLEANUP_PHRASE = "The context explains that "
 
-        if self.HUGGING_FACE_API_KEY:
-            os.environ["HUGGINGFACEHUB_API_TOKEN"] = self.HUGGING_FACE_API_KEY
-            print("Hugging Face API Key set successfully.")
-        else:
-            raise ValueError("HUGGING_FACE_API_KEY is not set in the .env file.")
-        
-        # HuggingFace Endpoint
-        self.repo_id = llm_model
-        self.llm = HuggingFaceEndpoint(
-            repo_id=self.repo_id, max_length=max_token, temperature=temperature, timeout=1000
+
+def clean_stream(pieces):
+    """
+    Apply the response cleanup to a token stream.
+    The tail that could still be the start of CLEANUP_PHRASE is held back until the next piece.
+    """
+    buffer = ""
+    for piece in pieces:
+        buffer = (buffer + piece).replace(CLEANUP_PHRASE, "")
+        hold = next(
+            (i for i in range(min(len(CLEANUP_PHRASE) - 1, len(buffer)), 0, -1) if buffer.endswith(CLEANUP_PHRASE[:i])), 0
+        )
+        if len(buffer) > hold:
+            yield buffer[:len(buffer) - hold]
+            buffer = buffer[len(buffer) - hold:]
+    if buffer:
+        yield buffer
+
+
+def token_count(text):
+    """
+    Word tokens of text for the tracing spans (not computed while tracing is disabled)
+    """
+    return len(tokenize(text)) if tracer.enabled else None
+
+
+def set_hugging_face_token():
+    """
+    Export HUGGING_FACE_API_KEY from .env for the Hugging Face clients
+    """
+    load_dotenv()
+    api_key = os.getenv('HUGGING_FACE_API_KEY')
+
+    if api_key:
+        os.environ["HUGGINGFACEHUB_API_TOKEN"] = api_key
+        print("Hugging Face API Key set successfully.")
+    else:
+        raise ValueError("HUGGING_FACE_API_KEY is not set in the .env file.")
+    return api_key
+
+
+def create_llm(llm_model, max_token, temperature=0.4, backend="endpoint", local_config=None):
+    """
+    Create the LLM client for the backend:
+    endpoint (Hugging Face Inference), local (GGUF model on the CPU) or stub (offline, no model)
+    """
+    if backend == "local":
+        local_config = local_config or {}
+        return LocalLlamaLLM(
+            model_path=local_config["model_path"], n_ctx=local_config.get("n_ctx", 4096),
+            n_threads=local_config.get("n_threads"), max_tokens=max_token, temperature=temperature,
         )
+    if backend == "stub":
+        return StubLLM()
+    set_hugging_face_token()
+    return HuggingFaceEndpoint(
+        repo_id=llm_model, max_length=max_token, temperature=temperature, timeout=1000
+    )
+
+
+def create_embedding_function(embedding_model, normalize_embeddings=False, query_runtime="torch", onnx_dir=None):
+    """
+    Query encoder: the sentence-transformers model (torch) or its verified int8 ONNX export (onnx)
+    """
+    if query_runtime == "onnx":
+        if onnx_dir and is_verified(onnx_dir, embedding_model):
+            return OnnxEmbeddings(onnx_dir, normalize_embeddings)
+        print(f"ONNX query encoder not exported or not verified at {onnx_dir} (run onnx_embedding.py), using torch")
+    return HuggingFaceEmbeddings(
+        model_name=embedding_model, encode_kwargs={"normalize_embeddings": normalize_embeddings}
+    )
+
+
+def create_answer_cache(cache_config):
+    """
+    Create the semantic answer cache from the answer_cache section of config.yaml (None if disabled)
+    """
+    if not cache_config.get("enabled", False):
+        return None
+    return SemanticAnswerCache(
+        threshold=cache_config.get("threshold", 0.95),
+        max_entries=cache_config.get("max_entries", 1000),
+        ttl=cache_config.get("ttl", 86400),
+        path=cache_config.get("path"),
+        save_interval=cache_config.get("save_interval", 60),
+    )
+
+
+def create_vector_store(persist_directory, embedding_function, vector_store="chroma", shard_routing=None):
+    """
+    Open the retriever backend written by embedding.py (chroma, numpy or sharded)
+    """
+    if vector_store == "numpy":
+        return NumpyVectorIndex.load(os.path.join(persist_directory, NUMPY_INDEX_DIR), embedding_function)
+    if vector_store == "sharded":
+        shard_routing = shard_routing or {}
+        return ShardedIndex(persist_directory, embedding_function, top_shards=shard_routing.get("top_shards", 3),
+                            search_all=shard_routing.get("search_all", False))
+    return Chroma(persist_directory=persist_directory, embedding_function=embedding_function)
+
+
+def open_vector_store(db_dir, embedding_function, vector_store="chroma", shard_routing=None):
+    """
+    Open the published version of the index in db_dir. Return (store, version id)
+    """
+    version = current_version(db_dir)
+    return create_vector_store(version_directory(db_dir, version), embedding_function, vector_store, shard_routing), version
+
+
+class RAGApp:
+
+    def __init__(self, embedding_model, llm_model, max_token, temperature=0.4, normalize_embeddings=False,
+                 persist_directory="./chroma_db", llm=None, embedding_function=None, db=None, answer_cache=None,
+                 vector_store="chroma", hybrid_alpha=0.5, context_token_budget=None, llm_backend="endpoint",
+                 local_llm=None, query_runtime="torch", onnx_dir=None, shard_routing=None, index_version=None):
+        # Already loaded components (see ResourceManager) are reused as is
+        self.repo_id = llm_model
+        self.persist_directory = persist_directory
+        self.vector_store = vector_store
+        self.shard_routing = shard_routing
+        self.swap_lock = threading.Lock()
+        self.answer_cache = answer_cache
+        self.llm = llm or create_llm(llm_model, max_token, temperature, llm_backend, local_llm)
+        self.temperature = temperature
+        # everything besides the request that shapes an answer, part of the answer cache key
+        self.answer_settings = [
+            (local_llm or {}).get("model_path") if llm_backend == "local" else llm_model, llm_backend, max_token,
+            vector_store, shard_routing or {}, hybrid_alpha, context_token_budget,
+        ]
 
         # Embedding function and database
-        self.embedding_function = HuggingFaceEmbeddings(model_name=embedding_model)
-        self.db = self.initialize_database()
+        self.embedding_function = embedding_function or create_embedding_function(
+            embedding_model, normalize_embeddings, query_runtime, onnx_dir
+        )
+        # db was opened on index_version (see open_vector_store)
+        self.hybrid_alpha = hybrid_alpha
+        self.index = self.open_index(db, index_version)
+
+        # retrieved chunks are packed into at most context_token_budget tokens (None keeps every chunk in full)
+        self.packer = ContextPacker(context_token_budget) if context_token_budget else None
 
         # prompt
         self.prompt = PromptTemplate(
@@ -41,6 +175,9 @@ class RAGApp:
                 # "Provide a detailed response based only on the given context."
             )
         )
+        if isinstance(self.llm, LocalLlamaLLM):
+            # the instruction prefix is evaluated once, each request only adds context and question
+            self.llm.cache_prefix(prompt_prefix(self.prompt))
 
         # prompt for conversation
         # self.prompt = ChatPromptTemplate.from_messages([
@@ -48,21 +185,127 @@ class RAGApp:
         #     ("human", "Context: {context}. Question: {question}. Please answer with full detail and explanation:")
         # ])
     
-    def initialize_database(self, persist_directory="./chroma_db"):
+    def initialize_database(self, persist_directory="./chroma_db", vector_store="chroma", shard_routing=None):
         try:
-            return Chroma(
-                persist_directory=persist_directory,
-                embedding_function=self.embedding_function,
-            )
+            return create_vector_store(persist_directory, self.embedding_function, vector_store, shard_routing)
         except Exception as e:
             print(f"Main loop error: {e}")
 
+    def open_index(self, db=None, db_version=None):
+        """
+        Lease the published version of persist_directory and open its stores
+        (db is reused when it was opened on that version)
+        """
+        version, lease = acquire_current_lease(self.persist_directory)
+        index = IndexHandle(self.persist_directory, version, lease)
+        if db is None or db_version != version:
+            db = self.initialize_database(index.directory, self.vector_store, self.shard_routing)
+        index.db = db
+        # BM25 index for hybrid search (built by embedding.py when embedding.bm25 is enabled)
+        if os.path.exists(os.path.join(index.directory, BM25_INDEX_DIR)):
+            index.bm25 = BM25Index.load(os.path.join(index.directory, BM25_INDEX_DIR))
+        return index
+
+    def refresh_index(self):
+        """
+        Switch to the index version published since the last request, if any (embedding.py with
+        embedding.versioned). The models stay loaded; requests still retrieving from the previous
+        version finish on it and its lease is released after them.
+        """
+        if current_version(self.persist_directory) == self.index.version:
+            return
+        with self.swap_lock:
+            if current_version(self.persist_directory) == self.index.version:
+                return
+            index = self.open_index()
+            if index.db is None:
+                index.retire()
+                return
+            previous, self.index = self.index, index
+        previous.retire()
+        print(f"Index version {index.version} loaded")
+
+    @property
+    def db(self):
+        return self.index.db
+
+    @property
+    def bm25(self):
+        return self.index.bm25
+
     def __format_docs__(self, docs):
         if not docs:
             return "No relevant documents found."
         return "\n\n".join(doc.page_content for doc in docs)
 
-    def get_response(self, question, search_type="mmr", k=4, fetch_k=20, eval_mode=False):
+    def __retrieve__(self, question, search_type, k, fetch_k, vector=None):
+        # the version stays leased while this request reads it, even if a newer one gets loaded meanwhile
+        index = self.index.acquire()
+        try:
+            with tracer.span("query.retrieve", search_type=search_type) as span:
+                docs = self.__search__(index, question, search_type, k, fetch_k, vector)
+                span.set(chunks=len(docs))
+        finally:
+            index.release()
+        return docs
+
+    def __search__(self, index, question, search_type, k, fetch_k, vector=None):
+        db = index.db
+        if search_type == "hybrid":
+            if index.bm25 is not None:
+                vector_results = db.similarity_search_with_relevance_scores(question, k=fetch_k)
+                return fuse_scores(vector_results, index.bm25.search(question, fetch_k), k, self.hybrid_alpha)
+            print("BM25 index not found, falling back to mmr search")
+            search_type = "mmr"
+        # reuse an already computed query embedding when possible
+        if vector is not None and search_type == "mmr":
+            return db.max_marginal_relevance_search_by_vector(vector, k=k, fetch_k=fetch_k)
+        if vector is not None and search_type == "similarity":
+            return db.similarity_search_by_vector(vector, k=k)
+        # search type: similarity, mmr, ...
+        retriever = db.as_retriever(search_type=search_type, search_kwargs={'k': k, 'fetch_k': fetch_k})
+        return retriever.invoke(question)
+
+    def __pack__(self, question, docs):
+        """
+        Return (packed docs, prompt tokens saved) when context packing is enabled
+        """
+        if self.packer is None:
+            return docs, 0
+        with tracer.span("query.pack", chunks=len(docs)) as span:
+            docs, stats = self.packer.pack(question, docs)
+            span.set(**stats)
+        return docs, stats["saved_tokens"]
+
+    def __cache_params__(self, search_type, k, fetch_k, temperature=None):
+        """
+        Answer cache key: the request parameters, its effective temperature and the answer settings
+        """
+        return [search_type, k, fetch_k, self.temperature if temperature is None else temperature, *self.answer_settings]
+
+    def __lookup_cache__(self, question, params):
+        """
+        Return (cached entry or None, query embedding) when the answer cache is enabled
+        """
+        if self.answer_cache is None:
+            return None, None
+        self.answer_cache.invalidate_if_stale(read_index_version(self.index.directory))
+        with tracer.span("query.embed"):
+            vector = self.embedding_function.embed_query(question)
+        with tracer.span("query.cache") as span:
+            cached = self.answer_cache.lookup(vector, params)
+            span.set(cache_hits=int(cached is not None))
+        return cached, vector
+
+    def __chain__(self, temperature=None):
+        # temperature is applied per request so the shared client needs no rebuild
+        llm = self.llm if temperature is None else self.llm.bind(temperature=temperature)
+        return (
+            RunnablePassthrough()  # Pass the formatted string directly
+            | llm  # The HuggingFaceEndpoint processes the input string
+        )
+
+    def get_response(self, question, search_type="mmr", k=4, fetch_k=20, eval_mode=False, temperature=None):
 
         #-------- Test: raw answer (no RAG system) ----
         # template = """Question: {question}
@@ -74,28 +317,43 @@ class RAGApp:
         # )
         # result = llm_chain.invoke(question)
         #----------------------------------
-        
-        rag_chain = (
-            RunnablePassthrough()  # Pass the formatted string directly
-            | self.llm  # The HuggingFaceEndpoint processes the input string
-        )
 
-        # search type: similarity, mmr, ...
-        retriever = self.db.as_retriever(search_type=search_type, search_kwargs={'k': k, 'fetch_k': fetch_k})
-        docs = retriever.invoke(question)
+        start = time.perf_counter()
+        self.refresh_index()
+        rag_chain = self.__chain__(temperature)
+
+        # semantic answer cache (not used for evaluation)
+        vector = None
+        params = self.__cache_params__(search_type, k, fetch_k, temperature)
+        if not eval_mode:
+            cached, vector = self.__lookup_cache__(question, params)
+            if cached:
+                return cached["answer"]
+
+        docs = self.__retrieve__(question, search_type, k, fetch_k, vector)
+        docs, saved_tokens = self.__pack__(question, docs)
 
         if eval_mode:
 
             # only evalaute top context due to my PC spec
-            formatted_context = [docs[0].page_content] if docs[0] else ["No relevant documents found."]
+            formatted_context = [docs[0].page_content] if docs else ["No relevant documents found."]
             
             # Format the input
-            formatted_input = self.prompt.format(context=formatted_context, question=question)
+            with tracer.span("query.prompt"):
+                formatted_input = self.prompt.format(context=formatted_context, question=question)
             # print("========== DEBUG: Formatted Input ==========")
             # print(formatted_input)
 
-            # Invoke the chain and debug the output
-            result = rag_chain.invoke(formatted_input)
+            # Stream the chain to measure time-to-first-token separately from total latency
+            time_to_first_token = None
+            pieces = []
+            with tracer.span("query.llm", prompt_tokens=token_count(formatted_input)) as span:
+                for piece in rag_chain.stream(formatted_input):
+                    if time_to_first_token is None:
+                        time_to_first_token = time.perf_counter() - start
+                    pieces.append(piece)
+                result = "".join(pieces)
+                span.set(response_tokens=token_count(result), time_to_first_token=time_to_first_token)
             # print("========== DEBUG: Raw LLM Output ==========")
             # print(result)
 
@@ -103,32 +361,227 @@ class RAGApp:
                 "user_input": question,
                 "contexts": formatted_context,
                 "response": result.strip(),  # Strip unnecessary whitespace
+                "time_to_first_token": time_to_first_token,
+                "latency": time.perf_counter() - start,
+                "context_tokens_saved": saved_tokens,
             }
         else:
             formatted_context = self.__format_docs__(docs)  # Format the documents into a context string
             # generate prompt
-            formatted_input = self.prompt.format(context=formatted_context, question=question)
-
-            print("DEBUG:")
-            print(formatted_input)
+            with tracer.span("query.prompt"):
+                formatted_input = self.prompt.format(context=formatted_context, question=question)
 
-            result = rag_chain.invoke(formatted_input)
+            with tracer.span("query.llm", prompt_tokens=token_count(formatted_input)) as span:
+                result = rag_chain.invoke(formatted_input)
+                span.set(response_tokens=token_count(result))
 
-            if "The context explains that" in result:
-                cleaned_response = result.replace("The context explains that ", "")
-                return cleaned_response
+            if CLEANUP_PHRASE in result:
+                result = result.replace(CLEANUP_PHRASE, "")
 
+            if self.answer_cache is not None:
+                self.answer_cache.store(question, vector, params, result, [doc.page_content for doc in docs])
             return result
 
+    def stream_response(self, question, search_type="mmr", k=4, fetch_k=20, temperature=None):
+        """
+        Streaming variant of get_response: yield the answer piece by piece as the LLM produces it
+        """
+        self.refresh_index()
+        params = self.__cache_params__(search_type, k, fetch_k, temperature)
+        cached, vector = self.__lookup_cache__(question, params)
+        if cached:
+            yield cached["answer"]
+            return
+
+        docs = self.__retrieve__(question, search_type, k, fetch_k, vector)
+        docs, _ = self.__pack__(question, docs)
+        formatted_context = self.__format_docs__(docs)
+        formatted_input = self.prompt.format(context=formatted_context, question=question)
+        pieces = []
+        with tracer.span("query.llm", prompt_tokens=token_count(formatted_input)) as span:
+            for piece in clean_stream(self.__chain__(temperature).stream(formatted_input)):
+                pieces.append(piece)
+                yield piece
+            span.set(response_tokens=token_count("".join(pieces)))
+
+        if self.answer_cache is not None:
+            self.answer_cache.store(question, vector, params, "".join(pieces), [doc.page_content for doc in docs])
+
+    def get_responses(self, questions, search_type="mmr", k=4, fetch_k=20, eval_mode=False, temperature=None,
+                      max_concurrency=4):
+        """
+        Batch variant of get_response, see aget_responses
+        """
+        return asyncio.run(self.aget_responses(questions, search_type, k, fetch_k, eval_mode, temperature, max_concurrency))
+
+    async def aget_responses(self, questions, search_type="mmr", k=4, fetch_k=20, eval_mode=False, temperature=None,
+                             max_concurrency=4):
+        """
+        Answer several questions at once: the query embeddings are computed in one encoder call,
+        then retrieval and LLM requests run concurrently (at most max_concurrency in flight).
+        Return one dict per question (user_input, contexts, response, time_to_first_token, latency,
+        context_tokens_saved),
+        where latency covers that item's retrieval and generation.
+        """
+        questions = list(questions)
+        self.refresh_index()
+        params = self.__cache_params__(search_type, k, fetch_k, temperature)
+        with tracer.span("query.embed", questions=len(questions)):
+            vectors = await asyncio.to_thread(self.embedding_function.embed_documents, questions)
+        if not eval_mode and self.answer_cache is not None:
+            self.answer_cache.invalidate_if_stale(read_index_version(self.index.directory))
+        rag_chain = self.__chain__(temperature)
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def answer(question, vector):
+            async with semaphore:
+                start = time.perf_counter()
+                cached = None
+                if not eval_mode and self.answer_cache is not None:
+                    with tracer.span("query.cache") as span:
+                        cached = self.answer_cache.lookup(vector, params)
+                        span.set(cache_hits=int(cached is not None))
+                if cached:
+                    return {
+                        "user_input": question,
+                        "contexts": cached["contexts"],
+                        "response": cached["answer"],
+                        "time_to_first_token": time.perf_counter() - start,
+                        "latency": time.perf_counter() - start,
+                        "context_tokens_saved": 0,
+                    }
+
+                docs = await asyncio.to_thread(self.__retrieve__, question, search_type, k, fetch_k, vector)
+                docs, saved_tokens = self.__pack__(question, docs)
+                if eval_mode:
+                    # only evalaute top context due to my PC spec
+                    contexts = [docs[0].page_content] if docs else ["No relevant documents found."]
+                    formatted_input = self.prompt.format(context=contexts, question=question)
+                else:
+                    contexts = [doc.page_content for doc in docs]
+                    formatted_input = self.prompt.format(context=self.__format_docs__(docs), question=question)
+
+                time_to_first_token = None
+                pieces = []
+                with tracer.span("query.llm", prompt_tokens=token_count(formatted_input)) as span:
+                    async for piece in rag_chain.astream(formatted_input):
+                        if time_to_first_token is None:
+                            time_to_first_token = time.perf_counter() - start
+                        pieces.append(piece)
+                    result = "".join(pieces).replace(CLEANUP_PHRASE, "").strip()
+                    span.set(response_tokens=token_count(result), time_to_first_token=time_to_first_token)
+
+                if not eval_mode and self.answer_cache is not None:
+                    self.answer_cache.store(question, vector, params, result, contexts)
+                return {
+                    "user_input": question,
+                    "contexts": contexts,
+                    "response": result,
+                    "time_to_first_token": time_to_first_token,
+                    "latency": time.perf_counter() - start,
+                    "context_tokens_saved": saved_tokens,
+                }
+
+        return await asyncio.gather(*(answer(question, vector) for question, vector in zip(questions, vectors)))
+
+
+class ResourceManager:
+    """
+    Process-wide holder of the embedding model, vector store and LLM client.
+    One instance is shared by every session (e.g. Streamlit reruns), and each component
+    is only rebuilt when the config values it depends on change.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.resources = {}  # name -> (config key, resource)
+        self.app = None
+        self.app_key = None
+        self.warm_key = None
+
+    def _get(self, name, key, factory):
+        cached = self.resources.get(name)
+        if cached and cached[0] == key:
+            return cached[1]
+        resource = factory()
+        self.resources[name] = (key, resource)
+        return resource
+
+    def get_app(self, config):
+        """
+        Return a RAGApp built from the shared components for this config
+        """
+        embedding_model = config["embedding"]["model"]
+        normalize = config["embedding"].get("normalize", False)
+        query_runtime = config["embedding"].get("query_runtime", "torch")
+        onnx_dir = config["embedding"].get("onnx_dir")
+        db_dir = config["embedding"]["db_dir"]
+        llm_model = config["llm"]["model"]
+        max_token = config["llm"]["max_token"]
+        temperature = config["llm"]["temperature"]
+        llm_backend = config["llm"].get("backend", "endpoint")
+        local_llm = config["llm"].get("local", {})
+
+        with self.lock:
+            embedding_key = (embedding_model, normalize, query_runtime, onnx_dir)
+            embedding_function = self._get(
+                "embedding", embedding_key,
+                lambda: create_embedding_function(embedding_model, normalize, query_runtime, onnx_dir)
+            )
+            vector_store = config["llm"].get("vector_store", "chroma")
+            shard_routing = config["llm"].get("shard_routing", {})
+            # a running app switches to newer index versions by itself (RAGApp.refresh_index)
+            db, db_version = self._get(
+                "db", (embedding_key, db_dir, vector_store, tuple(sorted(shard_routing.items()))),
+                lambda: open_vector_store(db_dir, embedding_function, vector_store, shard_routing)
+            )
+            llm_key = (llm_model, max_token, temperature, llm_backend, tuple(sorted(local_llm.items())))
+            llm = self._get(
+                "llm", llm_key, lambda: create_llm(llm_model, max_token, temperature, llm_backend, local_llm)
+            )
+
+            cache_config = config.get("answer_cache", {})
+            cache_key = (embedding_key, db_dir, tuple(sorted(cache_config.items())))
+            answer_cache = self._get("answer_cache", cache_key, lambda: create_answer_cache(cache_config))
+
+            hybrid_alpha = config["llm"].get("hybrid_alpha", 0.5)
+            context_token_budget = config["llm"].get("context_token_budget")
+            app_key = (embedding_key, db_dir, vector_store, tuple(sorted(shard_routing.items())), hybrid_alpha,
+                       context_token_budget, llm_key, cache_key)
+            if self.app_key != app_key:
+                self.app = RAGApp(embedding_model, llm_model, max_token, temperature, normalize, db_dir,
+                                  llm=llm, embedding_function=embedding_function, db=db, answer_cache=answer_cache,
+                                  llm_backend=llm_backend, local_llm=local_llm,
+                                  vector_store=vector_store, hybrid_alpha=hybrid_alpha,
+                                  context_token_budget=context_token_budget, shard_routing=shard_routing,
+                                  index_version=db_version)
+                self.app_key = app_key
+            return self.app
+
+    def warm_up(self, config):
+        """
+        Load every component up front (e.g. at server start) so the first question does not pay for it
+        """
+        app = self.get_app(config)
+        if self.warm_key != self.app_key:
+            app.embedding_function.embed_query("warm up")
+            self.warm_key = self.app_key
+        return app
+
+
+# shared by every user of this process
+resources = ResourceManager()
+
+
 def main():
 
     # load config
     with open('config.yaml') as file:
         config = yaml.safe_load(file.read())
+    tracer.configure(config.get("tracing", {}))
     
     try:
         # Instanace 
-        rag_app = RAGApp(config["embedding"]["model"], config["llm"]["model"], config["llm"]["max_token"], config["llm"]["temperature"])
+        rag_app = resources.get_app(config)
 
         # User Input
         question = input("Enter your question:")
@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import threading
+import time
+from typing import Optional
+
+# langchain
+from langchain_core.language_models.llms import LLM
+from langchain_core.outputs import GenerationChunk
+from pydantic import PrivateAttr
+
+
+def prompt_prefix(prompt):
+    """
+    Fixed instruction text of a PromptTemplate (everything before the first variable)
+    """
+    return prompt.template.split("{", 1)[0]
+
+
+class LocalLlamaLLM(LLM):
+    """
+    Quantized GGUF model run on the local CPU with llama.cpp (pip install llama-cpp-python).
+    The KV state after the fixed instruction prefix of the prompt is computed once
+    (cache_prefix) and restored before each request, so only the context and the question
+    are evaluated per answer. Requests are serialized because one model holds one KV cache.
+    """
+    model_path: str
+    n_ctx: int = 4096
+    n_threads: Optional[int] = None
+    max_tokens: int = 512
+    temperature: float = 0.4
+
+    _client = PrivateAttr(default=None)
+    _lock = PrivateAttr(default_factory=threading.Lock)
+    _prefix_tokens = PrivateAttr(default=None)
+    _prefix_state = PrivateAttr(default=None)
+
+    @property
+    def _llm_type(self):
+        return "llama_cpp"
+
+    def load(self):
+        if self._client is None:
+            from llama_cpp import Llama
+
+            start = time.perf_counter()
+            self._client = Llama(model_path=self.model_path, n_ctx=self.n_ctx, n_threads=self.n_threads, verbose=False)
+            print(f"Local LLM loaded from {self.model_path} in {time.perf_counter() - start:.2f}s")
+        return self._client
+
+    def cache_prefix(self, prefix):
+        """
+        Evaluate the instruction prefix once and keep its KV state for every later request
+        """
+        with self._lock:
+            client = self.load()
+            self._prefix_tokens = client.tokenize(prefix.encode("utf-8"), add_bos=True)
+            client.reset()
+            client.eval(self._prefix_tokens)
+            self._prefix_state = client.save_state()
+
+    def _restore_prefix(self, client):
+        # llama.cpp reuses the longest common token prefix of the previous evaluation,
+        # restore the prefix state only if the current KV cache no longer starts with it
+        if self._prefix_state is None:
+            return
+        n_prefix = len(self._prefix_tokens)
+        if client.n_tokens < n_prefix or list(client.input_ids[:n_prefix]) != list(self._prefix_tokens):
+            client.load_state(self._prefix_state)
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        with self._lock:
+            client = self.load()
+            self._restore_prefix(client)
+            for part in client.create_completion(
+                prompt, max_tokens=kwargs.get("max_tokens", self.max_tokens),
+                temperature=kwargs.get("temperature", self.temperature), stop=stop, stream=True,
+            ):
+                chunk = GenerationChunk(text=part["choices"][0]["text"])
+                if run_manager:
+                    run_manager.on_llm_new_token(chunk.text, chunk=chunk)
+                yield chunk
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        return "".join(chunk.text for chunk in self._stream(prompt, stop, run_manager, **kwargs))
+
+
+class StubLLM(LLM):
+    """
+    Deterministic stand-in for the LLM endpoint (offline runs, evaluation dry runs and benchmarks).
+    The answer is derived from a hash of the prompt, the first token arrives after
+    first_token_latency seconds and every following token after token_latency seconds.
+    """
+    first_token_latency: float = 0.05
+    token_latency: float = 0.005
+    n_tokens: int = 32
+
+    @property
+    def _llm_type(self):
+        return "stub"
+
+    def _tokens(self, prompt):
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+        return [f"{digest[i % len(digest):][:4]} " for i in range(self.n_tokens)]
+
+    def _call(self, prompt, stop=None, run_manager=None, **kwargs):
+        time.sleep(self.first_token_latency + self.token_latency * (self.n_tokens - 1))
+        return "".join(self._tokens(prompt))
+
+    def _stream(self, prompt, stop=None, run_manager=None, **kwargs):
+        for i, token in enumerate(self._tokens(prompt)):
+            time.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield GenerationChunk(text=token)
+
+    async def _acall(self, prompt, stop=None, run_manager=None, **kwargs):
+        await asyncio.sleep(self.first_token_latency + self.token_latency * (self.n_tokens - 1))
+        return "".join(self._tokens(prompt))
+
+    async def _astream(self, prompt, stop=None, run_manager=None, **kwargs):
+        for i, token in enumerate(self._tokens(prompt)):
+            await asyncio.sleep(self.first_token_latency if i == 0 else self.token_latency)
+            yield GenerationChunk(text=token)
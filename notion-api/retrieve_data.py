@@ -1,30 +1,251 @@
 import requests
 import json
 import unicodedata
+import fnmatch
 import os
+import random
+import sys
+import threading
+import time
 import yaml
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
 from dotenv import load_dotenv
 
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+from corpus import CorpusWriter
+from tracing import NOOP_SPAN, tracer
 
-def get_all_blocks(page_id, headers, notion_api_url):
+TEXT_BLOCK_TYPES = ["paragraph", "heading_1", "heading_2", "heading_3", "bulleted_list_item", "numbered_list_item"]
+# a page answering these was deleted or is no longer shared with the integration
+REMOVED_STATUS = [403, 404]
+RETRY_STATUS = [429, 500, 502, 503, 504]
+
+
+class NotionAPIError(Exception):
+    """
+    A request still failed after all retries (the crawl stops instead of keeping a truncated page)
+    """
+
+
+class RateLimiter:
+    """
+    Thread-safe limiter that spaces requests out to at most `rate` per second
+    (Notion allows an average of 3 requests per second per integration).
+    The rate adapts to the server: a 429 halves it (down to min_rate) and pauses every
+    worker for Retry-After seconds, each successful request raises it again by 5% of `rate`.
+    max_retries and backoff set how often and how long a failed request is retried.
+    """
+    def __init__(self, rate=3.0, min_rate=0.5, max_retries=5, backoff=1.0):
+        self.max_rate = rate
+        self.rate = rate
+        self.min_rate = min(min_rate, rate)
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.next_time = 0.0
+        self.lock = threading.Lock()
+
+    @property
+    def interval(self):
+        return 1.0 / self.rate if self.rate else 0.0
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            delay = self.next_time - now
+            self.next_time = max(now, self.next_time) + self.interval
+        if delay > 0:
+            time.sleep(delay)
+
+    def success(self):
+        with self.lock:
+            if self.rate < self.max_rate:
+                self.rate = min(self.max_rate, self.rate + 0.05 * self.max_rate)
+
+    def throttle(self, delay):
+        """
+        Slow down after a 429: no request is sent by any worker for `delay` seconds
+        """
+        with self.lock:
+            if self.rate:
+                self.rate = max(self.min_rate, self.rate / 2)
+            self.next_time = max(self.next_time, time.monotonic() + delay)
+
+    def backoff_delay(self, attempt):
+        # exponential backoff with jitter so the workers do not retry in lockstep
+        return self.backoff * 2 ** attempt * random.uniform(0.5, 1.0)
+
+
+def retry_after(response):
+    """
+    Seconds to wait from the Retry-After header of a response (None if absent or not in seconds)
+    """
+    try:
+        return float(response.headers.get("Retry-After"))
+    except (TypeError, ValueError):
+        return None
+
+
+def request_with_retry(http, url, headers, rate_limiter=None, span=NOOP_SPAN, method="GET", body=None):
+    """
+    Send a request (GET, or POST with a JSON body) and retry 429, 5xx and connection errors with backoff.
+    Return the last response; raise NotionAPIError if the request never got one.
+    """
+    rate_limiter = rate_limiter or RateLimiter(0)
+    for attempt in range(rate_limiter.max_retries + 1):
+        rate_limiter.wait()
+        try:
+            response = http.request(method, url, headers=headers, json=body)
+        except requests.RequestException as e:
+            if attempt == rate_limiter.max_retries:
+                raise NotionAPIError(f"{url}: {e}") from e
+            print(f"Retrying {url} after error: {e}")
+            time.sleep(rate_limiter.backoff_delay(attempt))
+            span.incr("retries")
+            continue
+
+        span.incr("http_calls")
+        if response.status_code not in RETRY_STATUS or attempt == rate_limiter.max_retries:
+            if response.status_code == 200:
+                rate_limiter.success()
+            return response
+        span.incr("retries")
+        if response.status_code == 429:
+            # the next rate_limiter.wait() sleeps until the server accepts requests again
+            rate_limiter.throttle(retry_after(response) or rate_limiter.backoff_delay(attempt))
+        else:
+            time.sleep(rate_limiter.backoff_delay(attempt))
+
+
+class CrawlCheckpoint:
+    """
+    Append-only JSON lines log of a crawl in progress: completed pages and, per block, the
+    children fetched so far with the pagination cursor to continue from. A crawl started
+    again with the same file reuses everything recorded instead of refetching it.
+    Call clear() once the crawl output is written.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pages = {}
+        self.listings = {}
+        if os.path.exists(path):
+            self._load()
+            if self.pages or self.listings:
+                print(f"Resuming crawl from {path}: {len(self.pages)} pages, {len(self.listings)} block lists")
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.file = open(path, "a", encoding="utf-8")
+
+    def _load(self):
+        with open(self.path, "r", encoding="utf-8") as f:
+            content = f.read()
+        if not content.endswith("\n"):
+            # drop the record cut off by the interruption
+            content = content[:content.rfind("\n") + 1]
+            with open(self.path, "w", encoding="utf-8") as f:
+                f.write(content)
+        for line in content.splitlines():
+            record = json.loads(line)
+            if "page" in record:
+                self.pages[record["page"][0]] = tuple(record["page"])
+            else:
+                listing = self.listings.setdefault(record["block"], {"blocks": [], "next_cursor": None})
+                if record["start_cursor"] is None:
+                    # the list was fetched again from the start
+                    listing["blocks"] = []
+                listing["blocks"].extend(record["results"])
+                listing["next_cursor"] = record["next_cursor"]
+                listing["complete"] = record["next_cursor"] is None
+
+    def _append(self, record):
+        with self.lock:
+            self.file.write(json.dumps(record, ensure_ascii=False) + "\n")
+            self.file.flush()
+
+    def page(self, page_id):
+        """
+        Return the recorded (page_id, title, last_edited_time, full_text), None if not crawled yet
+        """
+        return self.pages.get(page_id)
+
+    def add_page(self, page):
+        self._append({"page": list(page)})
+
+    def listing(self, block_id):
+        """
+        Return {"blocks", "next_cursor", "complete"} of the children already fetched, None if none
+        """
+        return self.listings.get(block_id)
+
+    def add_listing(self, block_id, start_cursor, blocks, next_cursor):
+        self._append({"block": block_id, "start_cursor": start_cursor,
+                      "results": [compact_block(block) for block in blocks], "next_cursor": next_cursor})
+
+    def close(self):
+        self.file.close()
+
+    def clear(self):
+        self.close()
+        os.remove(self.path)
+
+
+def create_session(headers, pool_size=10):
+    """
+    Create a pooled HTTP session shared by all crawler workers
+    """
+    session = requests.Session()
+    session.headers.update(headers)
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+def api_base_url(notion_api_url):
+    """
+    Return the API root (e.g. https://api.notion.com/v1) from the blocks endpoint URL
+    """
+    base = notion_api_url.rstrip("/")
+    if base.endswith("/blocks"):
+        base = base[:-len("/blocks")]
+    return base
+
+
+def get_all_blocks(page_id, headers, notion_api_url, session=None, rate_limiter=None, checkpoint=None):
     """
     Get all blcoks from Notion Page
+    Raise NotionAPIError if a request fails after the retries, so a page is never silently truncated.
+    With a checkpoint, every fetched batch is recorded and an interrupted listing continues from its cursor.
     """
+    http = session or requests
     all_blocks = []
-    url = f"{notion_api_url}/{page_id}/children"
-    while url:
-        response = requests.get(url, headers=headers)
-        if response.status_code == 200:
+    cursor = None
+    listing = checkpoint.listing(page_id) if checkpoint else None
+    if listing:
+        if listing["complete"]:
+            return list(listing["blocks"])
+        all_blocks = list(listing["blocks"])
+        cursor = listing["next_cursor"]
+    with tracer.span("crawl.blocks") as span:
+        while True:
+            start_cursor = cursor
+            url = f"{notion_api_url}/{page_id}/children"
+            if start_cursor:
+                url = f"{url}?start_cursor={start_cursor}"
+            response = request_with_retry(http, url, headers, rate_limiter, span)
+            if response.status_code != 200:
+                span.incr("http_errors")
+                raise NotionAPIError(f"Error: {response.status_code}, {response.text}")
             data = response.json()
-            all_blocks.extend(data.get("results", []))
-            
-            if data.get("has_more"):
-                url = f"{notion_api_url}/{page_id}/children?start_cursor={data.get('next_cursor')}"
-            else:
-                url = None
-        else:
-            print(f"Error: {response.status_code}, {response.text}")
-            break
+            results = data.get("results", [])
+            all_blocks.extend(results)
+            cursor = data.get("next_cursor") if data.get("has_more") else None
+            if checkpoint:
+                checkpoint.add_listing(page_id, start_cursor, results, cursor)
+            if cursor is None:
+                break
+        span.set(blocks=len(all_blocks))
     return all_blocks
 
 def normalize_text_data(content_list):
@@ -34,25 +255,81 @@ def normalize_text_data(content_list):
     normalized_content_list = [unicodedata.normalize('NFKC', text).strip().lower() for text in content_list]   
     return normalized_content_list 
 
-def get_page_title(page_id, headers):
+def fetch_page(page_id, headers, session=None, rate_limiter=None, notion_api_url="https://api.notion.com/v1/blocks"):
     """
-    Get page title from Notion Page
+    Get page object (properties, last_edited_time, ...) from Notion Page.
+    Return (page object or None, HTTP status); the status is None when no response came back.
     """
-    url = f"https://api.notion.com/v1/pages/{page_id}"
-    response = requests.get(url, headers=headers)
+    http = session or requests
+    url = f"{api_base_url(notion_api_url)}/pages/{page_id}"
+    with tracer.span("crawl.page") as span:
+        try:
+            response = request_with_retry(http, url, headers, rate_limiter, span)
+        except NotionAPIError as e:
+            print(f"Error: {e}")
+            span.set(http_errors=1)
+            return None, None
+        span.set(http_errors=int(response.status_code != 200))
     if response.status_code == 200:
-        page_data = response.json()
-        properties = page_data.get("properties", {})
-        for prop in properties.values():
-            if prop.get("type") == "title":
-                title_texts = prop.get("title", [])
-                return "".join([text["plain_text"] for text in title_texts])
-        return "Untitled"
+        return response.json(), 200
     else:
         print(f"Error: {response.status_code}, {response.text}")
+        return None, response.status_code
+
+
+def get_page(page_id, headers, session=None, rate_limiter=None, notion_api_url="https://api.notion.com/v1/blocks"):
+    """
+    Get page object (properties, last_edited_time, ...) from Notion Page (None if it could not be read)
+    """
+    return fetch_page(page_id, headers, session, rate_limiter, notion_api_url)[0]
+
+def lookup_page(page_id, page_objects, headers, session=None, rate_limiter=None,
+                notion_api_url="https://api.notion.com/v1/blocks"):
+    """
+    Page object already listed by discover_pages, otherwise requested with get_page
+    """
+    if page_objects and page_id in page_objects:
+        return page_objects[page_id]
+    return get_page(page_id, headers, session, rate_limiter, notion_api_url)
+
+def page_title(page_data):
+    """
+    Read the title property of a page object
+    """
+    properties = page_data.get("properties", {})
+    for prop in properties.values():
+        if prop.get("type") == "title":
+            title_texts = prop.get("title", [])
+            return "".join([text["plain_text"] for text in title_texts])
+    return "Untitled"
+
+def page_metadata(page_data):
+    """
+    Return (title, last_edited_time) of a page object, (None, None) if it could not be read
+    """
+    if page_data is None:
+        return None, None
+    return page_title(page_data), page_data.get("last_edited_time")
+
+
+def get_page_title(page_id, headers, session=None, rate_limiter=None, notion_api_url="https://api.notion.com/v1/blocks"):
+    """
+    Get page title from Notion Page
+    """
+    page_data = get_page(page_id, headers, session, rate_limiter, notion_api_url)
+    if page_data is None:
         return None
+    return page_title(page_data)
+
+def table_row_text(row):
+    """
+    Join the cells of a table row with tabs
+    """
+    row_cells = row["table_row"]["cells"]
+    row_text = ["".join([cell["text"]["content"] for cell in cell_texts if "text" in cell]) for cell_texts in row_cells]
+    return "\t".join(row_text)
 
-def extract_text_from_blocks(blocks, headers, notion_api_url):
+def extract_text_from_blocks(blocks, headers, notion_api_url, rate_limiter=None, checkpoint=None):
     """
     Extract text from blocks and return contents
     """
@@ -61,32 +338,396 @@ def extract_text_from_blocks(blocks, headers, notion_api_url):
         block_type = block.get("type")
         
         # text block
-        if block_type in ["paragraph", "heading_1", "heading_2", "heading_3", "bulleted_list_item", "numbered_list_item"]:
+        if block_type in TEXT_BLOCK_TYPES:
             rich_texts = block[block_type].get("rich_text", [])
             content_list.extend([text["text"]["content"] for text in rich_texts if "text" in text])
         
         # table blcok
         elif block_type == "table":
             table_id = block["id"]
-            child_blocks = get_all_blocks(table_id, headers, notion_api_url)
+            child_blocks = get_all_blocks(table_id, headers, notion_api_url, rate_limiter=rate_limiter,
+                                          checkpoint=checkpoint)
             for row in child_blocks:
                 if row.get("type") == "table_row":
-                    row_cells = row["table_row"]["cells"]
-                    row_text = ["".join([cell["text"]["content"] for cell in cell_texts if "text" in cell]) for cell_texts in row_cells]
-                    content_list.append("\t".join(row_text)) 
+                    content_list.append(table_row_text(row))
         
         # children block 
         if block.get("has_children"):
             child_id = block["id"]
-            child_blocks = get_all_blocks(child_id, headers, notion_api_url)
-            content_list.extend(extract_text_from_blocks(child_blocks, headers, notion_api_url))
+            child_blocks = get_all_blocks(child_id, headers, notion_api_url, rate_limiter=rate_limiter,
+                                          checkpoint=checkpoint)
+            content_list.extend(extract_text_from_blocks(child_blocks, headers, notion_api_url, rate_limiter, checkpoint))
     
     return content_list
 
 
-def main():
+def fetch_block_trees(root_ids, headers, notion_api_url, executor, session=None, rate_limiter=None, cached_blocks=None,
+                      checkpoint=None):
+    """
+    Fetch the block trees of several pages concurrently, level by level.
+    Children are attached to their parent block under "children" so the text can
+    be extracted afterwards without any further request.
+    If cached_blocks (block id -> cached block) is given, the subtree of a block whose
+    last_edited_time did not change is taken from the cache instead of being refetched.
+    Block lists already recorded in the checkpoint are not refetched either.
+    """
+    cached_blocks = cached_blocks or {}
 
-    # .env
+    def fetch(block_id):
+        return get_all_blocks(block_id, headers, notion_api_url, session, rate_limiter, checkpoint)
+
+    with tracer.span("crawl.trees", pages=len(root_ids)) as span:
+        trees = dict(zip(root_ids, executor.map(fetch, root_ids)))
+        level = [block for blocks in trees.values() for block in blocks]
+        while level:
+            parents = []
+            for block in level:
+                if not (block.get("has_children") or block.get("type") == "table"):
+                    continue
+                cached = cached_blocks.get(block["id"])
+                if cached and "children" in cached and cached.get("last_edited_time") == block.get("last_edited_time"):
+                    block["children"] = cached["children"]
+                    span.incr("cache_hits")
+                else:
+                    parents.append(block)
+            next_level = []
+            for block, children in zip(parents, executor.map(fetch, [block["id"] for block in parents])):
+                block["children"] = children
+                next_level.extend(children)
+            span.incr("levels")
+            level = next_level
+    return trees
+
+
+def extract_text_from_tree(blocks):
+    """
+    Extract text from blocks whose children were already fetched by fetch_block_trees.
+    Produces the same contents as extract_text_from_blocks.
+    """
+    content_list = []
+    for block in blocks:
+        block_type = block.get("type")
+        children = block.get("children", [])
+
+        # text block
+        if block_type in TEXT_BLOCK_TYPES:
+            rich_texts = block[block_type].get("rich_text", [])
+            content_list.extend([text["text"]["content"] for text in rich_texts if "text" in text])
+
+        # table blcok
+        elif block_type == "table":
+            for row in children:
+                if row.get("type") == "table_row":
+                    content_list.append(table_row_text(row))
+
+        # children block
+        if block.get("has_children"):
+            content_list.extend(extract_text_from_tree(children))
+
+    return content_list
+
+
+def crawl_pages(page_ids, headers, notion_api_url, max_workers=4, requests_per_second=3.0, rate_limiter=None,
+                checkpoint=None, page_objects=None):
+    """
+    Crawl pages concurrently with a bounded worker pool and a pooled session.
+    Return a list of (page_id, title, last_edited_time, full_text) in the order of page_ids
+    (title and last_edited_time are None if the page could not be read).
+    Pages completed in the checkpoint are taken from it, and every page read is recorded there.
+    Page objects listed by discover_pages (page_objects) are used instead of requesting each page.
+    """
+    session = create_session(headers, pool_size=max_workers)
+    rate_limiter = rate_limiter or RateLimiter(requests_per_second)
+    done = {page_id: checkpoint.page(page_id) for page_id in page_ids if checkpoint and checkpoint.page(page_id)}
+    to_fetch = [page_id for page_id in page_ids if page_id not in done]
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        page_data = dict(zip(to_fetch, executor.map(
+            lambda page_id: lookup_page(page_id, page_objects, headers, session, rate_limiter, notion_api_url), to_fetch
+        )))
+        trees = fetch_block_trees(to_fetch, headers, notion_api_url, executor, session, rate_limiter,
+                                  checkpoint=checkpoint)
+
+    pages = []
+    for page_id in page_ids:
+        if page_id in done:
+            pages.append(done[page_id])
+            continue
+        page_content = extract_text_from_tree(trees[page_id])
+        normalized_page_content = normalize_text_data(page_content)
+        page = (page_id, *page_metadata(page_data[page_id]), "\n".join(normalized_page_content))
+        if checkpoint and page_data[page_id] is not None:
+            checkpoint.add_page(page)
+        pages.append(page)
+    return pages
+
+
+def iter_pages(page_ids, headers, notion_api_url, max_workers=4, requests_per_second=3.0, rate_limiter=None,
+               checkpoint=None, page_objects=None):
+    """
+    Streaming variant of crawl_pages: yield (page_id, title, last_edited_time, full_text) in the order of page_ids
+    as soon as each page is complete. At most max_workers pages are in flight, so memory
+    does not grow with the size of the workspace.
+    Every complete page is recorded in the checkpoint; recorded pages are yielded without any request.
+    """
+    session = create_session(headers, pool_size=max_workers * 2)
+    rate_limiter = rate_limiter or RateLimiter(requests_per_second)
+    # pages and their blocks use separate pools so a page worker never waits on its own pool
+    with ThreadPoolExecutor(max_workers=max_workers) as page_executor, \
+            ThreadPoolExecutor(max_workers=max_workers) as block_executor:
+
+        def crawl(page_id):
+            if checkpoint and checkpoint.page(page_id):
+                return checkpoint.page(page_id)
+            data = lookup_page(page_id, page_objects, headers, session, rate_limiter, notion_api_url)
+            tree = fetch_block_trees([page_id], headers, notion_api_url, block_executor, session, rate_limiter,
+                                     checkpoint=checkpoint)
+            normalized_page_content = normalize_text_data(extract_text_from_tree(tree[page_id]))
+            page = (page_id, *page_metadata(data), "\n".join(normalized_page_content))
+            if checkpoint and data is not None:
+                checkpoint.add_page(page)
+            return page
+
+        pending = deque()
+        for page_id in page_ids:
+            pending.append(page_executor.submit(crawl, page_id))
+            if len(pending) >= max_workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
+
+
+def compact_block(block):
+    """
+    Keep only the fields of a block needed to rebuild its text
+    """
+    compact = {key: block[key] for key in ("id", "type", "has_children", "last_edited_time") if key in block}
+    block_type = block.get("type")
+    if block_type in TEXT_BLOCK_TYPES or block_type == "table_row":
+        compact[block_type] = block[block_type]
+    if "children" in block:
+        compact["children"] = [compact_block(child) for child in block["children"]]
+    return compact
+
+
+def index_blocks(blocks, index=None):
+    """
+    Map block id -> block for every block of a cached tree
+    """
+    index = {} if index is None else index
+    for block in blocks:
+        index[block["id"]] = block
+        index_blocks(block.get("children", []), index)
+    return index
+
+
+def load_cache(cache_file):
+    """
+    Load the incremental sync cache (page id -> title, last_edited_time and block tree)
+    """
+    if not os.path.exists(cache_file):
+        return {"pages": {}}
+    with open(cache_file, "r", encoding="utf-8") as f:
+        return json.load(f)
+
+
+def save_cache(cache, cache_file):
+    """
+    Write the sync cache atomically so an interrupted run keeps the previous cache
+    """
+    tmp_file = f"{cache_file}.tmp"
+    with open(tmp_file, "w", encoding="utf-8") as f:
+        json.dump(cache, f, ensure_ascii=False)
+    os.replace(tmp_file, cache_file)
+
+
+def sync_pages(page_ids, headers, notion_api_url, cache, max_workers=4, requests_per_second=3.0, rate_limiter=None,
+               checkpoint=None, page_objects=None):
+    """
+    Incrementally sync pages against the cache.
+    Unchanged pages (same last_edited_time) are rebuilt from cached blocks, changed pages
+    only refetch the subtrees whose last_edited_time moved.
+    Note: Notion does not always bump a parent block's last_edited_time when a nested
+    block is edited, so delete the cache file to force a full refetch if needed.
+    Return (pages, report) where pages is a list of (page_id, title, last_edited_time, full_text) and
+    report lists the added, changed, unchanged and removed page ids, and the pages served from the cache
+    because they could not be read (unreadable). Only transient failures (429, 5xx, timeouts after every
+    retry) keep the cached copy; a page answering 404 or 403 was deleted or unshared and counts as removed.
+    Block lists recorded in the checkpoint by an interrupted sync are not refetched.
+    """
+    cached_pages = cache.get("pages", {})
+    report = {"added": [], "changed": [], "unchanged": [], "removed": [], "unreadable": []}
+
+    session = create_session(headers, pool_size=max_workers)
+    rate_limiter = rate_limiter or RateLimiter(requests_per_second)
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def lookup(page_id):
+            if page_objects and page_id in page_objects:
+                return page_objects[page_id], 200
+            return fetch_page(page_id, headers, session, rate_limiter, notion_api_url)
+
+        lookups = list(executor.map(lookup, page_ids))
+        page_data = [data for data, _ in lookups]
+        statuses = [status for _, status in lookups]
+
+        to_fetch = []
+        cached_blocks = {}
+        for page_id, data in zip(page_ids, page_data):
+            if data is None:
+                continue
+            cached = cached_pages.get(page_id)
+            if cached is None:
+                report["added"].append(page_id)
+                to_fetch.append(page_id)
+            elif cached["last_edited_time"] != data.get("last_edited_time"):
+                report["changed"].append(page_id)
+                to_fetch.append(page_id)
+                index_blocks(cached["blocks"], cached_blocks)
+            else:
+                report["unchanged"].append(page_id)
+
+        trees = fetch_block_trees(to_fetch, headers, notion_api_url, executor, session, rate_limiter, cached_blocks,
+                                  checkpoint)
+
+    new_pages = {}
+    pages = []
+    for page_id, data, status in zip(page_ids, page_data, statuses):
+        if data is None:
+            # keep the cached copy (in the cache and in the corpus) when the page could not be read this time
+            if page_id not in cached_pages or status in REMOVED_STATUS:
+                continue
+            report["unreadable"].append(page_id)
+            new_pages[page_id] = cached_pages[page_id]
+            title, last_edited_time, blocks = (cached_pages[page_id][key] for key in ("title", "last_edited_time", "blocks"))
+        else:
+            if page_id in trees:
+                blocks = [compact_block(block) for block in trees[page_id]]
+            else:
+                blocks = cached_pages[page_id]["blocks"]
+            title = page_title(data)
+            last_edited_time = data.get("last_edited_time")
+            new_pages[page_id] = {"title": title, "last_edited_time": last_edited_time, "blocks": blocks}
+
+        page_content = extract_text_from_tree(blocks)
+        normalized_page_content = normalize_text_data(page_content)
+        pages.append((page_id, title, last_edited_time, "\n".join(normalized_page_content)))
+
+    report["removed"] = [page_id for page_id in cached_pages if page_id not in new_pages]
+    cache["pages"] = new_pages
+    return pages, report
+
+
+def plain_id(notion_id):
+    # Notion accepts ids with or without dashes, the API returns them with dashes
+    return notion_id.replace("-", "")
+
+
+def query_all(url, headers, session=None, rate_limiter=None, body=None):
+    """
+    Run a paginated POST endpoint (search, database query) and return every result, 100 per request
+    """
+    http = session or requests
+    body = dict(body or {}, page_size=100)
+    results = []
+    with tracer.span("crawl.discover") as span:
+        while True:
+            response = request_with_retry(http, url, headers, rate_limiter, span, method="POST", body=body)
+            if response.status_code != 200:
+                span.incr("http_errors")
+                raise NotionAPIError(f"Error: {response.status_code}, {response.text}")
+            data = response.json()
+            results.extend(data.get("results", []))
+            if not data.get("has_more"):
+                break
+            body["start_cursor"] = data.get("next_cursor")
+        span.set(objects=len(results))
+    return results
+
+
+def parent_id(notion_object):
+    """
+    Id of the page, database or block containing a page or database (None at the workspace level)
+    """
+    parent = notion_object.get("parent", {})
+    parent_type = parent.get("type")
+    if parent_type in ("page_id", "database_id", "block_id"):
+        return plain_id(parent[parent_type])
+    return None
+
+
+def title_matches(title, patterns):
+    return any(fnmatch.fnmatch(title.lower(), pattern.lower()) for pattern in patterns)
+
+
+def discover_pages(headers, notion_api_url, root_pages=None, databases=None, include=None, exclude=None,
+                   session=None, rate_limiter=None):
+    """
+    List the pages to crawl with the bulk endpoints instead of one pages/{id} request per page.
+    Every row of the given databases is listed with the database query endpoint. The search endpoint
+    lists the pages and databases shared with the integration, and a page is kept if it is one of
+    root_pages or has one of them among its ancestors (without roots nor databases every page is kept).
+    Note: a page nested in a block (e.g. a column) only matches if that block id is a root.
+    Titles are then filtered with the include/exclude glob patterns (case-insensitive, e.g. "Exam*").
+    Return {page id: page object}; the page objects carry the title and last_edited_time.
+    """
+    base = api_base_url(notion_api_url)
+    pages = {}
+    for database_id in databases or []:
+        for page in query_all(f"{base}/databases/{database_id}/query", headers, session, rate_limiter):
+            pages[page["id"]] = page
+
+    if root_pages or not databases:
+        roots = {plain_id(page_id) for page_id in root_pages or []}
+        objects = query_all(f"{base}/search", headers, session, rate_limiter)
+        parents = {plain_id(notion_object["id"]): parent_id(notion_object) for notion_object in objects}
+
+        def under_root(object_id):
+            seen = set()
+            while object_id and object_id not in seen:
+                if object_id in roots:
+                    return True
+                seen.add(object_id)
+                object_id = parents.get(object_id)
+            return False
+
+        for notion_object in objects:
+            if notion_object.get("object") != "page" or notion_object.get("archived"):
+                continue
+            if not roots or under_root(plain_id(notion_object["id"])):
+                pages.setdefault(notion_object["id"], notion_object)
+
+    selected = {}
+    for page_id, page in pages.items():
+        title = page_title(page)
+        if include and not title_matches(title, include):
+            continue
+        if exclude and title_matches(title, exclude):
+            continue
+        selected[page_id] = page
+    print(f"Discovered {len(pages)} pages, {len(selected)} selected by the filters")
+    return selected
+
+
+def resolve_pages(notion_config, headers, notion_api_url, page_ids, rate_limiter=None):
+    """
+    Return (page ids to crawl, known page objects): NOTION_PAGE_IDS as listed, or with
+    notion.discovery enabled the pages discovered under them and the configured databases
+    """
+    discovery = notion_config.get("discovery", {})
+    if not discovery.get("enabled", False):
+        return page_ids, {}
+    page_objects = discover_pages(
+        headers, notion_api_url, root_pages=discovery.get("root_pages", page_ids),
+        databases=discovery.get("databases"), include=discovery.get("include"), exclude=discovery.get("exclude"),
+        session=create_session(headers), rate_limiter=rate_limiter,
+    )
+    return list(page_objects), page_objects
+
+
+def load_notion_env():
+    """
+    Read the Notion settings from .env and return (headers, NOTION_API_URL, page ids)
+    """
     load_dotenv()
     NOTION_API_KEY = os.getenv('NOTION_API_KEY')
     NOTION_API_URL = os.getenv('NOTION_API_URL')
@@ -103,34 +744,90 @@ def main():
         "Authorization": f"Bearer {NOTION_API_KEY}",
         "Notion-Version": NOTION_VERSION
     }
+    return headers, NOTION_API_URL, PAGE_IDS_LIST
+
+
+def main():
+
+    # .env
+    headers, NOTION_API_URL, PAGE_IDS_LIST = load_notion_env()
 
     # load config
     with open('config.yaml') as file:
         config = yaml.safe_load(file.read())
+    tracer.configure(config.get("tracing", {}))
+
+    crawler_config = config["notion"].get("crawler", {})
+    max_workers = crawler_config.get("max_workers", 1)
+    rate_limiter = RateLimiter(crawler_config.get("requests_per_second", 3),
+                               min_rate=crawler_config.get("min_requests_per_second", 0.5),
+                               max_retries=crawler_config.get("max_retries", 5),
+                               backoff=crawler_config.get("backoff", 1.0))
+    # progress of an interrupted crawl, reused by the next run
+    checkpoint = CrawlCheckpoint(crawler_config.get("checkpoint_file", "notion-api/crawl_checkpoint.jsonl"))
 
     try:
-        all_content = {}
-        for page_id in PAGE_IDS_LIST:
+        PAGE_IDS_LIST, page_objects = resolve_pages(config["notion"], headers, NOTION_API_URL, PAGE_IDS_LIST, rate_limiter)
+        # database / parent page of the discovered pages (notion.corpus_file records it for sharding)
+        parents = {page_id: parent_id(page) for page_id, page in page_objects.items()}
 
-            title = get_page_title(page_id, headers)
-            blocks = get_all_blocks(page_id, headers, NOTION_API_URL)
-            page_content = extract_text_from_blocks(blocks, headers, NOTION_API_URL)
-            normalized_page_content = normalize_text_data(page_content)
+        # pages are written to the corpus snapshot as they are retrieved
+        corpus_file = config["notion"].get("corpus_file", "notion-api/notion_corpus.bin")
+        corpus = CorpusWriter(corpus_file)
+        if crawler_config.get("incremental", False):
+            # incremental sync: only refetch what changed since the last run
+            cache_file = crawler_config.get("cache_file", "notion-api/notion_cache.json")
+            cache = load_cache(cache_file)
+            pages, report = sync_pages(PAGE_IDS_LIST, headers, NOTION_API_URL, cache, max_workers=max_workers,
+                                       rate_limiter=rate_limiter, checkpoint=checkpoint, page_objects=page_objects)
+            for page_id, title, last_edited_time, full_text in pages:
+                corpus.add(page_id, title, full_text, last_edited_time, parents.get(page_id))
+            save_cache(cache, cache_file)
+
+            # delta for the later stages
+            report_file = crawler_config.get("sync_report", "notion-api/sync_report.json")
+            with open(report_file, "w", encoding="utf-8") as file:
+                json.dump(report, file, ensure_ascii=False, indent=4)
+            print(f"Sync: {len(report['added'])} added, {len(report['changed'])} changed, "
+                  f"{len(report['unchanged'])} unchanged, {len(report['removed'])} removed, "
+                  f"{len(report['unreadable'])} kept from the cache (unreadable)")
+        elif max_workers > 1:
+            # concurrent crawl
+            pages = crawl_pages(PAGE_IDS_LIST, headers, NOTION_API_URL, max_workers=max_workers,
+                                rate_limiter=rate_limiter, checkpoint=checkpoint, page_objects=page_objects)
+            for page_id, title, last_edited_time, full_text in pages:
+                corpus.add(page_id, title, full_text, last_edited_time, parents.get(page_id))
+                print(f"Retrieved the contents from {title}")
+        else:
+            for page_id in PAGE_IDS_LIST:
+                if checkpoint.page(page_id):
+                    _, title, last_edited_time, full_text = checkpoint.page(page_id)
+                    corpus.add(page_id, title, full_text, last_edited_time, parents.get(page_id))
+                    continue
 
-            # join the contents
-            full_text = "\n".join(normalized_page_content)
+                page_data = lookup_page(page_id, page_objects, headers, rate_limiter=rate_limiter,
+                                        notion_api_url=NOTION_API_URL)
+                title, last_edited_time = page_metadata(page_data)
+                blocks = get_all_blocks(page_id, headers, NOTION_API_URL, rate_limiter=rate_limiter, checkpoint=checkpoint)
+                page_content = extract_text_from_blocks(blocks, headers, NOTION_API_URL, rate_limiter, checkpoint)
+                normalized_page_content = normalize_text_data(page_content)
 
-            all_content[title] = full_text
-            print(f"Retrieved the contents from {title}")
+                # join the contents
+                full_text = "\n".join(normalized_page_content)
 
-        # save in json
-        with open(config["notion"]["content_file"], "w", encoding="utf-8") as file:
-            json.dump(all_content, file, ensure_ascii=False, indent=4)
+                corpus.add(page_id, title, full_text, last_edited_time, parents.get(page_id))
+                if page_data is not None:
+                    checkpoint.add_page((page_id, title, last_edited_time, full_text))
+                print(f"Retrieved the contents from {title}")
 
-        print("Content saved to notion_contents.json")
+        corpus.close()
+        checkpoint.clear()
+        print(f"Content saved to {corpus_file}")
 
     except Exception as e:
+        checkpoint.close()
         print(f"Error: {e}")
+        print(f"Progress is kept in {checkpoint.path}, run again to resume the crawl")
 
 # run
 if __name__ == "__main__":
@@ -0,0 +1,224 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import numpy as np
+import yaml
+
+# langchain
+from langchain_core.embeddings import Embeddings
+
+ONNX_MODEL_FILE = "model.int8.onnx"
+ONNX_CONFIG_FILE = "onnx_config.json"
+VERIFICATION_FILE = "verification.json"
+
+
+def export_onnx_model(model_name, output_dir):
+    """
+    Export the transformer of a sentence-transformers model to ONNX and quantize its
+    weights to int8 (dynamic quantization). The tokenizer and the pooling settings
+    are saved next to the model so the runtime needs neither torch nor transformers.
+    """
+    import torch
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from sentence_transformers import SentenceTransformer
+
+    os.makedirs(output_dir, exist_ok=True)
+    model = SentenceTransformer(model_name, device="cpu")
+    transformer = model[0]
+    pooling = model[1].get_pooling_mode_str() if len(model) > 1 else "mean"
+    if pooling not in ("mean", "cls"):
+        raise ValueError(f"Unsupported pooling for the ONNX export: {pooling}")
+
+    class HiddenStates(torch.nn.Module):
+        def __init__(self, auto_model):
+            super().__init__()
+            self.auto_model = auto_model
+
+        def forward(self, input_ids, attention_mask):
+            return self.auto_model(input_ids=input_ids, attention_mask=attention_mask)[0]
+
+    sample = transformer.tokenizer(["export sample"], return_tensors="pt")
+    float_path = os.path.join(output_dir, "model.onnx")
+    torch.onnx.export(
+        HiddenStates(transformer.auto_model).eval(), (sample["input_ids"], sample["attention_mask"]), float_path,
+        input_names=["input_ids", "attention_mask"], output_names=["last_hidden_state"],
+        dynamic_axes={"input_ids": {0: "batch", 1: "sequence"}, "attention_mask": {0: "batch", 1: "sequence"},
+                      "last_hidden_state": {0: "batch", 1: "sequence"}},
+        opset_version=14,
+    )
+    quantize_dynamic(float_path, os.path.join(output_dir, ONNX_MODEL_FILE), weight_type=QuantType.QInt8)
+    os.remove(float_path)
+
+    transformer.tokenizer.save_pretrained(output_dir)
+    with open(os.path.join(output_dir, ONNX_CONFIG_FILE), "w", encoding="utf-8") as f:
+        json.dump({
+            "model_name": model_name,
+            "pooling": pooling,
+            "normalize": any(type(module).__name__ == "Normalize" for module in model),
+            "max_seq_length": model.max_seq_length,
+            "pad_token": transformer.tokenizer.pad_token,
+            "pad_token_id": transformer.tokenizer.pad_token_id,
+        }, f, indent=4)
+    print(f"ONNX int8 model of {model_name} saved at {output_dir}")
+
+
+class OnnxEmbeddings(Embeddings):
+    """
+    Query encoder running the int8 ONNX export with onnxruntime on the CPU.
+    Produces the same vectors as the sentence-transformers model (see verify_onnx_model).
+    """
+    def __init__(self, model_dir, normalize=False, num_threads=None):
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_CONFIG_FILE), "r", encoding="utf-8") as f:
+            self.config = json.load(f)
+        self.normalize = normalize or self.config["normalize"]
+        self.tokenizer = Tokenizer.from_file(os.path.join(model_dir, "tokenizer.json"))
+        self.tokenizer.enable_truncation(self.config["max_seq_length"])
+        self.tokenizer.enable_padding(pad_id=self.config["pad_token_id"], pad_token=self.config["pad_token"])
+        options = onnxruntime.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, ONNX_MODEL_FILE), options, providers=["CPUExecutionProvider"]
+        )
+
+    def encode(self, texts):
+        encodings = self.tokenizer.encode_batch(list(texts))
+        input_ids = np.array([encoding.ids for encoding in encodings], dtype=np.int64)
+        attention_mask = np.array([encoding.attention_mask for encoding in encodings], dtype=np.int64)
+        hidden = self.session.run(None, {"input_ids": input_ids, "attention_mask": attention_mask})[0]
+        if self.config["pooling"] == "cls":
+            vectors = hidden[:, 0]
+        else:
+            mask = attention_mask[:, :, None].astype(np.float32)
+            vectors = (hidden * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+        if self.normalize:
+            vectors = vectors / np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        return vectors
+
+    def embed_documents(self, texts):
+        texts = list(texts)
+        return self.encode(texts).tolist() if texts else []
+
+    def embed_query(self, text):
+        return self.encode([text])[0].tolist()
+
+
+def verify_onnx_model(model_dir, model_name, texts, tolerance=0.01, normalize=False):
+    """
+    Compare the ONNX vectors with the reference sentence-transformers vectors.
+    The export passes when every cosine similarity is at least 1 - tolerance; the result is
+    written to verification.json, which the query runtime requires before using the model.
+    """
+    from sentence_transformers import SentenceTransformer
+
+    reference = SentenceTransformer(model_name, device="cpu").encode(
+        texts, normalize_embeddings=normalize, convert_to_numpy=True
+    )
+    vectors = OnnxEmbeddings(model_dir, normalize).encode(texts)
+    cosine = (reference * vectors).sum(axis=1) / (
+        np.linalg.norm(reference, axis=1) * np.linalg.norm(vectors, axis=1)
+    )
+    result = {
+        "model_name": model_name,
+        "texts": len(texts),
+        "min_cosine": float(cosine.min()),
+        "mean_cosine": float(cosine.mean()),
+        "tolerance": tolerance,
+        "passed": bool(cosine.min() >= 1 - tolerance),
+    }
+    with open(os.path.join(model_dir, VERIFICATION_FILE), "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=4)
+    print(f"ONNX verification: min cosine {result['min_cosine']:.4f}, mean {result['mean_cosine']:.4f} "
+          f"over {len(texts)} texts -> {'passed' if result['passed'] else 'FAILED'}")
+    return result
+
+
+def is_verified(model_dir, model_name):
+    path = os.path.join(model_dir, VERIFICATION_FILE)
+    if not os.path.exists(path):
+        return False
+    with open(path, "r", encoding="utf-8") as f:
+        result = json.load(f)
+    return result["passed"] and result["model_name"] == model_name
+
+
+def measure_runtime(runtime, model_name, model_dir, queries, normalize=False):
+    """
+    Startup time (imports and model load) and per-query encode latency of one runtime:
+    torch is the current HuggingFaceEmbeddings path, onnx the int8 export.
+    Run in a fresh process so imports of the other runtime do not skew the startup time.
+    """
+    start = time.perf_counter()
+    if runtime == "onnx":
+        encoder = OnnxEmbeddings(model_dir, normalize)
+    else:
+        from langchain_huggingface import HuggingFaceEmbeddings
+
+        encoder = HuggingFaceEmbeddings(model_name=model_name, encode_kwargs={"normalize_embeddings": normalize})
+    encoder.embed_query("warm up")
+    startup = time.perf_counter() - start
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        encoder.embed_query(query)
+        latencies.append((time.perf_counter() - start) * 1000.0)
+    return {
+        "startup_s": startup,
+        "p50_ms": float(np.percentile(latencies, 50)),
+        "p95_ms": float(np.percentile(latencies, 95)),
+        "mean_ms": float(np.mean(latencies)),
+    }
+
+
+def sample_texts(source_file, n=200):
+    """
+    Verification and latency texts: lines of the crawled Notion contents
+    """
+    from embedding import load_documents
+
+    lines = [line.strip() for doc in load_documents(source_file) for line in doc.page_content.splitlines() if line.strip()]
+    step = max(1, len(lines) // n)
+    return lines[::step][:n] or ["sample query"]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export, verify and benchmark the ONNX int8 query encoder")
+    parser.add_argument("--skip-export", action="store_true", help="verify and benchmark an existing export")
+    parser.add_argument("--measure", choices=["torch", "onnx"], help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # load config
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file.read())
+    model_name = config["embedding"]["model"]
+    model_dir = config["embedding"].get("onnx_dir", "./onnx_model")
+    normalize = config["embedding"].get("normalize", False)
+    from embedding import source_file
+
+    texts = sample_texts(source_file(config["notion"]))
+
+    if args.measure:
+        # child process of the latency report
+        print(json.dumps(measure_runtime(args.measure, model_name, model_dir, texts[:50], normalize)))
+        return
+
+    if not args.skip_export:
+        export_onnx_model(model_name, model_dir)
+    verify_onnx_model(model_dir, model_name, texts, config["embedding"].get("onnx_tolerance", 0.01), normalize)
+
+    for runtime in ("torch", "onnx"):
+        output = subprocess.run([sys.executable, __file__, "--measure", runtime], capture_output=True, text=True,
+                                check=True).stdout
+        report = json.loads(output.strip().splitlines()[-1])
+        print(f"{runtime}: startup {report['startup_s']:.2f}s, query p50 {report['p50_ms']:.2f}ms, "
+              f"p95 {report['p95_ms']:.2f}ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,400 @@
+import os
+import queue
+import resource
+import shutil
+import sys
+import threading
+import time
+import numpy as np
+import yaml
+
+# langchain
+from langchain.schema import Document
+from langchain_community.vectorstores import Chroma
+
+from bm25 import BM25Index
+from dedup import NearDuplicateIndex, merged_metadata, replace_metadata
+from embedding import BM25_INDEX_DIR, NUMPY_INDEX_DIR, Embedding, chunk_id
+from sharding import SHARD_DIR, ShardedIndex, shard_key
+from tracing import tracer
+from vector_index import DTYPES, NumpyVectorIndex
+
+# import the crawler
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "notion-api"))
+import retrieve_data  # noqa: E402
+
+DONE = object()
+PAGE_SIZE = 1000  # chunks read back from Chroma at a time
+SHARD_BATCH = 64  # shards updated at a time
+
+
+class StreamingIngestion:
+    """
+    Crawl -> chunk -> embed -> index as a chain of generators connected by bounded queues.
+    Every stage runs in its own thread, so embedding and indexing overlap with crawling,
+    and at most queue_size items wait between two stages: memory stays flat as the
+    workspace grows. Chunk ids are the same as in embedding.py, so chunks already in the
+    Chroma database are not embedded again and chunks of removed text are deleted at the end.
+    With embedding.dedup enabled, near-duplicate chunks are dropped in the embed stage: the LSH
+    buckets are filled one chunk at a time (see dedup.NearDuplicateIndex), so the first chunk of a
+    group is kept as embedding.py does, and the sources of each group are written once the stream is done.
+    The NumPy, BM25 and shard indexes are updated from the Chroma collection once the stream is done
+    (see update_derived_indexes). parents maps page ids to the database / parent page found by the
+    page discovery, as recorded in the corpus snapshot for embedding.py.
+    """
+    def __init__(self, embedding_handler, queue_size=64, parents=None):
+        self.embedding_handler = embedding_handler
+        self.parents = parents or {}
+        self.queue_size = queue_size
+        self.stop = threading.Event()
+        self.errors = []
+        self.existing_ids = set()
+        self.seen_ids = set()
+        self.duplicates = None
+        self.group_ids = []  # group number -> (chunk id, page key) of its first chunk
+        self.group_keys = {}  # group number -> page keys, for groups with near-duplicates only
+        self.changed_shards = set()
+        self.skipped_pages = 0
+        self.counts = {"pages": 0, "chunks": 0, "duplicates": 0, "embedded": 0}
+
+    def _put(self, outbox, item):
+        while not self.stop.is_set():
+            try:
+                outbox.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _iterate(self, inbox):
+        while True:
+            try:
+                item = inbox.get(timeout=0.1)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return
+                continue
+            if item is DONE:
+                return
+            yield item
+
+    def _run_stage(self, items, outbox):
+        try:
+            for item in items:
+                if not self._put(outbox, item):
+                    return
+        except Exception as e:
+            self.errors.append(e)
+            self.stop.set()
+        finally:
+            self._put(outbox, DONE)
+
+    def chunk(self, pages):
+        for page_id, title, last_edited_time, full_text in pages:
+            if title is None:
+                self.skipped_pages += 1
+                continue
+            self.counts["pages"] += 1
+            # same metadata as corpus.iter_documents, so chunk ids match embedding.py
+            metadata = {"key": page_id, "title": title}
+            if last_edited_time:
+                metadata["last_edited_time"] = last_edited_time
+            if self.parents.get(page_id):
+                metadata["parent"] = self.parents[page_id]
+            page = Document(page_content=full_text, metadata=metadata)
+            for doc in self.embedding_handler.split_and_clean_documents([page]):
+                yield doc
+
+    def embed(self, chunks, embedding_function):
+        batch_size = self.embedding_handler.batch_size
+        batch = {}
+        for doc in chunks:
+            self.counts["chunks"] += 1
+            doc_id = chunk_id(doc)
+            if self.duplicates is not None:
+                group, new = self.duplicates.add(doc.page_content)
+                if new:
+                    self.group_ids.append((doc_id, doc.metadata.get("key", "")))
+                else:
+                    self.group_keys.setdefault(group, [self.group_ids[group][1]]).append(doc.metadata.get("key", ""))
+                    self.counts["duplicates"] += 1
+                    continue
+            if doc_id in self.seen_ids:
+                continue
+            self.seen_ids.add(doc_id)
+            if doc_id in self.existing_ids:
+                continue
+            batch[doc_id] = Document(page_content=doc.page_content, metadata={**doc.metadata, "chunk_id": doc_id})
+            if len(batch) >= batch_size:
+                yield self._encode(batch, embedding_function)
+                batch = {}
+        if batch:
+            yield self._encode(batch, embedding_function)
+
+    def _encode(self, batch, embedding_function):
+        with tracer.span("pipeline.embed", chunks=len(batch)):
+            vectors = embedding_function.embed_documents([doc.page_content for doc in batch.values()])
+        self.counts["embedded"] += len(batch)
+        return list(batch), list(batch.values()), vectors
+
+    def merge_duplicates(self, db):
+        """
+        Write the sources of every near-duplicate group into the metadata of its first chunk, and drop
+        the sources left on stored chunks whose group is gone. Return the number of chunks updated.
+        """
+        collection = db._collection
+        group_keys = {self.group_ids[group][0]: keys for group, keys in self.group_keys.items()}
+        # new chunks were written without sources, stored ones may carry outdated sources
+        ids = [doc_id for doc_id in self.seen_ids if doc_id in self.existing_ids or doc_id in group_keys]
+        updated = 0
+        for start in range(0, len(ids), PAGE_SIZE):
+            stored = collection.get(ids=ids[start:start + PAGE_SIZE], include=["metadatas"])
+            changes = {}
+            for doc_id, metadata in zip(stored["ids"], stored["metadatas"]):
+                metadata = metadata or {}
+                expected = merged_metadata(metadata, group_keys.get(doc_id, [metadata.get("key", "")]))
+                if expected != metadata:
+                    changes[doc_id] = expected
+            replace_metadata(collection, list(changes), list(changes.values()))
+            self.mark_shards(changes.values())
+            updated += len(changes)
+        return updated
+
+    def mark_shards(self, metadatas):
+        """
+        Record the shards holding chunks with these metadata as changed
+        """
+        if self.embedding_handler.shards:
+            self.changed_shards.update(shard_key(Document(page_content="", metadata=metadata or {}), self.embedding_handler.shards)
+                                       for metadata in metadatas)
+
+    def delete_stale(self, collection, stale_ids):
+        for start in range(0, len(stale_ids), PAGE_SIZE):
+            ids = stale_ids[start:start + PAGE_SIZE]
+            if self.embedding_handler.shards:
+                self.mark_shards(collection.get(ids=ids, include=["metadatas"])["metadatas"])
+            collection.delete(ids=ids)
+
+    @staticmethod
+    def stored_chunks(collection, include=("documents", "metadatas", "embeddings")):
+        """
+        Yield the chunks of a Chroma collection as (ids, docs, vectors), PAGE_SIZE at a time
+        """
+        for offset in range(0, collection.count(), PAGE_SIZE):
+            page = collection.get(limit=PAGE_SIZE, offset=offset, include=list(include))
+            docs = [Document(page_content=text or "", metadata=metadata or {})
+                    for text, metadata in zip(page["documents"] or [None] * len(page["ids"]), page["metadatas"])]
+            yield page["ids"], docs, page["embeddings"]
+
+    def update_derived_indexes(self, db, embedding_function, chroma_changed):
+        """
+        Update the configured NumPy, BM25 and shard indexes from the chunks now in Chroma, and remove
+        the ones left in persist_directory (e.g. copied into a new version) that are no longer configured,
+        so none of them keeps serving deleted chunks. The chunks are read back PAGE_SIZE at a time with
+        their stored vectors, nothing is embedded again. The NumPy and BM25 indexes are rewritten when
+        Chroma changed (or they do not match it), only the shards holding changed chunks are updated.
+        Return True if one of them changed.
+        """
+        handler = self.embedding_handler
+        directory = handler.persist_directory
+        collection = db._collection
+        count = collection.count()
+        changed = False
+
+        numpy_dir = os.path.join(directory, NUMPY_INDEX_DIR)
+        if handler.backend in ("numpy", "both"):
+            vectors_path = os.path.join(numpy_dir, "vectors.npy")
+            stored = np.load(vectors_path, mmap_mode="r") if os.path.exists(vectors_path) else None
+            if chroma_changed or stored is None or len(stored) != count or stored.dtype != DTYPES[handler.numpy_dtype]:
+                del stored
+                with tracer.span("pipeline.numpy", chunks=count):
+                    NumpyVectorIndex.write(numpy_dir, self.stored_chunks(collection), count, handler.numpy_dtype)
+                print(f"Numpy index rewritten: {count} chunks ({handler.numpy_dtype}) at {numpy_dir}")
+                changed = True
+        elif os.path.exists(numpy_dir):
+            shutil.rmtree(numpy_dir)
+            changed = True
+
+        bm25_dir = os.path.join(directory, BM25_INDEX_DIR)
+        if handler.bm25:
+            arrays_path = os.path.join(bm25_dir, "bm25.npz")
+            stored = len(np.load(arrays_path)["doc_lengths"]) if os.path.exists(arrays_path) else None
+            if chroma_changed or stored != count:
+                with tracer.span("pipeline.bm25", chunks=count) as span:
+                    chunks, terms = BM25Index.write(bm25_dir, (doc for _, docs, _ in self.stored_chunks(
+                        collection, ("documents", "metadatas")) for doc in docs))
+                    span.set(terms=terms)
+                print(f"BM25 index saved: {chunks} chunks, {terms} terms at {bm25_dir}")
+                changed = True
+        elif os.path.exists(bm25_dir):
+            shutil.rmtree(bm25_dir)
+            changed = True
+
+        if handler.shards:
+            changed |= self.update_shards(collection, embedding_function)
+        elif os.path.exists(os.path.join(directory, SHARD_DIR)):
+            # an update without chunks drops every shard collection
+            ShardedIndex(directory).update({}, embedding_function)
+            shutil.rmtree(os.path.join(directory, SHARD_DIR))
+            changed = True
+        return changed
+
+    def update_shards(self, collection, embedding_function):
+        """
+        Update the shards holding changed chunks (every shard when there are none yet), SHARD_BATCH
+        shards at a time, with the chunks and vectors of each shard read from Chroma.
+        """
+        shard_by = self.embedding_handler.shards
+        index = ShardedIndex(self.embedding_handler.persist_directory)
+        keys = self.changed_shards
+        if not index.catalog:
+            keys = {shard_key(doc, shard_by) for _, docs, _ in self.stored_chunks(collection, ("metadatas",)) for doc in docs}
+        keys = sorted(keys)
+        changed = False
+        for start in range(0, len(keys), SHARD_BATCH):
+            batch = keys[start:start + SHARD_BATCH]
+            docs_by_id, vectors = {}, {}
+            for key in batch:
+                where = {"$or": [{"key": key}, {"parent": key}]} if shard_by == "parent" else {"key": key}
+                stored = collection.get(where=where, include=["documents", "metadatas", "embeddings"])
+                for doc_id, text, metadata, vector in zip(stored["ids"], stored["documents"], stored["metadatas"],
+                                                          stored["embeddings"]):
+                    doc = Document(page_content=text, metadata=metadata or {})
+                    if shard_key(doc, shard_by) == key:
+                        docs_by_id[doc_id] = doc
+                        vectors[doc_id] = vector
+            changed |= index.update(docs_by_id, embedding_function, shard_by, keys=batch, vectors=vectors)
+        return changed
+
+    def run(self, pages):
+        """
+        Ingest an iterable of (page_id, title, last_edited_time, full_text), e.g. retrieve_data.iter_pages(...)
+        into the index (a new version of it when the embedding handler is versioned)
+        """
+        self.embedding_handler.in_new_version(lambda: self.ingest(pages))
+        return self.counts
+
+    def ingest(self, pages):
+        """
+        Run the stages into handler.persist_directory. Return True if the index changed.
+        """
+        handler = self.embedding_handler
+        embedding_function = handler.create_embeddings()
+        os.makedirs(handler.persist_directory, exist_ok=True)
+        db = Chroma(persist_directory=handler.persist_directory, embedding_function=embedding_function)
+        self.existing_ids = set(db.get(include=[])["ids"])
+        if handler.dedup.get("enabled", False):
+            self.duplicates = NearDuplicateIndex(handler.dedup.get("threshold", 0.8), handler.dedup.get("num_perm", 128),
+                                                 handler.dedup.get("shingle_size", 5))
+
+        page_queue = queue.Queue(self.queue_size)
+        chunk_queue = queue.Queue(self.queue_size)
+        batch_queue = queue.Queue(max(1, self.queue_size // handler.batch_size))
+        threads = [
+            threading.Thread(target=self._run_stage, args=(pages, page_queue), daemon=True),
+            threading.Thread(target=self._run_stage, args=(self.chunk(self._iterate(page_queue)), chunk_queue),
+                             daemon=True),
+            threading.Thread(target=self._run_stage,
+                             args=(self.embed(self._iterate(chunk_queue), embedding_function), batch_queue),
+                             daemon=True),
+        ]
+        start = time.perf_counter()
+        for thread in threads:
+            thread.start()
+
+        # index stage
+        try:
+            for ids, docs, vectors in self._iterate(batch_queue):
+                with tracer.span("pipeline.index", chunks=len(ids)):
+                    self.mark_shards(doc.metadata for doc in docs)
+                    db._collection.upsert(
+                        ids=ids, embeddings=vectors, documents=[doc.page_content for doc in docs],
+                        metadatas=[doc.metadata for doc in docs],
+                    )
+        finally:
+            # every stage has finished at this point unless the index stage failed
+            self.stop.set()
+            for thread in threads:
+                thread.join()
+
+        if self.errors:
+            handler.encoder.close()
+            if handler.embedding_cache is not None:
+                # vectors computed before the failure stay usable for the next run
+                handler.embedding_cache.close()
+            raise self.errors[0]
+
+        # stale chunks are only deleted after a complete crawl
+        stale_ids = [] if self.skipped_pages else list(self.existing_ids - self.seen_ids)
+        self.delete_stale(db._collection, stale_ids)
+        if self.skipped_pages:
+            print(f"{self.skipped_pages} pages could not be read, their previous chunks are kept")
+        with tracer.span("pipeline.dedup", groups=len(self.group_keys)) as span:
+            updated = self.merge_duplicates(db)
+            span.set(updated=updated)
+        changed = bool(self.counts["embedded"] or stale_ids or updated)
+        changed |= self.update_derived_indexes(db, embedding_function, changed)
+        handler.finish_encoding(changed)
+
+        seconds = time.perf_counter() - start
+        # ru_maxrss is in kilobytes on Linux
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        print(f"Streaming ingestion: {self.counts['pages']} pages, {self.counts['chunks']} chunks "
+              f"({self.counts['embedded']} embedded, {self.counts['duplicates']} near-duplicates dropped, "
+              f"{len(stale_ids)} removed) in {seconds:.2f}s, "
+              f"peak memory {peak_mb:.0f} MB")
+        return changed
+
+
+def main():
+
+    # load config
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file.read())
+    tracer.configure(config.get("tracing", {}))
+    crawler_config = config["notion"].get("crawler", {})
+
+    try:
+        embedding_handler = Embedding(
+            embedding_model_name=config["embedding"]["model"],
+            persist_directory=config["embedding"]["db_dir"],
+            chunk_size=config["embedding"]["chunk_size"],
+            chunk_overlap=config["embedding"]["overlap"],
+            cache_dir=config["embedding"].get("cache_dir"),
+            cache_max_entries=config["embedding"].get("cache_max_entries", 100000),
+            batch_size=config["embedding"].get("batch_size", 32),
+            normalize=config["embedding"].get("normalize", False),
+            backend=config["embedding"].get("backend", "chroma"),
+            numpy_dtype=config["embedding"].get("numpy_dtype", "float32"),
+            bm25=config["embedding"].get("bm25", False),
+            shards=config["embedding"].get("shards"),
+            versioned=config["embedding"].get("versioned", False),
+            dedup=config["embedding"].get("dedup"),
+        )
+
+        headers, notion_api_url, page_ids = retrieve_data.load_notion_env()
+        rate_limiter = retrieve_data.RateLimiter(
+            crawler_config.get("requests_per_second", 3), min_rate=crawler_config.get("min_requests_per_second", 0.5),
+            max_retries=crawler_config.get("max_retries", 5), backoff=crawler_config.get("backoff", 1.0),
+        )
+        checkpoint = retrieve_data.CrawlCheckpoint(
+            crawler_config.get("checkpoint_file", "notion-api/crawl_checkpoint.jsonl")
+        )
+        page_ids, page_objects = retrieve_data.resolve_pages(config["notion"], headers, notion_api_url, page_ids,
+                                                             rate_limiter)
+        # database / parent page of the discovered pages, for embedding.shards: parent
+        parents = {page_id: retrieve_data.parent_id(page) for page_id, page in page_objects.items()}
+        ingestion = StreamingIngestion(embedding_handler, config.get("pipeline", {}).get("queue_size", 64), parents)
+        pages = retrieve_data.iter_pages(
+            page_ids, headers, notion_api_url, max_workers=crawler_config.get("max_workers", 4),
+            rate_limiter=rate_limiter, checkpoint=checkpoint, page_objects=page_objects,
+        )
+        ingestion.run(pages)
+        checkpoint.clear()
+
+    except Exception as e:
+        print(f"Error: {e}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,286 @@
+import argparse
+import hashlib
+import json
+import os
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import yaml
+
+# langchain
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+
+from dedup import replace_metadata
+from index_versions import resolve_index_dir
+from tracing import tracer
+from vector_index import mmr_select, normalize_rows
+
+SHARD_DIR = "shards"
+CATALOG_FILE = "catalog.json"
+CENTROIDS_FILE = "centroids.npy"
+
+
+def shard_key(doc, shard_by="page"):
+    """
+    Shard of a chunk: its page, or with shard_by "parent" the database / parent page recorded by
+    the page discovery (pages without a recorded parent stay in their own shard)
+    """
+    if shard_by == "parent" and doc.metadata.get("parent"):
+        return doc.metadata["parent"]
+    return doc.metadata.get("key", "")
+
+
+def collection_name(key):
+    # Chroma collection names are limited to 3-63 characters of [a-zA-Z0-9._-]
+    return f"shard_{hashlib.sha256(key.encode('utf-8')).hexdigest()[:16]}"
+
+
+class ShardedIndex(VectorStore):
+    """
+    Chunks split into one Chroma collection per Notion page or parent (the shards), each summarized
+    by the normalized mean of its chunk vectors (the centroid). A query is routed to the top_shards
+    shards whose centroid is closest to it, their candidates are merged by cosine similarity and the
+    fine-grained search (similarity or MMR) runs over the merged candidates only. With search_all
+    every shard is searched. Shards are queried in parallel.
+    Files: <persist_directory>/shards/catalog.json and centroids.npy (collections live in the Chroma db).
+    """
+    def __init__(self, persist_directory, embedding_function=None, top_shards=3, search_all=False, max_workers=4):
+        import chromadb
+
+        self.persist_directory = persist_directory
+        self.embedding_function = embedding_function
+        self.top_shards = top_shards
+        self.search_all = search_all
+        self.max_workers = max_workers
+        self.client = chromadb.PersistentClient(path=persist_directory)
+        self.collections = {}
+        self.executor = None
+        self.catalog = []
+        self.centroids = np.zeros((0, 1), dtype=np.float32)
+        catalog_path = os.path.join(persist_directory, SHARD_DIR, CATALOG_FILE)
+        if os.path.exists(catalog_path):
+            with open(catalog_path, "r", encoding="utf-8") as f:
+                self.catalog = json.load(f)
+            self.centroids = np.load(os.path.join(persist_directory, SHARD_DIR, CENTROIDS_FILE))
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    def update(self, docs_by_id, embedding_function, shard_by="page", keys=None, rebuild=False, vectors=None):
+        """
+        Write the shards of docs_by_id (chunk id -> document). Only new chunks are embedded, chunks
+        whose text disappeared are deleted and changed metadata is rewritten; shards left without chunks are dropped.
+        keys limits the update to those shards (the others are left as they are), rebuild re-embeds
+        them from scratch. vectors (chunk id -> vector, e.g. read from the main Chroma collection)
+        spares the encoder the chunks it holds. Return True if any shard changed.
+        """
+        groups = {}
+        for doc_id, doc in docs_by_id.items():
+            groups.setdefault(shard_key(doc, shard_by), {})[doc_id] = doc
+        entries = {entry["key"]: entry for entry in self.catalog}
+        centroids = dict(zip(entries, self.centroids))
+        targets = keys or list(dict.fromkeys(list(groups) + list(entries)))
+
+        with tracer.span("ingest.shards", shards=len(targets)) as span:
+            # list_collections returns names from chromadb 0.6, Collection objects before
+            existing_names = {getattr(collection, "name", collection) for collection in self.client.list_collections()}
+            collections = {}
+            new_docs = []
+            changed_keys = set()
+            for key in targets:
+                name = collection_name(key)
+                docs = groups.get(key, {})
+                if name in existing_names and (rebuild or not docs):
+                    self.client.delete_collection(name)
+                if not docs:
+                    if key in entries:
+                        del entries[key]
+                        centroids.pop(key, None)
+                        changed_keys.add(key)
+                    continue
+                collection = self.client.get_or_create_collection(name)
+                stored = collection.get(include=["metadatas"])
+                existing = dict(zip(stored["ids"], stored["metadatas"]))
+                stale_ids = [doc_id for doc_id in existing if doc_id not in docs]
+                if stale_ids:
+                    collection.delete(ids=stale_ids)
+                updated_ids = [doc_id for doc_id in docs if doc_id in existing and existing[doc_id] != docs[doc_id].metadata]
+                replace_metadata(collection, updated_ids, [docs[doc_id].metadata for doc_id in updated_ids])
+                missing = [(key, doc_id) for doc_id in docs if doc_id not in existing]
+                new_docs.extend(missing)
+                if stale_ids or updated_ids or missing or key not in centroids:
+                    changed_keys.add(key)
+                collections[key] = collection
+                entries[key] = {"key": key, "collection": name, "title": next(iter(docs.values())).metadata.get("title"),
+                                "chunks": len(docs)}
+
+            # one encoder call for every shard, so batches stay full even with small pages
+            known = vectors or {}
+            to_embed = [(key, doc_id) for key, doc_id in new_docs if doc_id not in known]
+            embedded = dict(zip(to_embed, embedding_function.embed_documents(
+                [groups[key][doc_id].page_content for key, doc_id in to_embed]
+            ))) if to_embed else {}
+            added = {}
+            for key, doc_id in new_docs:
+                vector = known[doc_id] if doc_id in known else embedded[(key, doc_id)]
+                added.setdefault(key, ([], []))
+                added[key][0].append(doc_id)
+                added[key][1].append(vector)
+            for key, (ids, key_vectors) in added.items():
+                docs = [groups[key][doc_id] for doc_id in ids]
+                collections[key].upsert(ids=ids, embeddings=key_vectors, documents=[doc.page_content for doc in docs],
+                                        metadatas=[doc.metadata for doc in docs])
+
+            for key in changed_keys:
+                if key in collections:
+                    shard_vectors = normalize_rows(collections[key].get(include=["embeddings"])["embeddings"])
+                    centroids[key] = normalize_rows(shard_vectors.mean(axis=0))
+            span.set(changed=len(changed_keys), added=len(new_docs))
+
+        self.catalog = sorted(entries.values(), key=lambda entry: entry["key"])
+        self.centroids = np.array([centroids[entry["key"]] for entry in self.catalog], dtype=np.float32)
+        self.save()
+        print(f"Shards updated: {len(changed_keys)} of {len(self.catalog)} changed, {len(new_docs)} chunks added "
+              f"({len(to_embed)} embedded)")
+        return bool(changed_keys)
+
+    def save(self):
+        directory = os.path.join(self.persist_directory, SHARD_DIR)
+        os.makedirs(directory, exist_ok=True)
+        # files are replaced rather than rewritten, they may be hard links into the published version
+        centroids_path = os.path.join(directory, CENTROIDS_FILE)
+        with open(f"{centroids_path}.tmp", "wb") as f:
+            np.save(f, self.centroids)
+        os.replace(f"{centroids_path}.tmp", centroids_path)
+        catalog_path = os.path.join(directory, CATALOG_FILE)
+        with open(f"{catalog_path}.tmp", "w", encoding="utf-8") as f:
+            json.dump(self.catalog, f, ensure_ascii=False, indent=4)
+        os.replace(f"{catalog_path}.tmp", catalog_path)
+
+    def route(self, vector):
+        """
+        Catalog entries of the shards to search for a query vector
+        """
+        if self.search_all or len(self.catalog) <= self.top_shards:
+            return list(self.catalog)
+        scores = self.centroids @ normalize_rows(vector)
+        return [self.catalog[row] for row in np.argsort(-scores)[:self.top_shards]]
+
+    def _query_shard(self, entry, vector, n):
+        if entry["collection"] not in self.collections:
+            self.collections[entry["collection"]] = self.client.get_collection(entry["collection"])
+        result = self.collections[entry["collection"]].query(
+            query_embeddings=[list(map(float, vector))], n_results=min(n, entry["chunks"]),
+            include=["documents", "metadatas", "embeddings"],
+        )
+        docs = [Document(page_content=text, metadata=metadata or {})
+                for text, metadata in zip(result["documents"][0], result["metadatas"][0])]
+        return docs, list(result["embeddings"][0])
+
+    def candidates(self, vector, n):
+        """
+        Return (docs, normalized vectors, cosine scores) of the n best chunks of the routed shards
+        """
+        with tracer.span("query.route") as span:
+            shards = self.route(vector)
+            span.set(shards=len(shards))
+        if not shards:
+            return [], np.zeros((0, 1), dtype=np.float32), np.zeros(0, dtype=np.float32)
+        if len(shards) == 1:
+            results = [self._query_shard(shards[0], vector, n)]
+        else:
+            if self.executor is None:
+                self.executor = ThreadPoolExecutor(max_workers=self.max_workers)
+            results = list(self.executor.map(lambda entry: self._query_shard(entry, vector, n), shards))
+        docs = [doc for shard_docs, _ in results for doc in shard_docs]
+        vectors = normalize_rows([row for _, shard_vectors in results for row in shard_vectors])
+        if not docs:
+            return [], vectors, np.zeros(0, dtype=np.float32)
+        scores = vectors @ normalize_rows(vector)
+        order = np.argsort(-scores)[:n]
+        return [docs[row] for row in order], vectors[order], scores[order]
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        docs, _, _ = self.candidates(embedding, k)
+        return docs
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4):
+        docs, _, scores = self.candidates(embedding, k)
+        return [(doc, float(score)) for doc, score in zip(docs, scores)]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score(query, k)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        docs, vectors, _ = self.candidates(embedding, fetch_k)
+        selected = mmr_select(normalize_rows(embedding), vectors, k, lambda_mult)
+        return [docs[i] for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult
+        )
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, **kwargs):
+        raise NotImplementedError("ShardedIndex is built by embedding.py")
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        raise NotImplementedError("ShardedIndex is built by embedding.py, it cannot be appended to")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="List or rebuild the shards of the index")
+    parser.add_argument("--rebuild", nargs="+", metavar="KEY", help="page (or parent) ids of the shards to rebuild")
+    args = parser.parse_args()
+
+    # load config
+    with open('config.yaml') as file:
+        config = yaml.safe_load(file.read())
+    tracer.configure(config.get("tracing", {}))
+    db_dir = config["embedding"]["db_dir"]
+
+    if not args.rebuild:
+        for entry in ShardedIndex(resolve_index_dir(db_dir)).catalog:
+            print(f"{entry['key']}\t{entry['chunks']} chunks\t{entry['title']}")
+        return
+
+    from embedding import Embedding, load_documents, source_file
+
+    embedding_handler = Embedding(
+        embedding_model_name=config["embedding"]["model"],
+        persist_directory=db_dir,
+        chunk_size=config["embedding"]["chunk_size"],
+        chunk_overlap=config["embedding"]["overlap"],
+        cache_dir=config["embedding"].get("cache_dir"),
+        cache_max_entries=config["embedding"].get("cache_max_entries", 100000),
+        batch_size=config["embedding"].get("batch_size", 32),
+        normalize=config["embedding"].get("normalize", False),
+        versioned=config["embedding"].get("versioned", False),
+        dedup=config["embedding"].get("dedup"),
+    )
+    cleaned_docs = embedding_handler.deduplicate_documents(
+        embedding_handler.split_and_clean_documents(load_documents(source_file(config["notion"])))
+    )
+
+    def rebuild():
+        embedding_function = embedding_handler.create_embeddings()
+        ShardedIndex(embedding_handler.persist_directory).update(
+            embedding_handler.prepare_documents(cleaned_docs), embedding_function,
+            config["embedding"].get("shards") or "page", keys=args.rebuild, rebuild=True,
+        )
+        embedding_handler.finish_encoding(True)
+        return True
+
+    embedding_handler.in_new_version(rebuild)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,7 @@
+import os
+import sys
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+for directory in (ROOT, os.path.join(ROOT, "notion-api"), os.path.join(ROOT, "benchmark")):
+    if directory not in sys.path:
+        sys.path.append(directory)
@@ -0,0 +1,114 @@
+import numpy as np
+from langchain_core.embeddings import Embeddings
+
+from answer_cache import SemanticAnswerCache
+from embedding_cache import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """
+    Deterministic embedding function recording every text it encodes
+    """
+    def __init__(self):
+        self.calls = []
+
+    def vector(self, text):
+        rng = np.random.default_rng(sum(text.encode("utf-8")))
+        return rng.normal(size=8).tolist()
+
+    def embed_documents(self, texts):
+        self.calls.extend(texts)
+        return [self.vector(text) for text in texts]
+
+    def embed_query(self, text):
+        self.calls.append(text)
+        return self.vector(text)
+
+
+def test_answer_cache_hit_and_miss():
+    cache = SemanticAnswerCache(threshold=0.95)
+    cache.store("where is the lake?", [1.0, 0.0, 0.0], ["mmr", 4], "north", ["ctx"])
+    assert cache.lookup([0.99, 0.05, 0.0], ["mmr", 4])["answer"] == "north"
+    # other search parameters or a different question
+    assert cache.lookup([1.0, 0.0, 0.0], ["similarity", 4]) is None
+    assert cache.lookup([0.0, 1.0, 0.0], ["mmr", 4]) is None
+    assert cache.stats()["hits"] == 1
+    assert cache.stats()["misses"] == 2
+
+
+def test_answer_cache_invalidation_and_eviction():
+    cache = SemanticAnswerCache(threshold=0.95, max_entries=2)
+    cache.invalidate_if_stale("v1")
+    cache.store("a", [1.0, 0.0, 0.0], [], "A", [])
+    cache.store("b", [0.0, 1.0, 0.0], [], "B", [])
+    assert cache.lookup([1.0, 0.0, 0.0], [])["answer"] == "A"
+    # "b" is now the least recently used entry
+    cache.store("c", [0.0, 0.0, 1.0], [], "C", [])
+    assert cache.lookup([0.0, 1.0, 0.0], []) is None
+    assert cache.lookup([1.0, 0.0, 0.0], [])["answer"] == "A"
+
+    cache.invalidate_if_stale("v1")
+    assert cache.stats()["entries"] == 2
+    cache.invalidate_if_stale("v2")
+    assert cache.stats()["entries"] == 0
+
+
+def test_answer_cache_expires_entries():
+    cache = SemanticAnswerCache(ttl=60)
+    cache.store("a", [1.0, 0.0], [], "A", [])
+    next(iter(cache.entries.values()))["created"] -= 120
+    assert cache.lookup([1.0, 0.0], []) is None
+    assert cache.stats()["entries"] == 0
+
+
+def test_answer_cache_save_and_load(tmp_path):
+    path = str(tmp_path / "answers.json")
+    cache = SemanticAnswerCache(path=path, save_interval=3600)
+    cache.invalidate_if_stale("v1")
+    cache.store("a", [1.0, 0.0], ["mmr"], "A", ["ctx"])
+    # saved at most every save_interval seconds
+    assert not (tmp_path / "answers.json").exists()
+    cache.flush()
+
+    loaded = SemanticAnswerCache(path=path)
+    assert loaded.index_version == "v1"
+    assert loaded.lookup([1.0, 0.0], ["mmr"])["contexts"] == ["ctx"]
+
+
+def test_cached_embeddings_hit_and_miss(tmp_path):
+    encoder = CountingEmbeddings()
+    cached = CachedEmbeddings(encoder, "model", str(tmp_path))
+    first = cached.embed_documents(["lake stars", "course price", "lake stars"])
+    assert encoder.calls == ["lake stars", "course price"]
+    # whitespace variants share an entry, queries are cached separately from documents
+    assert np.allclose(cached.embed_documents(["lake   stars\n"]), [first[0]])
+    cached.embed_query("lake stars")
+    assert encoder.calls == ["lake stars", "course price", "lake stars"]
+    assert cached.stats() == {"hits": 1, "misses": 4, "entries": 3}
+
+
+def test_cached_embeddings_persist_and_invalidate(tmp_path):
+    encoder = CountingEmbeddings()
+    cached = CachedEmbeddings(encoder, "model", str(tmp_path), flush_every=1000)
+    vectors = cached.embed_documents(["lake stars", "course price"])
+    cached.close()
+
+    reopened = CachedEmbeddings(encoder, "model", str(tmp_path))
+    assert np.allclose(reopened.embed_documents(["lake stars", "course price"]), vectors)
+    assert len(encoder.calls) == 2
+    # another model never reuses these vectors
+    CachedEmbeddings(encoder, "other-model", str(tmp_path)).embed_documents(["lake stars"])
+    assert len(encoder.calls) == 3
+
+
+def test_cached_embeddings_evicts_least_recently_used(tmp_path):
+    encoder = CountingEmbeddings()
+    cached = CachedEmbeddings(encoder, "model", str(tmp_path), max_entries=2)
+    cached.embed_documents(["a"])
+    cached.embed_documents(["b"])
+    cached.embed_documents(["a"])
+    cached.embed_documents(["c"])
+    assert cached.stats()["entries"] == 2
+    encoder.calls.clear()
+    cached.embed_documents(["a", "b", "c"])
+    assert encoder.calls == ["b"]
@@ -0,0 +1,58 @@
+from langchain.schema import Document
+
+from context_packing import ContextPacker, count_tokens, trim_overlap
+
+
+def test_trim_overlap_drops_the_repeated_boundary():
+    first = "one two three four five six".split()
+    second = "four five six seven eight".split()
+    assert trim_overlap(second, [first]) == ["seven", "eight"]
+    # fewer than MIN_OVERLAP_WORDS repeated words are kept
+    assert trim_overlap("five six seven".split(), [first]) == ["five", "six", "seven"]
+
+
+def test_pack_trims_overlap_of_the_same_page_only():
+    docs = [
+        Document(page_content="The lake is north of the village. Stars are visible at night.", metadata={"key": "a"}),
+        Document(page_content="Stars are visible at night. Boats leave at noon.", metadata={"key": "a"}),
+        Document(page_content="are visible at night. Tickets cost ten zloty.", metadata={"key": "b"}),
+    ]
+    packed, stats = ContextPacker(token_budget=1000).pack("lake", docs)
+    assert [doc.page_content for doc in packed] == [
+        "The lake is north of the village. Stars are visible at night.",
+        "Boats leave at noon.",
+        "are visible at night. Tickets cost ten zloty.",
+    ]
+    assert stats["saved_tokens"] == 5
+    assert stats["dropped_chunks"] == 0
+
+
+def test_pack_drops_repeated_sentences():
+    docs = [
+        Document(page_content="Exams start in June. Bring your card.", metadata={"key": "a"}),
+        Document(page_content="Bring your card. The room is 101.", metadata={"key": "b"}),
+        Document(page_content="exams start in june.", metadata={"key": "c"}),
+    ]
+    packed, stats = ContextPacker(token_budget=1000).pack("exam", docs)
+    assert [doc.page_content for doc in packed] == ["Exams start in June. Bring your card.", "The room is 101."]
+    assert stats["dropped_chunks"] == 1
+
+
+def test_pack_respects_the_budget_and_keeps_relevant_sentences():
+    docs = [
+        Document(page_content="Accommodation costs 500 per month. " + "Unrelated filler sentence here. " * 5 +
+                 "The dormitory price includes internet.", metadata={"key": "a"}),
+        Document(page_content="Another page about something else entirely.", metadata={"key": "b"}),
+    ]
+    packed, stats = ContextPacker(token_budget=12).pack("dormitory price accommodation", docs)
+    assert stats["packed_tokens"] <= 12
+    assert sum(count_tokens(doc.page_content) for doc in packed) == stats["packed_tokens"]
+    assert packed[0].page_content == "Accommodation costs 500 per month. The dormitory price includes internet."
+    assert packed[0].metadata == {"key": "a"}
+
+
+def test_pack_splits_long_unpunctuated_text():
+    text = " ".join(f"word{i}" for i in range(200)) + " budget travel"
+    packed, stats = ContextPacker(token_budget=50).pack("budget travel", [Document(page_content=text)])
+    assert 0 < stats["packed_tokens"] <= 50
+    assert "budget travel" in packed[0].page_content
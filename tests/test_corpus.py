@@ -0,0 +1,80 @@
+import json
+import os
+
+import pytest
+
+from corpus import CorpusReader, CorpusWriter, export_json, import_json, iter_documents
+
+PAGES = [
+    ("page-2", "Dormitory", "accommodation costs 500 zł per month.\nłóżko i biurko", "2024-12-28T00:00:00.000Z", None),
+    ("page-1", "Exams", "exams start in june.", "2024-12-29T00:00:00.000Z", "db-1"),
+    ("page-3", "Exams", "resits are in september.", None, None),
+]
+
+
+def write_corpus(path):
+    with CorpusWriter(path) as writer:
+        for page_id, title, text, last_edited_time, parent in PAGES:
+            writer.add(page_id, title, text, last_edited_time, parent)
+
+
+def test_round_trip(tmp_path):
+    path = str(tmp_path / "corpus.bin")
+    write_corpus(path)
+    assert not os.path.exists(f"{path}.tmp")
+
+    with CorpusReader(path) as reader:
+        assert len(reader) == 3
+        assert "page-1" in reader and "page-4" not in reader
+        assert reader.page_ids() == ["page-2", "page-1", "page-3"]
+        assert reader.metadata("page-1") == {"page_id": "page-1", "title": "Exams",
+                                             "last_edited_time": "2024-12-29T00:00:00.000Z"}
+        assert reader.get("page-2")["text"] == PAGES[0][2]
+        assert [(record["page_id"], record["title"], record["text"], record["last_edited_time"], record["parent"])
+                for record in reader] == PAGES
+
+
+def test_iter_documents(tmp_path):
+    path = str(tmp_path / "corpus.bin")
+    write_corpus(path)
+    docs = list(iter_documents(path))
+    assert [doc.page_content for doc in docs] == [page[2] for page in PAGES]
+    assert docs[1].metadata == {"key": "page-1", "title": "Exams", "last_edited_time": "2024-12-29T00:00:00.000Z",
+                                "parent": "db-1"}
+    assert docs[2].metadata == {"key": "page-3", "title": "Exams"}
+
+
+def test_failed_write_keeps_previous_snapshot(tmp_path):
+    path = str(tmp_path / "corpus.bin")
+    write_corpus(path)
+    with pytest.raises(RuntimeError):
+        with CorpusWriter(path) as writer:
+            writer.add("page-9", "Partial", "text")
+            raise RuntimeError("crawl failed")
+    assert not os.path.exists(f"{path}.tmp")
+    with CorpusReader(path) as reader:
+        assert reader.page_ids() == ["page-2", "page-1", "page-3"]
+
+
+def test_reader_rejects_other_files(tmp_path):
+    path = tmp_path / "notion_contents.json"
+    path.write_text(json.dumps({"Exams": "text"}) + " " * 32, encoding="utf-8")
+    with pytest.raises(ValueError):
+        CorpusReader(str(path))
+    with pytest.raises(FileNotFoundError):
+        CorpusReader(str(tmp_path / "missing.bin"))
+
+
+def test_json_export_and_import(tmp_path):
+    path = str(tmp_path / "corpus.bin")
+    json_path = str(tmp_path / "notion_contents.json")
+    write_corpus(path)
+    export_json(path, json_path)
+    with open(json_path, "r", encoding="utf-8") as f:
+        contents = json.load(f)
+    assert contents == {"Dormitory": PAGES[0][2], "Exams": PAGES[1][2], "Exams (page-3)": PAGES[2][2]}
+
+    imported = str(tmp_path / "imported.bin")
+    import_json(json_path, imported)
+    with CorpusReader(imported) as reader:
+        assert [(record["title"], record["text"]) for record in reader] == list(contents.items())
@@ -0,0 +1,124 @@
+import os
+
+import pytest
+
+import retrieve_data
+from fake_notion import FakeNotionServer, rich_text, synthetic_workspace
+
+
+@pytest.fixture
+def workspace():
+    return synthetic_workspace(6, blocks_per_page=30, seed=3)
+
+
+def serve(workspace):
+    return FakeNotionServer(workspace).start()
+
+
+def sequential_crawl(page_ids, blocks_url):
+    """
+    Reference output: the original one-request-at-a-time crawl
+    """
+    pages = []
+    for page_id in page_ids:
+        blocks = retrieve_data.get_all_blocks(page_id, {}, blocks_url)
+        content = retrieve_data.normalize_text_data(retrieve_data.extract_text_from_blocks(blocks, {}, blocks_url))
+        data = retrieve_data.get_page(page_id, {}, notion_api_url=blocks_url)
+        pages.append((page_id, *retrieve_data.page_metadata(data), "\n".join(content)))
+    return pages
+
+
+def test_crawl_pages_matches_sequential_crawl(workspace):
+    server = serve(workspace)
+    try:
+        url = server.url + "/blocks"
+        expected = sequential_crawl(list(workspace), url)
+        assert retrieve_data.crawl_pages(list(workspace), {}, url, max_workers=4, requests_per_second=0) == expected
+        assert list(retrieve_data.iter_pages(list(workspace), {}, url, max_workers=4, requests_per_second=0)) == expected
+    finally:
+        server.stop()
+
+
+def test_sync_pages_matches_crawl_and_refetches_only_changes(workspace):
+    server = serve(workspace)
+    cache = {}
+    try:
+        url = server.url + "/blocks"
+        expected = retrieve_data.crawl_pages(list(workspace), {}, url, requests_per_second=0)
+        pages, report = retrieve_data.sync_pages(list(workspace), {}, url, cache, requests_per_second=0)
+        assert pages == expected
+        assert report["added"] == list(workspace)
+
+        server.requests = 0
+        pages, report = retrieve_data.sync_pages(list(workspace), {}, url, cache, requests_per_second=0)
+        assert pages == expected
+        assert report["unchanged"] == list(workspace)
+        # only the page objects are requested, the blocks come from the cache
+        assert server.requests == len(workspace)
+    finally:
+        server.stop()
+
+    edited = workspace["page-1"]
+    edited["last_edited_time"] = "2025-01-02T00:00:00.000Z"
+    edited["blocks"][0] = {"id": "p1-b0", "type": "paragraph", "has_children": False,
+                           "paragraph": rich_text("Edited paragraph."), "last_edited_time": "2025-01-02T00:00:00.000Z"}
+    server = serve(workspace)
+    try:
+        url = server.url + "/blocks"
+        pages, report = retrieve_data.sync_pages(list(workspace), {}, url, cache, requests_per_second=0)
+        assert report["changed"] == ["page-1"]
+        assert pages == retrieve_data.crawl_pages(list(workspace), {}, url, requests_per_second=0)
+        assert pages[1][3].startswith("edited paragraph.")
+    finally:
+        server.stop()
+
+
+def test_sync_pages_drops_removed_pages_and_keeps_unreadable_ones(workspace, monkeypatch):
+    server = serve(workspace)
+    cache = {}
+    try:
+        url = server.url + "/blocks"
+        retrieve_data.sync_pages(list(workspace), {}, url, cache, requests_per_second=0)
+
+        del server.pages["page-2"]
+        fetch_page = retrieve_data.fetch_page
+        monkeypatch.setattr(retrieve_data, "fetch_page", lambda page_id, *args, **kwargs: (
+            (None, 503) if page_id == "page-3" else fetch_page(page_id, *args, **kwargs)
+        ))
+        pages, report = retrieve_data.sync_pages(list(workspace), {}, url, cache, requests_per_second=0)
+        assert report["removed"] == ["page-2"]
+        assert report["unreadable"] == ["page-3"]
+        assert [page[0] for page in pages] == [page_id for page_id in workspace if page_id != "page-2"]
+        assert "page-3" in cache["pages"]
+    finally:
+        server.stop()
+
+
+def test_crawl_resumes_from_interrupted_checkpoint(workspace, tmp_path):
+    server = serve(workspace)
+    try:
+        url = server.url + "/blocks"
+        path = str(tmp_path / "crawl.jsonl")
+        checkpoint = retrieve_data.CrawlCheckpoint(path)
+        expected = retrieve_data.crawl_pages(list(workspace), {}, url, requests_per_second=0, checkpoint=checkpoint)
+        checkpoint.close()
+        full_requests = server.requests
+
+        # keep the first half of the log and a record cut off in the middle
+        with open(path, "r", encoding="utf-8") as f:
+            lines = f.readlines()
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(lines[:len(lines) // 2])
+            f.write(lines[len(lines) // 2][:20])
+
+        server.requests = 0
+        checkpoint = retrieve_data.CrawlCheckpoint(path)
+        assert checkpoint.listings
+        resumed = retrieve_data.crawl_pages(list(workspace), {}, url, requests_per_second=0, checkpoint=checkpoint)
+        assert resumed == expected
+        assert 0 < server.requests < full_requests
+
+        checkpoint.clear()
+        assert not os.path.exists(path)
+    finally:
+        server.stop()
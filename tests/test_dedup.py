@@ -0,0 +1,65 @@
+import random
+
+from langchain.schema import Document
+
+from dedup import NearDuplicateIndex, deduplicate, jaccard, merged_metadata, shingles
+
+WORDS = ["notion", "lake", "stars", "course", "price", "warsaw", "university", "accommodation",
+         "exam", "schedule", "python", "embedding", "budget", "travel", "spirit", "village"]
+
+
+def paragraph(seed, length=80):
+    rng = random.Random(seed)
+    return " ".join(rng.choice(WORDS) for _ in range(length))
+
+
+def edited(text, position=40):
+    words = text.split()
+    words[position] = "edited"
+    return " ".join(words)
+
+
+def test_shingles_and_jaccard():
+    assert shingles("a b c", size=5) == {"a b c"}
+    assert len(shingles("a b c d e f", size=5)) == 2
+    assert jaccard({"x"}, {"x"}) == 1.0
+    assert jaccard({"x", "y"}, {"y", "z"}) == 1 / 3
+
+
+def test_near_duplicate_index_groups_similar_texts():
+    index = NearDuplicateIndex(threshold=0.8)
+    text = paragraph(0)
+    assert index.add(text) == (0, True)
+    assert index.add(paragraph(1)) == (1, True)
+    assert index.add(edited(text)) == (0, False)
+    assert index.add(text) == (0, False)
+
+
+def test_deduplicate_keeps_first_chunk_with_sources():
+    text = paragraph(0)
+    docs = [
+        Document(page_content=text, metadata={"key": "a"}),
+        Document(page_content=paragraph(1), metadata={"key": "b"}),
+        Document(page_content=edited(text), metadata={"key": "c"}),
+        Document(page_content=text, metadata={"key": "a"}),
+    ]
+    kept, stats = deduplicate(docs)
+    assert [doc.page_content for doc in kept] == [text, paragraph(1)]
+    assert kept[0].metadata == {"key": "a", "sources": "a,c", "duplicates": 2}
+    assert kept[1].metadata == {"key": "b"}
+    assert stats["chunks"] == 4
+    assert stats["removed"] == 2
+    assert stats["groups"] == 1
+
+
+def test_deduplicate_keeps_distinct_chunks():
+    docs = [Document(page_content=paragraph(seed), metadata={"key": str(seed)}) for seed in range(20)]
+    kept, stats = deduplicate(docs)
+    assert kept == docs
+    assert stats["removed"] == 0
+
+
+def test_merged_metadata_replaces_previous_sources():
+    metadata = {"key": "a", "sources": "a,b,c", "duplicates": 2}
+    assert merged_metadata(metadata, ["a"]) == {"key": "a"}
+    assert merged_metadata(metadata, ["a", "d"]) == {"key": "a", "sources": "a,d", "duplicates": 1}
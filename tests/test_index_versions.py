@@ -0,0 +1,86 @@
+import os
+
+import pytest
+
+from index_versions import (CURRENT_FILE, VERSIONS_DIR, VersionBuild, acquire_current_lease, collect_garbage,
+                            current_version, resolve_index_dir)
+
+
+def write(path, text):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(text)
+
+
+def read(path):
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def versions(db_dir):
+    return sorted(os.listdir(os.path.join(db_dir, VERSIONS_DIR)))
+
+
+def test_first_build_starts_from_unversioned_index(tmp_path):
+    db_dir = str(tmp_path)
+    write(os.path.join(db_dir, "chroma.sqlite3"), "v0")
+    assert resolve_index_dir(db_dir) == db_dir
+
+    with VersionBuild(db_dir) as build:
+        assert read(os.path.join(build.directory, "chroma.sqlite3")) == "v0"
+        write(os.path.join(build.directory, "chroma.sqlite3"), "v1")
+    assert current_version(db_dir) == build.version
+    assert read(os.path.join(resolve_index_dir(db_dir), "chroma.sqlite3")) == "v1"
+    assert not os.path.exists(os.path.join(db_dir, VERSIONS_DIR, build.version, CURRENT_FILE))
+
+
+def test_unchanged_or_failed_build_is_discarded(tmp_path):
+    db_dir = str(tmp_path)
+    with VersionBuild(db_dir) as published:
+        write(os.path.join(published.directory, "chroma.sqlite3"), "v1")
+
+    with VersionBuild(db_dir) as unchanged:
+        unchanged.changed = False
+    with pytest.raises(RuntimeError):
+        with VersionBuild(db_dir) as failed:
+            raise RuntimeError("embedding failed")
+
+    assert current_version(db_dir) == published.version
+    assert versions(db_dir) == [published.version]
+    assert not os.path.exists(unchanged.directory)
+    assert not os.path.exists(failed.directory)
+
+
+def test_old_versions_are_collected_once_unleased(tmp_path):
+    db_dir = str(tmp_path)
+    with VersionBuild(db_dir) as first:
+        write(os.path.join(first.directory, "chroma.sqlite3"), "v1")
+    version, lease = acquire_current_lease(db_dir)
+    assert version == first.version
+
+    with VersionBuild(db_dir) as second:
+        write(os.path.join(second.directory, "chroma.sqlite3"), "v2")
+    # a reader still holds the first version
+    assert versions(db_dir) == sorted([first.version, second.version])
+
+    lease.release()
+    assert collect_garbage(db_dir) == [first.version]
+    assert versions(db_dir) == [second.version]
+
+
+def test_linked_files_are_shared_until_replaced(tmp_path):
+    db_dir = str(tmp_path)
+    with VersionBuild(db_dir) as first:
+        write(os.path.join(first.directory, "numpy_index", "docs.jsonl"), "v1")
+        write(os.path.join(first.directory, "chroma.sqlite3"), "v1")
+    first_docs = os.path.join(first.directory, "numpy_index", "docs.jsonl")
+
+    with VersionBuild(db_dir, linked=("numpy_index",)) as second:
+        docs = os.path.join(second.directory, "numpy_index", "docs.jsonl")
+        assert os.path.samefile(docs, first_docs)
+        assert not os.path.samefile(os.path.join(second.directory, "chroma.sqlite3"),
+                                    os.path.join(first.directory, "chroma.sqlite3"))
+        write(f"{docs}.tmp", "v2")
+        os.replace(f"{docs}.tmp", docs)
+        assert read(first_docs) == "v1"
+    assert read(os.path.join(resolve_index_dir(db_dir), "numpy_index", "docs.jsonl")) == "v2"
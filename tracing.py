@@ -0,0 +1,152 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class NoopSpan:
+    """
+    Returned while tracing is disabled, so instrumented code costs one attribute check.
+    """
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def set(self, **attributes):
+        pass
+
+    def incr(self, key, value=1):
+        pass
+
+
+NOOP_SPAN = NoopSpan()
+
+
+class Span:
+    """
+    Timing span with counters (chunks, tokens, http_calls, cache_hits, ...).
+    """
+    __slots__ = ("tracer", "name", "attributes", "start", "duration")
+
+    def __init__(self, tracer, name, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.attributes = attributes
+        self.start = 0.0
+        self.duration = 0.0
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.duration = time.perf_counter() - self.start
+        if exc_type is not None:
+            self.attributes["error"] = exc_type.__name__
+        self.tracer.record(self)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def incr(self, key, value=1):
+        self.attributes[key] = self.attributes.get(key, 0) + value
+
+
+class Tracer:
+    """
+    Collects spans of the ingestion and query pipelines.
+    Spans are appended to a JSON lines file and aggregated per name for the
+    Prometheus text endpoint (count, total seconds and the sum of numeric attributes).
+    """
+    def __init__(self):
+        self.enabled = False
+        self.lock = threading.Lock()
+        self.file = None
+        self.server = None
+        self.metrics = {}  # span name -> {"count", "seconds", "attributes": {key: sum}}
+
+    def configure(self, tracing_config):
+        """
+        Apply the tracing section of config.yaml ({enabled, jsonl_path, prometheus_port})
+        """
+        self.enabled = bool(tracing_config.get("enabled", False))
+        if not self.enabled:
+            return
+        jsonl_path = tracing_config.get("jsonl_path")
+        if jsonl_path and self.file is None:
+            self.file = open(jsonl_path, "a", encoding="utf-8")
+        port = tracing_config.get("prometheus_port")
+        if port and self.server is None:
+            self.serve_prometheus(port)
+
+    def span(self, name, **attributes):
+        if not self.enabled:
+            return NOOP_SPAN
+        return Span(self, name, attributes)
+
+    def record(self, span):
+        with self.lock:
+            metric = self.metrics.setdefault(span.name, {"count": 0, "seconds": 0.0, "attributes": {}})
+            metric["count"] += 1
+            metric["seconds"] += span.duration
+            for key, value in span.attributes.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    metric["attributes"][key] = metric["attributes"].get(key, 0) + value
+            if self.file is not None:
+                self.file.write(json.dumps({
+                    "name": span.name,
+                    "timestamp": time.time(),
+                    "duration_ms": span.duration * 1000.0,
+                    **span.attributes,
+                }, ensure_ascii=False, default=str) + "\n")
+                self.file.flush()
+
+    def render_prometheus(self):
+        """
+        Aggregated spans in the Prometheus text exposition format
+        """
+        lines = [
+            "# TYPE rag_span_total counter",
+            "# TYPE rag_span_seconds_total counter",
+            "# TYPE rag_span_attribute_total counter",
+        ]
+        with self.lock:
+            for name, metric in sorted(self.metrics.items()):
+                lines.append(f'rag_span_total{{span="{name}"}} {metric["count"]}')
+                lines.append(f'rag_span_seconds_total{{span="{name}"}} {metric["seconds"]:.6f}')
+                for key, value in sorted(metric["attributes"].items()):
+                    lines.append(f'rag_span_attribute_total{{span="{name}",attribute="{key}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+    def serve_prometheus(self, port, host="0.0.0.0"):
+        """
+        Serve render_prometheus() on http://host:port/metrics from a background thread
+        """
+        tracer = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                if self.path != "/metrics":
+                    self.send_response(404)
+                    self.end_headers()
+                    return
+                body = tracer.render_prometheus().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        print(f"Tracing: Prometheus metrics on http://{host}:{port}/metrics")
+
+
+# shared by every module of this process
+tracer = Tracer()
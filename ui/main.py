@@ -6,7 +6,8 @@ from streamlit_option_menu import option_menu
 
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 
-from llm import RAGApp
+from llm import resources
+from tracing import tracer
 
 # Initialize session state for chat history
 if "chat_history" not in st.session_state:
@@ -24,6 +25,11 @@ st.markdown(
 # load config
 with open('config.yaml') as file:
     config = yaml.safe_load(file.read())
+tracer.configure(config.get("tracing", {}))
+
+# Load the shared models once per server process (reloaded only when config.yaml changes)
+with st.spinner("Loading models..."):
+    rag_app = resources.warm_up(config)
 
 # Sidebar
 with st.sidebar:
@@ -79,39 +85,38 @@ if selected == "Chat":
 
     send_button = st.button("Send", key="send_button")
 
-    rag_app = RAGApp(embedding_model=config["embedding"]["model"], llm_model=config["llm"]["model"],
-                                      max_token=config["llm"]["max_token"], temperature=config["llm"]["temperature"])
-
     if send_button and user_input.strip():
-        # Spinner
-        with st.spinner("Generating response..."):
-            
-            # DEBUG:
-            print(f"##### Passing temp to RAG: {st.session_state.temperature} #####")
 
-            # RAGApp
-            response = rag_app.get_response(user_input, search_type=config["llm"]["search_type"], 
-                                            k=config["llm"]["k"], fetch_k=config["llm"]["fetch_k"], eval_mode=False)
+        # DEBUG:
+        print(f"##### Passing temp to RAG: {st.session_state.temperature} #####")
 
-        # Update chat history
-        st.session_state.chat_history.append({"user": user_input, "bot": response})
-        
-        # Dispaly the updated convo
+        # Dispaly the updated convo, rendering the answer as tokens arrive
         with chat_container:
             st.markdown(f"**You:** {user_input}")
-            st.markdown(
-                f"""
-                <div style='display: flex; align-items: flex-start; margin-bottom: 10px;'>
-                    <div style='font-size: 24px; margin-right: 10px;'>
-                            <i class="fa fa-robot" style="color: #555;"></i>  <!-- Robot-icon -->
-                    </div>
-                    <div style='background-color: #f0f0f0; padding: 10px; border-radius: 10px;'>
-                        {response}
-                    </div>
-                </div>
-                """,
-                unsafe_allow_html=True
-            )
+            bot_placeholder = st.empty()
+            with st.spinner("Generating response..."):
+                # RAGApp
+                response = ""
+                for piece in rag_app.stream_response(user_input, search_type=config["llm"]["search_type"],
+                                                     k=config["llm"]["k"], fetch_k=config["llm"]["fetch_k"],
+                                                     temperature=st.session_state.temperature):
+                    response += piece
+                    bot_placeholder.markdown(
+                        f"""
+                        <div style='display: flex; align-items: flex-start; margin-bottom: 10px;'>
+                            <div style='font-size: 24px; margin-right: 10px;'>
+                                    <i class="fa fa-robot" style="color: #555;"></i>  <!-- Robot-icon -->
+                            </div>
+                            <div style='background-color: #f0f0f0; padding: 10px; border-radius: 10px;'>
+                                {response}
+                            </div>
+                        </div>
+                        """,
+                        unsafe_allow_html=True
+                    )
+
+        # Update chat history
+        st.session_state.chat_history.append({"user": user_input, "bot": response})
 
 # Setting layout
 elif selected == "Settings":
@@ -126,3 +131,8 @@ elif selected == "Settings":
         value=st.session_state.temperature,  # default temperature
         step=0.1                    # step
     )
+
+    # Answer cache counters
+    if rag_app.answer_cache is not None:
+        st.write("#### Answer cache:")
+        st.write(rag_app.answer_cache.stats())
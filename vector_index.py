@@ -0,0 +1,278 @@
+import json
+import os
+import numpy as np
+
+# langchain
+from langchain.schema import Document
+from langchain_core.vectorstores import VectorStore
+
+DTYPES = {"float32": np.float32, "float16": np.float16, "int8": np.int8}
+
+
+def normalize_rows(vectors):
+    vectors = np.asarray(vectors, dtype=np.float32)
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+def mmr_select(query_vector, candidate_vectors, k=4, lambda_mult=0.5):
+    """
+    Maximal marginal relevance over normalized candidates.
+    All pairwise similarities come from one matrix product, and each of the k selection
+    steps is a vector operation over every candidate (no per-candidate Python loop).
+    Return the selected row indices in selection order.
+    """
+    if len(candidate_vectors) == 0 or k <= 0:
+        return []
+    relevance = candidate_vectors @ query_vector
+    similarity = candidate_vectors @ candidate_vectors.T
+    selected = [int(np.argmax(relevance))]
+    max_similarity = similarity[selected[0]].copy()
+    for _ in range(min(k, len(candidate_vectors)) - 1):
+        scores = lambda_mult * relevance - (1 - lambda_mult) * max_similarity
+        scores[selected] = -np.inf
+        best = int(np.argmax(scores))
+        selected.append(best)
+        np.maximum(max_similarity, similarity[best], out=max_similarity)
+    return selected
+
+
+class NumpyVectorIndex(VectorStore):
+    """
+    Flat in-process vector index: every chunk vector lives in one contiguous array
+    (float32, float16 or int8 with per-row scales, optionally memory-mapped).
+    Top-k is a single matrix product over normalized vectors (cosine similarity).
+    Files: vectors.npy, scales.npy (int8 only) and docs.jsonl.
+    """
+    BLOCK_ROWS = 16384  # float16 / int8 rows converted to float32 at a time when scoring
+
+    def __init__(self, vectors, docs, ids, embedding_function=None, scales=None):
+        self.vectors = vectors
+        self.docs = docs
+        self.ids = ids
+        self.scales = scales
+        self.embedding_function = embedding_function
+
+    @property
+    def embeddings(self):
+        return self.embedding_function
+
+    @staticmethod
+    def quantize(vectors, dtype="float32"):
+        """
+        Normalize raw vectors and convert them to dtype. Return (vectors, per-row scales or None).
+        """
+        vectors = normalize_rows(vectors)
+        scales = None
+        if dtype == "int8":
+            scales = np.abs(vectors).max(axis=1) / 127.0
+            scales[scales == 0] = 1.0
+            vectors = np.round(vectors / scales[:, None]).astype(np.int8)
+            scales = scales.astype(np.float32)
+        else:
+            vectors = vectors.astype(DTYPES[dtype])
+        return vectors, scales
+
+    @classmethod
+    def build(cls, vectors, docs, ids, embedding_function=None, dtype="float32"):
+        """
+        Build the index from raw vectors, quantizing them to dtype.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32).reshape(len(docs), -1) if len(docs) else vectors
+        vectors, scales = cls.quantize(vectors, dtype)
+        return cls(vectors, list(docs), list(ids), embedding_function, scales)
+
+    @classmethod
+    def extend(cls, previous, docs, ids, new_vectors, embedding_function=None, dtype="float32"):
+        """
+        Build the index of docs / ids from a previous index and the raw vectors of the ids it lacks
+        (new_vectors, in the order of ids). Rows of the previous index are reused as stored, with their
+        int8 scales, unless it was built with another dtype.
+        """
+        if not ids:
+            return cls(np.zeros((0, 0), dtype=DTYPES[dtype]), [], [], embedding_function,
+                       np.zeros(0, dtype=np.float32) if dtype == "int8" else None)
+        if previous is not None and previous.vectors.dtype != DTYPES[dtype]:
+            stored = dict(zip(previous.ids, previous.get_vectors()))
+            new_vectors = iter(new_vectors)
+            return cls.build([stored[doc_id] if doc_id in stored else next(new_vectors) for doc_id in ids], docs, ids,
+                             embedding_function, dtype)
+        rows = {doc_id: row for row, doc_id in enumerate(previous.ids)} if previous is not None else {}
+        kept = [(position, rows[doc_id]) for position, doc_id in enumerate(ids) if doc_id in rows]
+        added = [position for position, doc_id in enumerate(ids) if doc_id not in rows]
+        if added:
+            new_rows, new_scales = cls.quantize(np.asarray(new_vectors, dtype=np.float32).reshape(len(added), -1), dtype)
+        dim = new_rows.shape[1] if added else previous.vectors.shape[1]
+        vectors = np.empty((len(ids), dim), dtype=DTYPES[dtype])
+        scales = np.empty(len(ids), dtype=np.float32) if dtype == "int8" else None
+        if kept:
+            positions, previous_rows = (np.array(column) for column in zip(*kept))
+            vectors[positions] = previous.vectors[previous_rows]
+            if scales is not None:
+                scales[positions] = previous.scales[previous_rows]
+        if added:
+            vectors[added] = new_rows
+            if scales is not None:
+                scales[added] = new_scales
+        return cls(vectors, list(docs), list(ids), embedding_function, scales)
+
+    @classmethod
+    def write(cls, directory, batches, count, dtype="float32"):
+        """
+        Write an index of count rows from (ids, docs, raw vectors) batches without holding it in memory:
+        rows go straight into a memory-mapped vectors.npy and documents into docs.jsonl.
+        The files are written next to the old ones and moved in place at the end.
+        """
+        os.makedirs(directory, exist_ok=True)
+        vectors_path = os.path.join(directory, "vectors.npy.tmp")
+        vectors = None
+        scales = np.ones(count, dtype=np.float32) if dtype == "int8" else None
+        row = 0
+        with open(os.path.join(directory, "docs.jsonl.tmp"), "w", encoding="utf-8") as f:
+            for ids, docs, batch_vectors in batches:
+                batch_vectors, batch_scales = cls.quantize(np.asarray(batch_vectors, dtype=np.float32), dtype)
+                if vectors is None:
+                    vectors = np.lib.format.open_memmap(vectors_path, mode="w+", dtype=DTYPES[dtype],
+                                                        shape=(count, batch_vectors.shape[1]))
+                vectors[row:row + len(ids)] = batch_vectors
+                if scales is not None:
+                    scales[row:row + len(ids)] = batch_scales
+                row += len(ids)
+                for doc_id, doc in zip(ids, docs):
+                    f.write(json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                                       ensure_ascii=False) + "\n")
+        if row != count:
+            raise ValueError(f"Numpy index: {row} rows written, {count} expected")
+        if vectors is None:
+            with open(vectors_path, "wb") as f:
+                np.save(f, np.zeros((0, 0), dtype=DTYPES[dtype]))
+        else:
+            vectors.flush()
+            del vectors
+        scales_path = os.path.join(directory, "scales.npy")
+        if scales is not None:
+            with open(f"{scales_path}.tmp", "wb") as f:
+                np.save(f, scales)
+            os.replace(f"{scales_path}.tmp", scales_path)
+        elif os.path.exists(scales_path):
+            os.remove(scales_path)
+        os.replace(vectors_path, os.path.join(directory, "vectors.npy"))
+        os.replace(os.path.join(directory, "docs.jsonl.tmp"), os.path.join(directory, "docs.jsonl"))
+
+    @classmethod
+    def from_texts(cls, texts, embedding, metadatas=None, ids=None, dtype="float32", **kwargs):
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(i) for i in range(len(texts))]
+        docs = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        return cls.build(embedding.embed_documents(list(texts)), docs, ids, embedding, dtype)
+
+    def add_texts(self, texts, metadatas=None, ids=None, **kwargs):
+        raise NotImplementedError("NumpyVectorIndex is rebuilt by embedding.py, it cannot be appended to")
+
+    def save(self, directory):
+        """
+        Write the index files into directory. Each file is written next to the old one and moved
+        in place, so readers memory-mapping the old file (or hard links to it) are not affected.
+        """
+        os.makedirs(directory, exist_ok=True)
+        vectors_path = os.path.join(directory, "vectors.npy")
+        with open(f"{vectors_path}.tmp", "wb") as f:
+            np.save(f, self.vectors)
+        scales_path = os.path.join(directory, "scales.npy")
+        if self.scales is not None:
+            with open(f"{scales_path}.tmp", "wb") as f:
+                np.save(f, self.scales)
+            os.replace(f"{scales_path}.tmp", scales_path)
+        elif os.path.exists(scales_path):
+            os.remove(scales_path)
+        os.replace(f"{vectors_path}.tmp", vectors_path)
+        docs_path = os.path.join(directory, "docs.jsonl")
+        with open(f"{docs_path}.tmp", "w", encoding="utf-8") as f:
+            for doc_id, doc in zip(self.ids, self.docs):
+                f.write(json.dumps({"id": doc_id, "page_content": doc.page_content, "metadata": doc.metadata},
+                                   ensure_ascii=False) + "\n")
+        os.replace(f"{docs_path}.tmp", docs_path)
+
+    @classmethod
+    def load(cls, directory, embedding_function=None, mmap=True):
+        """
+        Load an index written by save(); vectors are memory-mapped when mmap is True.
+        """
+        if not os.path.exists(os.path.join(directory, "vectors.npy")):
+            raise FileNotFoundError(f"Numpy index not found: {directory}")
+        vectors = np.load(os.path.join(directory, "vectors.npy"), mmap_mode="r" if mmap else None)
+        scales_path = os.path.join(directory, "scales.npy")
+        scales = np.load(scales_path) if os.path.exists(scales_path) else None
+        docs, ids = [], []
+        with open(os.path.join(directory, "docs.jsonl"), "r", encoding="utf-8") as f:
+            for line in f:
+                record = json.loads(line)
+                ids.append(record["id"])
+                docs.append(Document(page_content=record["page_content"], metadata=record["metadata"]))
+        return cls(vectors, docs, ids, embedding_function, scales)
+
+    def get_vectors(self, rows=None):
+        """
+        Return normalized float32 vectors for the given rows (all rows by default).
+        """
+        vectors = self.vectors if rows is None else self.vectors[rows]
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if self.scales is not None:
+            scales = self.scales if rows is None else self.scales[rows]
+            vectors = vectors * scales[:, None]
+        return vectors
+
+    def scores(self, vector):
+        """
+        Cosine similarity of the query vector with every row (one matrix product).
+        float16 / int8 rows are converted BLOCK_ROWS at a time, a query never copies the whole matrix.
+        """
+        if len(self.vectors) == 0:
+            return np.zeros(0, dtype=np.float32)
+        query = normalize_rows(vector)
+        if self.vectors.dtype == np.float32:
+            scores = np.asarray(self.vectors @ query, dtype=np.float32)
+        else:
+            scores = np.empty(len(self.vectors), dtype=np.float32)
+            for start in range(0, len(self.vectors), self.BLOCK_ROWS):
+                block = np.asarray(self.vectors[start:start + self.BLOCK_ROWS], dtype=np.float32)
+                scores[start:start + len(block)] = block @ query
+        if self.scales is not None:
+            scores *= self.scales
+        return scores
+
+    def _top_rows(self, vector, n):
+        scores = self.scores(vector)
+        n = min(n, len(scores))
+        if n <= 0:
+            return np.array([], dtype=int), scores
+        rows = np.argpartition(-scores, n - 1)[:n]
+        return rows[np.argsort(-scores[rows])], scores
+
+    def similarity_search_by_vector(self, embedding, k=4, **kwargs):
+        rows, _ = self._top_rows(embedding, k)
+        return [self.docs[row] for row in rows]
+
+    def similarity_search_with_score_by_vector(self, embedding, k=4):
+        rows, scores = self._top_rows(embedding, k)
+        return [(self.docs[row], float(scores[row])) for row in rows]
+
+    def similarity_search(self, query, k=4, **kwargs):
+        return self.similarity_search_by_vector(self.embedding_function.embed_query(query), k)
+
+    def similarity_search_with_score(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score_by_vector(self.embedding_function.embed_query(query), k)
+
+    def _similarity_search_with_relevance_scores(self, query, k=4, **kwargs):
+        return self.similarity_search_with_score(query, k)
+
+    def max_marginal_relevance_search_by_vector(self, embedding, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        rows, _ = self._top_rows(embedding, fetch_k)
+        selected = mmr_select(normalize_rows(embedding), self.get_vectors(rows), k, lambda_mult)
+        return [self.docs[rows[i]] for i in selected]
+
+    def max_marginal_relevance_search(self, query, k=4, fetch_k=20, lambda_mult=0.5, **kwargs):
+        return self.max_marginal_relevance_search_by_vector(
+            self.embedding_function.embed_query(query), k, fetch_k, lambda_mult
+        )